@@ -5,23 +5,41 @@ Module stores class dependencies for running alfredo
 from alfredo_lib import MAIN_CFG, USER_INPUT_SCHEMAS
 from alfredo_lib.controllers import validator
 from alfredo_lib.gateways import google_sheets_gateway
-from alfredo_lib.gateways.base import async_rps_limiter
-from alfredo_lib.local_persistence import cache
+from alfredo_lib.gateways.base import async_rps_limiter, hierarchical_limiter
+from alfredo_lib.local_persistence import async_cache, cache
 
 # Start with classes as further steps might be dependent on them
 local_cache = cache.Cache(MAIN_CFG["cache_path"]) # Referred by main & logging
+# Cogs talk to the db through this one to keep sqlite off the event loop
+async_local_cache = async_cache.AsyncCache(
+    local_cache=local_cache, workers=MAIN_CFG["cache_executor_workers"]
+)
 input_controller = validator.InputController(input_schemas=USER_INPUT_SCHEMAS)
 # Gsheet-related things
-read_limiter = async_rps_limiter.AsyncLimiter(
-    **MAIN_CFG["google_sheets"]["rps"]["read"]
+read_limiter = hierarchical_limiter.HierarchicalLimiter(
+    global_limiter=async_rps_limiter.AsyncLimiter(
+        **MAIN_CFG["google_sheets"]["rps"]["read"]
+    ),
+    **MAIN_CFG["google_sheets"]["fair_share"]["read"]
 )
-write_limiter = async_rps_limiter.AsyncLimiter(
-    **MAIN_CFG["google_sheets"]["rps"]["read"]
+write_limiter = hierarchical_limiter.HierarchicalLimiter(
+    global_limiter=async_rps_limiter.AsyncLimiter(
+        **MAIN_CFG["google_sheets"]["rps"]["write"]
+    ),
+    **MAIN_CFG["google_sheets"]["fair_share"]["write"]
 )
 sheets = google_sheets_gateway.GoogleSheetAsyncGateway(
     service_acc_path=MAIN_CFG["google_sheets"]["service_file"],
     read_rps_limiter=read_limiter,
-    write_rps_limter=write_limiter
+    write_rps_limter=write_limiter,
+    **MAIN_CFG["google_sheets"]["row_count_cache"],
+    **MAIN_CFG["google_sheets"]["metadata_cache"],
+    **MAIN_CFG["google_sheets"]["http_session"],
+    **MAIN_CFG["google_sheets"]["append_coalescing"],
+    **MAIN_CFG["google_sheets"]["reads"],
+    **MAIN_CFG["google_sheets"]["pastes"],
+    **MAIN_CFG["google_sheets"]["discovery_cache"],
+    request_weights=MAIN_CFG["google_sheets"]["request_weights"]
 )
 # Get our loggers
 # bot_logger = logging.getLogger(MAIN_CFG["main_logger_name"])
@@ -4,16 +4,19 @@ Module implements custom logging classes for the project
 
 import logging
 import queue
+import threading
+import time
 from atexit import register
 from logging import LogRecord
 from logging.config import ConvertingList
 from logging.handlers import (
+    BufferingHandler,
     QueueHandler,
     QueueListener,
     TimedRotatingFileHandler,
 )
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, List, Optional
 
 from requests import RequestException, session
 from retry import retry
@@ -278,22 +281,72 @@ class DiscordHandler(logging.Handler):
         self._log_to_discord(record)
             
 
-class DbHandler(logging.Handler):
+class DbHandler(BufferingHandler):
     """
-    Handles writing log records to a local sqlite db
+    ### Handles writing log records to a local sqlite db in batches.
+    Records are flushed with a single insert once capacity is reached
+    or flush_interval seconds passed, whichever comes first.
+    Remaining records are flushed on close() which logging calls at exit.
     """
-    def __init__(self, cache_instance: Cache):
+    def __init__(self, cache_instance: Cache, capacity: Optional[int] = None,
+                 flush_interval: Optional[float] = None):
         """
         Stores an instance of Cahce within self. This instance interacts with the db.
+        :param capacity: max number of buffered records, 100 by default
+        :param flush_interval: max seconds a record waits in buffer, 5 by default
         """
-        super().__init__()
+        capacity = capacity or 100
+        flush_interval = flush_interval or 5
+        super().__init__(capacity=capacity)
         self.__cache_instance = cache_instance
+        self.flush_interval = flush_interval
+        self._last_flush = time.monotonic()
+        # Flushes quiet periods when no emit() would trigger shouldFlush()
+        self._stop_event = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_periodically,
+                                         name="db_log_flusher", daemon=True)
+        self._flusher.start()
 
-    def emit(self, record: LogRecord):
+    def _flush_periodically(self):
+        """
+        ### Background loop flushing the buffer every flush_interval
+        """
+        while not self._stop_event.wait(self.flush_interval):
+            self.flush()
+
+    def shouldFlush(self, record: LogRecord) -> bool:
+        """
+        ### Checks buffer size & age to decide if it needs flushing
+        :param record: LogRecord that has just been buffered
+        """
+        return (
+            len(self.buffer) >= self.capacity
+            or (time.monotonic() - self._last_flush) >= self.flush_interval
+        )
+
+    def flush(self):
+        """
+        ### Writes buffered records to db in one batch
+        """
+        # Swapping the buffer under lock, db write happens outside of it
+        self.acquire()
+        try:
+            records, self.buffer = self.buffer, []
+            self._last_flush = time.monotonic()
+        finally:
+            self.release()
+        if not records:
+            return
+        e = self.__cache_instance.add_log_rows(records)
+        if e is not None:
+            backup_logger.error("Dropped %s log records: %s", len(records), e)
+
+    def close(self):
         """
-        Performs logging to db
+        ### Stops the background flusher and flushes what is left
         """
-        self.__cache_instance.add_log_row(record)
+        self._stop_event.set()
+        super().close()
 
 
 class BackupFileHandler(TimedRotatingFileHandler):
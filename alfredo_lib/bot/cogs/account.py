@@ -7,7 +7,12 @@ from typing import Optional
 from discord.ext import commands
 
 from alfredo_lib import COMMANDS_METADATA, MAIN_CFG
-from alfredo_lib.alfredo_deps import cache, google_sheets_gateway, validator
+from alfredo_lib.alfredo_deps import (
+    async_cache,
+    cache,
+    google_sheets_gateway,
+    validator,
+)
 from alfredo_lib.bot import ex
 from alfredo_lib.bot.cogs.base import base_cog
 
@@ -18,12 +23,14 @@ class AccountCog(base_cog.CogHelper, name=MAIN_CFG["cog_names"]["account"]):
 
     def __init__(self, bot: commands.Bot,
                  local_cache: cache.Cache,
+                 async_local_cache: async_cache.AsyncCache,
                  input_controller: validator.InputController,
                  sheets: google_sheets_gateway.GoogleSheetAsyncGateway):
         """
         Instantiates account cog
         """
         super().__init__(bot=bot, local_cache=local_cache,
+                         async_local_cache=async_local_cache,
                          input_controller=input_controller,
                          sheets=sheets)
 
@@ -32,7 +39,7 @@ class AccountCog(base_cog.CogHelper, name=MAIN_CFG["cog_names"]["account"]):
         Actual register implementation
         """
         command = COMMANDS_METADATA["register"]["name"]
-        _, e = self.lc.get_user(discord_id=ctx.author.id)
+        _, e = await self.alc.get_user(discord_id=ctx.author.id)
         if e is None:
             await ctx.message.author.send("You are already registered")
             return
@@ -48,7 +55,7 @@ class AccountCog(base_cog.CogHelper, name=MAIN_CFG["cog_names"]["account"]):
             return
         await ctx.message.author.send(f"All fields are present. Running {command}.")
 
-        user_msg, e = self.lc.create_user(reg_data)
+        user_msg, e = await self.alc.create_user(reg_data)
         username = reg_data["username"]
         if e is not None:
             await ctx.message.author.send(
@@ -72,13 +79,16 @@ class AccountCog(base_cog.CogHelper, name=MAIN_CFG["cog_names"]["account"]):
         """
         bot_logger.debug("User %s invoked %s command",
                          ctx.author.id, COMMANDS_METADATA["prepare_sheet"]["name"])
-        user_data, user_msg = self.lc.get_user(discord_id=ctx.author.id)
+        user_data, user_msg = await self.alc.get_user(
+            discord_id=ctx.author.id
+        )
         if user_msg is not None:
             raise ex.UserNotRegisteredError(user_msg)
         sheet_id = user_data.spreadsheet
         bot_logger.debug("Preparing sheet %s for user %s",
                          sheet_id, ctx.author.id)
-        e = await self._format_sheet(sheet_id=sheet_id)
+        e = await self._format_sheet(sheet_id=sheet_id,
+                                     discord_id=ctx.author.id)
         # Quick check for success to avoid indenting code
         if e is None:
             await ctx.message.author.send("Sheet preparation - ok!")
@@ -103,7 +113,7 @@ class AccountCog(base_cog.CogHelper, name=MAIN_CFG["cog_names"]["account"]):
         """
         bot_logger.debug("User %s invoked %s command",
                          ctx.author.id, COMMANDS_METADATA["whoami"]["name"])
-        user_data, user_msg = self.lc.get_user(
+        user_data, user_msg = await self.alc.get_user(
             discord_id=ctx.author.id, parse_mode=cache.ROW_PARSE_MODE_STRING
         )
         if user_msg is not None:
@@ -129,7 +139,7 @@ class AccountCog(base_cog.CogHelper, name=MAIN_CFG["cog_names"]["account"]):
         # TODO this function is too long
         # TODO can we re-use the user object returned from local_cache.get_user?
         # Check for user's eligiblity to edit this
-        _, e = self.lc.get_user(discord_id=ctx.author.id)
+        _, e = await self.alc.get_user(discord_id=ctx.author.id)
         if e is not None:
             raise ex.UserNotRegisteredError(e)
         # Check if users are expected to update this field  
@@ -163,8 +173,8 @@ class AccountCog(base_cog.CogHelper, name=MAIN_CFG["cog_names"]["account"]):
                 return
         # Attempt an update
         bot_logger.debug("Attempting update on user %s db data", ctx.author.id)
-        e = self.lc.update_user_data(discord_id=ctx.author.id,
-                                     user_update=user_update)
+        e = await self.alc.update_user_data(discord_id=ctx.author.id,
+                                            user_update=user_update)
         # Log on results
         if e is not None:
             bot_logger.error("Update for user %s failed, %s", ctx.author.id, e)
@@ -10,8 +10,14 @@ import polars as pl
 from discord.ext import commands
 
 from alfredo_lib import MAIN_CFG
-from alfredo_lib.alfredo_deps import cache, google_sheets_gateway, validator
+from alfredo_lib.alfredo_deps import (
+    async_cache,
+    cache,
+    google_sheets_gateway,
+    validator,
+)
 from alfredo_lib.bot import ex
+from alfredo_lib.gateways.base import hierarchical_limiter
 
 bot_logger = logging.getLogger(MAIN_CFG["main_logger_name"])
 
@@ -21,6 +27,7 @@ class CogHelper(commands.Cog):
     #TODO objects in this init should be singletons instead
     def __init__(self, bot: commands.Bot,
                  local_cache: cache.Cache,
+                 async_local_cache: async_cache.AsyncCache,
                  input_controller: validator.InputController,
                  sheets: google_sheets_gateway.GoogleSheetAsyncGateway):
         """
@@ -28,6 +35,8 @@ class CogHelper(commands.Cog):
         """
         self.bot = bot
         self.lc = local_cache
+        # Awaitable db calls, preferred inside commands
+        self.alc = async_local_cache
         self.ic = input_controller
         self.sheets = sheets
 
@@ -151,16 +160,25 @@ class CogHelper(commands.Cog):
         bot_logger.debug("Collected data for command %s: %s", command, res)
         return res
     
-    async def _format_sheet(self, sheet_id: str) -> Union[None, Exception]:
+    async def _format_sheet(self, sheet_id: str,
+                            discord_id: Optional[int] = None
+                            ) -> Union[None, Exception]:
         """
         Prepares spreadsheet where transactions will be appended
+        :param discord_id: user the sheet is prepared for, used for
+            rate limiting Google requests per user
         """
-        # Get sheet data
-        sp, e = await self.sheets.get_sheet_properties(sheet_id=sheet_id)
+        # Sheet maintenance, user facing requests go first
+        req_ctx = hierarchical_limiter.RequestContext(
+            sheet_id=sheet_id, user_id=discord_id,
+            priority=hierarchical_limiter.BACKGROUND_PRIORITY
+        )
+        # Get tab data, cached by the gateway
+        sheet_data, e = await self.sheets.get_tab_properties(sheet_id=sheet_id,
+                                                             ctx=req_ctx)
         if e is not None:
             bot_logger.error("Error fetching sheet properties: %s", e)
-        # Check if tab is there
-        sheet_data = self.sheets.parse_raw_properties(sheet_properties=sp)
+            return e
         tab_name = MAIN_CFG["google_sheets"]["transaction_tab"]["name"]
         tab_schema = MAIN_CFG["google_sheets"]["transaction_tab"]["schema"]
         hdr_index = MAIN_CFG["google_sheets"]["hdr_index"]
@@ -170,7 +188,7 @@ class CogHelper(commands.Cog):
             bot_logger.debug("%s sheet does not have %s tab",
                              sheet_id, tab_name)
             _, e = await self.sheets.add_sheet(sheet_id=sheet_id,
-                                               title=tab_name)
+                                               title=tab_name, ctx=req_ctx)
             if e is not None:
                 return e
             bot_logger.debug("Added %s tab", tab_name)
@@ -179,20 +197,21 @@ class CogHelper(commands.Cog):
             _, e = await self.sheets.paste_data(sheet_id=sheet_id,
                                                 tab_name=tab_name,
                                                 start_row=hdr_index,
-                                                data=df, include_header=False)
+                                                data=df, include_header=False,
+                                                ctx=req_ctx)
             if e is not None:
                 return e
             bot_logger.debug("Added %s row to the tab", df)
             return
-        # Check if header matches schema
-        sheet_df, e = await self.sheets.read_sheet(sheet_id=sheet_id,
-                                                   tab_name=tab_name,
-                                                   header_rownum=hdr_index,
-                                                   as_df=True)
+        # Check if header matches schema, only the header row is needed
+        sheet_rows, e = await self.sheets.read_sheet(sheet_id=sheet_id,
+                                                     tab_name=tab_name,
+                                                     header_rownum=hdr_index,
+                                                     header_only=True,
+                                                     ctx=req_ctx)
         if e is not None:
             return e
-        bot_logger.debug("Fetched %s data from the sheet", sheet_df)
-        sheet_header = list(sheet_df.columns)
+        sheet_header = list(sheet_rows[0])
         bot_logger.debug("Sheet header: %s, needed row: %s",
                          sheet_header, header_row)
         if sorted(sheet_header) != sorted(header_row):
@@ -6,7 +6,12 @@ import logging
 from discord.ext import commands
 
 from alfredo_lib import ADMINS, COMMANDS_METADATA, MAIN_CFG
-from alfredo_lib.alfredo_deps import cache, google_sheets_gateway, validator
+from alfredo_lib.alfredo_deps import (
+    async_cache,
+    cache,
+    google_sheets_gateway,
+    validator,
+)
 from alfredo_lib.bot import ex
 from alfredo_lib.bot.cogs.base import base_cog, helpers
 
@@ -18,12 +23,14 @@ class CategoryCog(base_cog.CogHelper, name="category"):
 
     def __init__(self, bot: commands.Bot,
                  local_cache: cache.Cache,
+                 async_local_cache: async_cache.AsyncCache,
                  input_controller: validator.InputController,
                  sheets: google_sheets_gateway.GoogleSheetAsyncGateway):
         """
         Instantiates the class
         """
         super().__init__(bot=bot, local_cache=local_cache,
+                         async_local_cache=async_local_cache,
                          input_controller=input_controller,
                          sheets=sheets)
 
@@ -33,7 +40,7 @@ class CategoryCog(base_cog.CogHelper, name="category"):
         Fetches available categories to show to the user
         """
         bot_logger.debug("Command invoked")
-        categories, e = self.lc.get_categories(
+        categories, e = await self.alc.get_categories(
             parse_mode=cache.ROW_PARSE_MODE_STRING
         )
         if e is not None:
@@ -57,7 +64,7 @@ class CategoryCog(base_cog.CogHelper, name="category"):
             include_extra=False
         )
         bot_logger.debug("Transaction data prepared: %s", category_data)
-        msg, e = self.lc.create_category(category_data=category_data)
+        msg, e = await self.alc.create_category(category_data=category_data)
         if e is not None:
             bot_logger.error("create_category() failed: %s", e)
         await ctx.author.send(msg)
@@ -78,7 +85,8 @@ class CategoryCog(base_cog.CogHelper, name="category"):
             )
         #TODO not doing data validation till we pass MVP stage of the project
         update = {field: data}
-        e = self.lc.update_category(category_id=category_id, update=update)
+        e = await self.alc.update_category(category_id=category_id,
+                                           update=update)
         if e is not None:
             msg = f"DB Data update failed for category: {e}"
             bot_logger.error(msg)
@@ -92,13 +100,13 @@ class CategoryCog(base_cog.CogHelper, name="category"):
         Deletes category with the given id
         """
         bot_logger.debug("Command invoked")
-        category = self.lc._fetch_category(category_id=category_id)
+        category = await self.alc.fetch_category(category_id=category_id)
         if category is None:
             await ctx.author.send(
                 f"Category with {category_id} does not exist!"
             )
             return
-        e = self.lc.delete_row(row_struct=category)
+        e = await self.alc.delete_category(category=category)
         if e is not None:
             msg = f"Error deleting category row: {e}"
             bot_logger.error(msg)
@@ -9,8 +9,13 @@ from discord.ext import commands
 from sqlalchemy import engine
 
 from alfredo_lib import COMMANDS_METADATA, MAIN_CFG
-from alfredo_lib.alfredo_deps import cache, google_sheets_gateway, validator
-from alfredo_lib.bot import buttons, ex
+from alfredo_lib.alfredo_deps import (
+    async_cache,
+    cache,
+    google_sheets_gateway,
+    validator,
+)
+from alfredo_lib.bot import buttons, ex, outbox
 from alfredo_lib.bot.cogs.base import base_cog
 from alfredo_lib.local_persistence import models
 
@@ -21,14 +26,18 @@ class TransactionCog(base_cog.CogHelper, name="transaction"):
 
     def __init__(self, bot: commands.Bot,
                  local_cache: cache.Cache,
+                 async_local_cache: async_cache.AsyncCache,
                  input_controller: validator.InputController,
-                 sheets: google_sheets_gateway.GoogleSheetAsyncGateway):
+                 sheets: google_sheets_gateway.GoogleSheetAsyncGateway,
+                 outbox_worker: outbox.SheetOutboxWorker):
         """
         Instantiates the class
         """
         super().__init__(bot=bot, local_cache=local_cache,
+                         async_local_cache=async_local_cache,
                          input_controller=input_controller,
                          sheets=sheets)
+        self.outbox_worker = outbox_worker
 
     async def _get_transaction(self, ctx: commands.Context):
         """
@@ -36,11 +45,11 @@ class TransactionCog(base_cog.CogHelper, name="transaction"):
         """
         bot_logger.debug("Command invoked")
         # Check if caller discord id is in db
-        user, e = self.lc.get_user(discord_id=ctx.author.id)
+        user, e = await self.alc.get_user(discord_id=ctx.author.id)
         if e is not None:
             raise ex.UserNotRegisteredError(str(e))
         try:
-            transaction = self.lc.get_user_transactions(
+            transaction = await self.alc.get_user_transactions(
                 user=user, parse_mode=cache.ROW_PARSE_MODE_STRING
             )
         except Exception as e:
@@ -75,16 +84,17 @@ class TransactionCog(base_cog.CogHelper, name="transaction"):
             await asyncio.sleep(1)
     
     @staticmethod
-    def _category_data_to_category_view(categories: dict,
+    def _category_data_to_category_view(category_buttons: list,
                                         ctx: commands.Context,
                                         data_container: dict) -> buttons.TransactionCategoryView:
         view = buttons.TransactionCategoryView(timeout=MAIN_CFG["input_prompt_timeout"],
                                                ctx=ctx)
         bot_logger.debug("Instantiated view")
-        for cat_id, cat_name in categories.items():
+        # Labels are precomputed by the category registry of the cache
+        for label, cat_id in category_buttons:
             view.add_item(
                 buttons.TransactionButton(
-                    label=cat_name,
+                    label=label,
                     category_id=cat_id,
                     data_container=data_container
                 )
@@ -92,13 +102,16 @@ class TransactionCog(base_cog.CogHelper, name="transaction"):
         bot_logger.debug("Added view buttons")
         return view
     
-    async def _collect_category_id(self, ctx: commands.Context, categories: dict,
+    async def _collect_category_id(self, ctx: commands.Context,
+                                   category_buttons: list,
                                    data_container: dict):
         """
         Shows categories as buttons for users to select
         """
-        view = self._category_data_to_category_view(categories=categories, ctx=ctx,
-                                                    data_container=data_container)
+        view = self._category_data_to_category_view(
+            category_buttons=category_buttons, ctx=ctx,
+            data_container=data_container
+        )
         await ctx.message.author.send("Choose category", view=view)
         await self.__poll_on_view_id_input(view=view, data_container=data_container)
     
@@ -107,16 +120,15 @@ class TransactionCog(base_cog.CogHelper, name="transaction"):
         """
         ### Creates a new transaction from scratch my prompting user for data
         """
-        categories, e = self.lc.get_categories(
-            parse_mode=cache.ROW_PARSE_MODE_DICT
-        )
+        category_buttons, e = await self.alc.get_category_buttons()
         if e is not None:
             await ctx.author.send(
                 f"Can't create transaction. No categories data in db: {e}"
             )
             return
         transaction = {}
-        await self._collect_category_id(ctx=ctx, categories=categories,
+        await self._collect_category_id(ctx=ctx,
+                                        category_buttons=category_buttons,
                                         data_container=transaction)
         tr_data = await self.get_input(
             ctx=ctx, command=command, model="transaction",
@@ -128,7 +140,7 @@ class TransactionCog(base_cog.CogHelper, name="transaction"):
         tr_data["currency"] = user.currency
         bot_logger.debug("Transaction data prepared %s", tr_data)
         # Write to db
-        msg, e = self.lc.create_transaction(tr_data)
+        msg, e = await self.alc.create_transaction(tr_data)
         if e is not None:
             bot_logger.error("new_transaction() failed: %s", e)
         await ctx.author.send(msg)
@@ -140,10 +152,10 @@ class TransactionCog(base_cog.CogHelper, name="transaction"):
         bot_logger.debug("Command invoked")
         command = "new_transaction"
         # Check if caller discord id is in db
-        user, e = self.lc.get_user(discord_id=ctx.author.id)
+        user, e = await self.alc.get_user(discord_id=ctx.author.id)
         if e is not None:
             raise ex.UserNotRegisteredError(str(e))
-        transaction = self.lc.get_user_transactions(
+        transaction = await self.alc.get_user_transactions(
             user=user, parse_mode=cache.ROW_PARSE_MODE_STRING
         )
         bot_logger.debug("Fetched user transaction")
@@ -168,22 +180,18 @@ class TransactionCog(base_cog.CogHelper, name="transaction"):
         """
         bot_logger.debug("Command invoked")
         # Check if caller discord id is in db
-        user, e = self.lc.get_user(discord_id=ctx.author.id)
+        user, e = await self.alc.get_user(discord_id=ctx.author.id)
         if e is not None:
             raise ex.UserNotRegisteredError(str(e))
         # Get transaction as ORM obj
-        transaction = self.lc.get_user_transactions(user=user)
+        transaction = await self.alc.get_user_transactions(user=user)
         if not transaction:
             await ctx.author.send("No transactions located, can't delete")
             return
         # Delete transaction using cache class methods
-        # TODO this is hacky, refactor
-        tr_row = (
-            self.lc.sesh.query(models.Transaction)
-            .filter(models.Transaction.transaction_id==transaction._asdict()["transaction_id"])
-            .first()
+        e = await self.alc.delete_transaction(
+            transaction_id=transaction.transaction_id
         )
-        e = self.lc.delete_row(tr_row)
         if e is not None:
             msg = f"Error deleting transaction row: {e}"
             bot_logger.error(msg)
@@ -210,7 +218,7 @@ class TransactionCog(base_cog.CogHelper, name="transaction"):
         """
         bot_logger.debug("Command invoked")
         # Check if caller discord id is in db
-        user, e = self.lc.get_user(discord_id=ctx.author.id)
+        user, e = await self.alc.get_user(discord_id=ctx.author.id)
         if e is not None:
             raise ex.UserNotRegisteredError(str(e))
         # Check if field is valid
@@ -229,14 +237,14 @@ class TransactionCog(base_cog.CogHelper, name="transaction"):
             await ctx.author.send(f"{data} is not valid for {field}: {e}")
             return
         # Fetch transation that to apply updates to
-        transaction = self.lc.get_user_transactions(user=user)
+        transaction = await self.alc.get_user_transactions(user=user)
         if not transaction:
             # TODO Generic handling?
             await ctx.author.send("No transactions located, can't update")
             return
         # Call cache method to update transation
-        e = self.lc.update_transaction(update={field: data},
-                                       transaction=transaction)
+        e = await self.alc.update_transaction(update={field: data},
+                                              transaction=transaction)
         if e is not None:
             msg = f"DB Data update failed for transaction: {e}"
             bot_logger.error(msg)
@@ -267,10 +275,10 @@ class TransactionCog(base_cog.CogHelper, name="transaction"):
         Implements transaction_to_sheet
         """
         bot_logger.debug("Command invoked")
-        user, e = self.lc.get_user(discord_id=ctx.author.id)
+        user, e = await self.alc.get_user(discord_id=ctx.author.id)
         if e is not None:
             raise ex.UserNotRegisteredError(str(e))
-        transaction = self.lc.get_user_transactions(user=user)
+        transaction = await self.alc.get_user_transactions(user=user)
         if not transaction:
             await ctx.author.send("No transactions located, can't send to sheet")
             return
@@ -287,24 +295,25 @@ class TransactionCog(base_cog.CogHelper, name="transaction"):
             return
         
         bot_logger.debug("DF to paste to sheet: %s", df)
-        _, e = await self.sheets.append_data_native(
-            sheet_id=user.spreadsheet, data=df,
-            tab_name=MAIN_CFG["google_sheets"]["transaction_tab"]["name"],
-            row_limit=MAIN_CFG["google_sheets"]["transaction_tab"]["row_limit"]
+        # Sheet append happens in the outbox worker, it notifies the user
+        user_msg, e = await self.alc.enqueue_transaction_to_sheet(
+            transaction_id=transaction.transaction_id,
+            outbox_data={
+                "user_id": user.user_id,
+                "discord_id": ctx.author.id,
+                "spreadsheet": user.spreadsheet,
+                "tab_name": MAIN_CFG["google_sheets"]["transaction_tab"]["name"],
+                "payload": outbox.df_to_outbox_payload(df)
+            }
         )
         if e is not None:
-            msg = f"Error appending to the sheet. Please retry the command: {e}"
-            bot_logger.error(msg)
-            return
-        e = self.lc.delete_row(user.transactions[0])
-        
-        if e is not None:
-            msg = f"Error deleting transaction row: {e}. Please delete manually by calling delete command."
-            bot_logger.error(msg)
-            await ctx.author.send(msg)
+            bot_logger.error("Queueing transaction for the sheet failed: %s", e)
+            await ctx.author.send(f"{user_msg}. Please retry the command: {e}")
             return
-        
-        await ctx.author.send("Transaction pasted to the sheet!")
+        self.outbox_worker.wake()
+        await ctx.author.send(
+            f"{user_msg}. I will message you once it is in the sheet."
+        )
     
     @commands.command(name=COMMANDS_METADATA["transaction_to_sheet"]["name"],
                       aliases=COMMANDS_METADATA["transaction_to_sheet"]["aliases"],
@@ -0,0 +1,244 @@
+"""
+Module implements a background worker sending outbox items to spreadsheets
+"""
+import asyncio
+import json
+import logging
+import time
+from typing import Optional, Union
+
+import polars as pl
+from discord.ext import commands
+
+from alfredo_lib import MAIN_CFG
+from alfredo_lib.alfredo_deps import async_cache, google_sheets_gateway
+from alfredo_lib.gateways.base import hierarchical_limiter
+from alfredo_lib.local_persistence import cache, models
+
+bot_logger = logging.getLogger(MAIN_CFG["main_logger_name"])
+
+
+def df_to_outbox_payload(df: pl.DataFrame) -> str:
+    """
+    Mapper converting a df to a JSON payload stored in the outbox
+    """
+    return json.dumps({"columns": df.columns, "rows": df.rows()})
+
+
+def outbox_payload_to_df(payload: str) -> pl.DataFrame:
+    """
+    Mapper converting an outbox JSON payload back to a df
+    """
+    data = json.loads(payload)
+    return pl.DataFrame(data=data["rows"], schema=data["columns"],
+                        orient="row")
+
+
+class SheetOutboxWorker:
+    """
+    ### Drains the sheet outbox in the background.
+    Commands only write to the outbox & return, this worker does the
+    Google calls, retries failures with a growing delay and tells users
+    about the outcome. Items survive restarts because they live in the db.
+    """
+    def __init__(self, bot: commands.Bot,
+                 async_local_cache: async_cache.AsyncCache,
+                 sheets: google_sheets_gateway.GoogleSheetAsyncGateway,
+                 poll_interval: Optional[float] = None,
+                 batch_size: Optional[int] = None,
+                 max_attempts: Optional[int] = None,
+                 retry_delay: Optional[float] = None,
+                 max_retry_delay: Optional[float] = None,
+                 send_timeout: Optional[float] = None):
+        """
+        Instantiates the worker
+        :param poll_interval: seconds between outbox scans when idle
+        :param batch_size: max number of items sent concurrently
+        :param max_attempts: attempts after which an item is marked failed
+        :param retry_delay: seconds before the first retry, doubled after
+        :param max_retry_delay: upper bound of the delay between retries
+        :param send_timeout: seconds an item is held before its append,
+            it is picked up again after that if its outcome isn't recorded
+        """
+        self.bot = bot
+        self.alc = async_local_cache
+        self.sheets = sheets
+        self.poll_interval = poll_interval or 10
+        self.batch_size = batch_size or 20
+        self.max_attempts = max_attempts or 8
+        self.retry_delay = retry_delay or 5
+        self.max_retry_delay = max_retry_delay or 600
+        self.send_timeout = send_timeout or 300
+        self._wakeup = None
+        self._task = None
+
+    @property
+    def is_running(self) -> bool:
+        """
+        True when the worker loop is active
+        """
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        """
+        Starts the worker loop, no-op if it is already running
+        """
+        if self.is_running:
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        bot_logger.debug("Started sheet outbox worker")
+
+    async def stop(self):
+        """
+        Stops the worker loop, pending items stay in the outbox
+        """
+        if not self.is_running:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        bot_logger.debug("Stopped sheet outbox worker")
+
+    def wake(self):
+        """
+        Makes the worker scan the outbox now instead of after poll_interval
+        """
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        """
+        ### Worker loop: sends due items, sleeps when there is nothing to do
+        Also sleeps when outcomes could not be written to the db,
+        scanning again right away would only hit the same db errors.
+        """
+        while True:
+            try:
+                items = await self.alc.get_due_outbox_items(
+                    limit=self.batch_size
+                )
+                if items:
+                    errors = await asyncio.gather(
+                        *(self._process_item(item) for item in items)
+                    )
+                    errors = [e for e in errors if e is not None]
+                    if not errors:
+                        # There may be more due items, not sleeping
+                        continue
+                    bot_logger.error("%s outbox items not updated in db, "
+                                     "next scan in %ss: %s", len(errors),
+                                     self.poll_interval, errors[0])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                bot_logger.error("Sheet outbox worker iteration failed: %s", e)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(),
+                                       timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _process_item(
+            self, item: models.SheetOutboxItem
+        ) -> Union[Exception, None]:
+        """
+        ### Appends one outbox item to its sheet and records the outcome
+        Item is held for send_timeout before the append, so it is not
+        sent twice while in flight or when its outcome can't be saved.
+        :return: db error if the item could not be held or updated
+        """
+        bot_logger.debug("Sending outbox item %s to sheet %s",
+                         item.outbox_id, item.spreadsheet)
+        try:
+            df = outbox_payload_to_df(item.payload)
+        except Exception as e:
+            # Malformed payload will never succeed, not retrying it
+            return await self._fail_item(item=item,
+                                         attempts=item.attempts + 1, e=e)
+        e = await self.alc.update_outbox_item(
+            outbox_id=item.outbox_id,
+            update={"next_attempt_at": self._ts_in(seconds=self.send_timeout)}
+        )
+        if e is not None:
+            bot_logger.error("Outbox item %s not held, not sending it: %s",
+                             item.outbox_id, e)
+            return e
+        # Fresh items are what users wait for, retries can wait longer
+        priority = hierarchical_limiter.INTERACTIVE_PRIORITY
+        if item.attempts > 0:
+            priority = hierarchical_limiter.BACKGROUND_PRIORITY
+        # Items going to the same tab end up in one append request
+        _, e = await self.sheets.append_data_coalesced(
+            sheet_id=item.spreadsheet, tab_name=item.tab_name, data=df,
+            row_limit=MAIN_CFG["google_sheets"]["transaction_tab"]["row_limit"],
+            low_watermark=MAIN_CFG["google_sheets"]["transaction_tab"]["trim_low_watermark"],  # noqa: E501
+            ctx=hierarchical_limiter.RequestContext(user_id=item.discord_id,
+                                                    priority=priority)
+        )
+        if e is None:
+            e = await self.alc.delete_outbox_item(outbox_id=item.outbox_id)
+            if e is not None:
+                bot_logger.error("Outbox item %s sent but not deleted, "
+                                 "sent again in %ss: %s", item.outbox_id,
+                                 self.send_timeout, e)
+            await self._notify(discord_id=item.discord_id,
+                               msg="Transaction pasted to the sheet!")
+            return e
+        attempts = item.attempts + 1
+        if attempts >= self.max_attempts:
+            return await self._fail_item(item=item, attempts=attempts, e=e)
+        delay = min(self.retry_delay * 2 ** (attempts - 1),
+                    self.max_retry_delay)
+        bot_logger.warning("Outbox item %s failed attempt %s, retry in %ss: %s",
+                           item.outbox_id, attempts, delay, e)
+        return await self.alc.update_outbox_item(
+            outbox_id=item.outbox_id,
+            update={
+                "attempts": attempts,
+                "next_attempt_at": self._ts_in(seconds=delay),
+                "last_error": str(e)[:300]
+            }
+        )
+
+    async def _fail_item(self, item: models.SheetOutboxItem, attempts: int,
+                         e: Exception) -> Union[Exception, None]:
+        """
+        Marks an item as failed for good and lets its user know
+        :return: db error if the item could not be updated
+        """
+        bot_logger.error("Outbox item %s failed after %s attempts: %s",
+                         item.outbox_id, attempts, e)
+        db_e = await self.alc.update_outbox_item(
+            outbox_id=item.outbox_id,
+            update={"attempts": attempts,
+                    "status": cache.OUTBOX_STATUS_FAILED,
+                    "last_error": str(e)[:300]}
+        )
+        await self._notify(
+            discord_id=item.discord_id,
+            msg=f"Could not paste transaction to the sheet: {e}. Admin contact needed."  # noqa: E501
+        )
+        return db_e
+
+    @staticmethod
+    def _ts_in(seconds: float) -> int:
+        """
+        Unix ms timestamp seconds from now, format of next_attempt_at
+        """
+        return int((time.time() + seconds) * 1000)
+
+    async def _notify(self, discord_id: int, msg: str):
+        """
+        Sends a DM to the user, failures are only logged
+        """
+        try:
+            user = self.bot.get_user(discord_id)
+            if user is None:
+                user = await self.bot.fetch_user(discord_id)
+            await user.send(msg)
+        except Exception as e:
+            bot_logger.error("Failed to notify %s: %s", discord_id, e)
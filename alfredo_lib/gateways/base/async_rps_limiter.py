@@ -8,19 +8,49 @@ from typing import Optional
 
 class AsyncLimiter:
     """
-    Async RPS limiter meant to be used as a context manager
-    Usage:  limiter = AsyncLimiter(RPS, # of concurrent requests)
+    ### Async token bucket RPS limiter meant to be used as a context manager
+    Usage:  limiter = AsyncLimiter(RPS, # of concurrent requests, burst)
             async with limiter:
                 # make request here.
-    Actual RPS will be slightly lower than the theoretical RPS.
+            async with limiter.weighted(3):
+                # make a request costing 3 tokens here.
+    Bucket holds up to burst tokens and refills at rps tokens per second,
+    so idle limiters let a burst through at once while sustained
+    throughput stays at rps. Callers reserve tokens on entry & wait for
+    the reservation to mature, cancelled waiters get their tokens back.
+    Rate adapts to throttling when min_rps & max_rps are given: successes
+    add rps_step to it, throttled requests multiply it by backoff_factor.
     """
-    def __init__(self, rps: float, concurrent_requests: Optional[int] = None):
+    def __init__(self, rps: float, concurrent_requests: Optional[int] = None,
+                 burst: Optional[float] = None,
+                 min_rps: Optional[float] = None,
+                 max_rps: Optional[float] = None,
+                 rps_step: Optional[float] = None,
+                 backoff_factor: Optional[float] = None,
+                 throttle_cooldown: Optional[float] = None):
         """
         Instantiates the limiter
+        :param rps: tokens added to the bucket per second
+        :param concurrent_requests: max requests inside the limiter at once
+        :param burst: bucket capacity, 1 means no bursts
+        :param min_rps: floor of the adaptive rate, rps by default
+        :param max_rps: ceiling of the adaptive rate, rps by default
+        :param rps_step: rps added per successful request
+        :param backoff_factor: rps multiplier applied on throttling
+        :param throttle_cooldown: seconds after a decrease during which
+            further throttling is attributed to the same overload
         """
-        self.rps_lock = asyncio.Lock()
-        self.interval_ms = 1000 / rps
-        self.last_request_time = time.time() * 1000
+        self.rps = rps
+        self.burst = burst or 1
+        self.min_rps = min_rps or rps
+        self.max_rps = max_rps or rps
+        self.rps_step = rps_step or 0.01
+        self.backoff_factor = backoff_factor or 0.5
+        self.throttle_cooldown = throttle_cooldown or 1
+        self._last_decrease = None
+        # Starting full so that the first requests go through instantly
+        self.tokens = self.burst
+        self.last_refill = time.monotonic()
 
         self.concurrency = False
         self.sem = None
@@ -28,24 +58,131 @@ class AsyncLimiter:
             self.concurrency = True
             self.sem = asyncio.Semaphore(value=concurrent_requests)
 
-    async def __aenter__(self):
+    def _refill(self):
         """
-        Context manager entry
+        Adds tokens accumulated since the last refill, up to burst
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.last_refill) * self.rps)
+        self.last_refill = now
+
+    def _reserve(self, weight: float) -> float:
+        """
+        ### Takes weight tokens from the bucket, going into debt if needed
+        Runs without awaits so reservations are taken in call order.
+        :return: seconds until the reservation is covered
+        """
+        self._refill()
+        self.tokens -= weight
+        return max(0., -self.tokens / self.rps)
+
+    def _set_rps(self, rps: float):
+        """
+        Changes the refill rate, tokens accumulated so far keep the old one
+        """
+        self._refill()
+        self.rps = min(self.max_rps, max(self.min_rps, rps))
+
+    def on_success(self):
+        """
+        Additively increases the rate after a request went through
+        """
+        if self.rps < self.max_rps:
+            self._set_rps(rps=self.rps + self.rps_step)
+
+    def on_throttle(self):
         """
+        ### Multiplicatively decreases the rate after a throttled request
+        Requests sent before a decrease fail together, so only the first
+        throttle within throttle_cooldown counts.
+        """
+        now = time.monotonic()
+        if (self._last_decrease is not None
+                and now - self._last_decrease < self.throttle_cooldown):
+            return
+        self._last_decrease = now
+        self._set_rps(rps=self.rps * self.backoff_factor)
+
+    def time_until(self, weight: float) -> float:
+        """
+        ### Seconds until a request costing weight can go without debt
+        Nothing is taken. Requests heavier than burst need a full bucket.
+        """
+        self._refill()
+        return max(0., (min(weight, self.burst) - self.tokens) / self.rps)
+
+    def refund(self, weight: float):
+        """
+        Gives back tokens of a reservation that was not used
+        """
+        self._refill()
+        self.tokens = min(self.burst, self.tokens + weight)
+
+    async def acquire(self, weight: Optional[float] = None):
+        """
+        ### Waits until a request costing weight tokens can be sent
+        Cancellation safe: a cancelled call releases whatever it took.
+        """
+        if weight is None:
+            weight = 1
         if self.concurrency:
             await self.sem.acquire()
-        async with self.rps_lock:
-            await asyncio.sleep(
-                max(
-                    0.,
-                    self.interval_ms - ((time.time() * 1000) - self.last_request_time)  # noqa: E501
-                ) / 1000
-            )
-            self.last_request_time = time.time() * 1000
+        delay = self._reserve(weight=weight)
+        try:
+            if delay > 0:
+                await asyncio.sleep(delay)
+        except BaseException:
+            self.refund(weight=weight)
+            if self.concurrency:
+                self.sem.release()
+            raise
+
+    def release(self):
+        """
+        Frees the concurrency slot taken by acquire
+        """
+        if self.concurrency:
+            self.sem.release()
+
+    def weighted(self, weight: float) -> "WeightedAcquire":
+        """
+        Context manager acquiring weight tokens instead of one
+        """
+        return WeightedAcquire(limiter=self, weight=weight)
+
+    async def __aenter__(self):
+        """
+        Context manager entry
+        """
+        await self.acquire()
 
     async def __aexit__(self, exc_type, exc, tb):
         """
         Context manager exit
         """
-        if self.concurrency:
-            self.sem.release()
\ No newline at end of file
+        self.release()
+
+
+class WeightedAcquire:
+    """
+    Context manager returned by AsyncLimiter.weighted
+    """
+    def __init__(self, limiter: AsyncLimiter, weight: float):
+        """
+        Instantiates the context manager
+        """
+        self.limiter = limiter
+        self.weight = weight
+
+    async def __aenter__(self):
+        """
+        Context manager entry
+        """
+        await self.limiter.acquire(weight=self.weight)
+
+    async def __aexit__(self, exc_type, exc, tb):
+        """
+        Context manager exit
+        """
+        self.limiter.release()
@@ -0,0 +1,279 @@
+"""
+Module implements a hierarchical rps limiter sharing a global quota fairly
+"""
+import asyncio
+import heapq
+import itertools
+import time
+from typing import Optional
+
+import cachetools
+
+from alfredo_lib.gateways.base.async_rps_limiter import AsyncLimiter
+
+INTERACTIVE_PRIORITY = "interactive"
+BACKGROUND_PRIORITY = "background"
+# Lanes in the order they are served
+PRIORITY_LANES = (INTERACTIVE_PRIORITY, BACKGROUND_PRIORITY)
+
+
+class RequestContext:
+    """
+    ### Describes whom a Google request is made for
+    Used by HierarchicalLimiter to pick buckets & order waiters.
+    """
+    def __init__(self, sheet_id: Optional[str] = None,
+                 user_id: Optional[int] = None,
+                 weight: Optional[float] = None,
+                 priority: Optional[str] = None):
+        """
+        Instantiates the context
+        :param sheet_id: spreadsheet the request goes to
+        :param user_id: discord id of the user the request is made for
+        :param weight: limiter tokens the request costs, 1 by default
+        :param priority: INTERACTIVE_PRIORITY (default) for requests
+            a user waits for, BACKGROUND_PRIORITY for maintenance
+        """
+        self.sheet_id = sheet_id
+        self.user_id = user_id
+        self.weight = weight
+        self.priority = priority
+
+    def replace(self, **changes) -> "RequestContext":
+        """
+        Creates a copy of the context with changes applied
+        """
+        return RequestContext(**{**vars(self), **changes})
+
+    def __repr__(self) -> str:
+        "Shows the context in logs"
+        return (f"RequestContext(sheet_id={self.sheet_id}, "
+                f"user_id={self.user_id}, weight={self.weight}, "
+                f"priority={self.priority})")
+
+
+class HierarchicalLimiter:
+    """
+    ### Rate limits requests on global, per-spreadsheet & per-user levels
+    A request first takes tokens from its spreadsheet & user buckets
+    and then waits for the global bucket. Waiters of the global bucket
+    are served by weighted fair queueing: each user gets an equal share,
+    so a user sending a lot of requests can't starve the others.
+    Interactive requests are served before background ones, background
+    requests waiting longer than max_background_wait jump the line.
+    Usage:  async with limiter.limit(RequestContext(...)):
+                # make request here.
+    """
+    def __init__(self, global_limiter: AsyncLimiter,
+                 sheet_rps: Optional[float] = None,
+                 sheet_burst: Optional[float] = None,
+                 user_rps: Optional[float] = None,
+                 user_burst: Optional[float] = None,
+                 max_buckets: Optional[int] = None,
+                 bucket_ttl: Optional[int] = None,
+                 max_background_wait: Optional[float] = None):
+        """
+        Instantiates the limiter
+        :param global_limiter: bucket shared by all requests
+        :param sheet_rps: rps allowed per spreadsheet, None means no limit
+        :param sheet_burst: burst allowed per spreadsheet
+        :param user_rps: rps allowed per user, None means no limit
+        :param user_burst: burst allowed per user
+        :param max_buckets: max number of per-spreadsheet & per-user buckets
+        :param bucket_ttl: seconds after which an idle bucket is dropped
+        :param max_background_wait: seconds after which a queued background
+            request is served ahead of interactive ones
+        """
+        max_buckets = max_buckets or 4096
+        bucket_ttl = bucket_ttl or 600
+        self.max_background_wait = max_background_wait or 30
+        self.global_limiter = global_limiter
+        self.sheet_rps = sheet_rps
+        self.sheet_burst = sheet_burst
+        self.user_rps = user_rps
+        self.user_burst = user_burst
+        self._sheet_buckets = cachetools.TTLCache(maxsize=max_buckets,
+                                                  ttl=bucket_ttl)
+        self._user_buckets = cachetools.TTLCache(maxsize=max_buckets,
+                                                 ttl=bucket_ttl)
+        # {lane: heap of (finish tag, arrival number, weight, future,
+        #         queued at)}
+        self._queues = {lane: [] for lane in PRIORITY_LANES}
+        self._arrivals = itertools.count()
+        self._virtual_time = 0.
+        # {user_id: finish tag of the user's latest request}
+        self._finish_tags = {}
+        self._dispatcher = None
+
+    @staticmethod
+    def _bucket(buckets: cachetools.TTLCache, key,
+                rps: Optional[float], burst: Optional[float]):
+        """
+        Gets bucket of key, creating it if needed. None if rps is not set.
+        """
+        if rps is None or key is None:
+            return None
+        bucket = buckets.get(key, None)
+        if bucket is None:
+            bucket = AsyncLimiter(rps=rps, burst=burst)
+        # Setting on every use keeps active buckets from expiring
+        buckets[key] = bucket
+        return bucket
+
+    def _buckets_for(self, ctx: RequestContext) -> list:
+        """
+        Lists spreadsheet & user buckets that ctx needs to go through
+        """
+        buckets = [
+            self._bucket(buckets=self._sheet_buckets, key=ctx.sheet_id,
+                         rps=self.sheet_rps, burst=self.sheet_burst),
+            self._bucket(buckets=self._user_buckets, key=ctx.user_id,
+                         rps=self.user_rps, burst=self.user_burst)
+        ]
+        return [bucket for bucket in buckets if bucket is not None]
+
+    async def acquire(self, ctx: Optional[RequestContext] = None):
+        """
+        ### Waits until a request described by ctx can be sent
+        Cancellation safe: a cancelled call gives back what it took.
+        """
+        ctx = ctx or RequestContext()
+        weight = ctx.weight or 1
+        taken = []
+        try:
+            for bucket in self._buckets_for(ctx=ctx):
+                await bucket.acquire(weight=weight)
+                taken.append(bucket)
+            await self._acquire_global(
+                flow=ctx.user_id, weight=weight,
+                lane=ctx.priority or INTERACTIVE_PRIORITY
+            )
+        except BaseException:
+            for bucket in taken:
+                bucket.refund(weight=weight)
+                bucket.release()
+            raise
+
+    async def _acquire_global(self, flow, weight: float, lane: str):
+        """
+        Queues for the global bucket by finish tag of the request
+        """
+        if lane not in self._queues:
+            raise ValueError(f"Bad input for priority: {lane}. "
+                             f"Need one of {PRIORITY_LANES}")
+        future = asyncio.get_running_loop().create_future()
+        start = max(self._virtual_time, self._finish_tags.get(flow, 0.))
+        finish = start + weight
+        self._finish_tags[flow] = finish
+        heapq.heappush(self._queues[lane],
+                       (finish, next(self._arrivals), weight, future,
+                        time.monotonic()))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Tokens were granted right before the cancellation
+                self.global_limiter.refund(weight=weight)
+                self.global_limiter.release()
+            raise
+
+    def _next_lane(self) -> Optional[str]:
+        """
+        Picks the lane to serve next, None if nothing is queued
+        """
+        background = self._queues[BACKGROUND_PRIORITY]
+        if background:
+            waited = time.monotonic() - background[0][4]
+            if waited >= self.max_background_wait:
+                return BACKGROUND_PRIORITY
+        for lane in PRIORITY_LANES:
+            if self._queues[lane]:
+                return lane
+        return None
+
+    async def _dispatch(self):
+        """
+        Lets queued requests through the global bucket, lowest tag first
+        """
+        while True:
+            lane = self._next_lane()
+            if lane is None:
+                break
+            finish, _, weight, future, _ = self._queues[lane][0]
+            if future.done():
+                # Waiter was cancelled while queued
+                heapq.heappop(self._queues[lane])
+                continue
+            # Waiting without reserving so that requests of a higher
+            # priority arriving meanwhile get picked instead
+            delay = min(self.global_limiter.time_until(weight=weight),
+                        self.max_background_wait)
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            heapq.heappop(self._queues[lane])
+            await self.global_limiter.acquire(weight=weight)
+            # Lanes are served out of tag order, virtual time never goes back
+            self._virtual_time = max(self._virtual_time, finish)
+            if future.done():
+                self.global_limiter.refund(weight=weight)
+                self.global_limiter.release()
+                continue
+            future.set_result(None)
+        # Every tag is behind virtual time once the queue is drained
+        self._finish_tags.clear()
+
+    def release(self, ctx: Optional[RequestContext] = None):
+        """
+        Frees concurrency slots taken by acquire
+        """
+        ctx = ctx or RequestContext()
+        for bucket in self._buckets_for(ctx=ctx):
+            bucket.release()
+        self.global_limiter.release()
+
+    def on_success(self):
+        """
+        Reports a request that went through, see AsyncLimiter.on_success
+        """
+        self.global_limiter.on_success()
+
+    def on_throttle(self):
+        """
+        ### Reports a request throttled by Google
+        Only the global rate adapts as the quota is shared by everyone.
+        """
+        self.global_limiter.on_throttle()
+
+    def limit(self, ctx: Optional[RequestContext] = None) -> "LimitContext":
+        """
+        Context manager around acquire & release for ctx
+        """
+        return LimitContext(limiter=self, ctx=ctx)
+
+
+class LimitContext:
+    """
+    Context manager returned by HierarchicalLimiter.limit
+    """
+    def __init__(self, limiter: HierarchicalLimiter,
+                 ctx: Optional[RequestContext] = None):
+        """
+        Instantiates the context manager
+        """
+        self.limiter = limiter
+        self.ctx = ctx
+
+    async def __aenter__(self):
+        """
+        Context manager entry
+        """
+        await self.limiter.acquire(ctx=self.ctx)
+
+    async def __aexit__(self, exc_type, exc, tb):
+        """
+        Context manager exit
+        """
+        self.limiter.release(ctx=self.ctx)
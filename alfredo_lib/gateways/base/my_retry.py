@@ -2,31 +2,128 @@
 Module implements a simple async-friendly retry decorator
 """
 import asyncio
+import email.utils
 import functools
 import logging
-from typing import Callable, Sequence
+import random
+import time
+from typing import Callable, Optional, Sequence
+
+
+class RetryBudget:
+    """
+    ### Caps retries to a share of calls made, meant to be shared process-wide
+    Every call deposits ratio tokens, every retry takes one. Once the
+    budget is empty failing calls are not retried, so an outage does not
+    multiply the load on the failing backend by the number of retries.
+    """
+    def __init__(self, ratio: Optional[float] = None,
+                 max_tokens: Optional[float] = None):
+        """
+        Instantiates the budget
+        :param ratio: retries allowed per call on average
+        :param max_tokens: retries that can be saved up, budget starts full
+        """
+        self.ratio = ratio or 0.2
+        self.max_tokens = max_tokens or 10
+        self.tokens = self.max_tokens
+
+    def deposit(self):
+        """
+        Records a call, adding ratio tokens to the budget
+        """
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        """
+        Takes a token for a retry
+        :return: True if the retry is allowed
+        """
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+def _retry_after(e: Exception) -> Optional[float]:
+    """
+    ### Reads seconds to wait from Retry-After header of the failed response
+    Response is looked up on e or on e.og_exception for wrapped errors.
+    :return: seconds, None if there is no usable header
+    """
+    og_exception = getattr(e, "og_exception", e)
+    headers = getattr(getattr(og_exception, "res", None), "headers", None)
+    if not headers:
+        return None
+    value = None
+    for key, header in headers.items():
+        if key.lower() == "retry-after":
+            value = header
+            break
+    if value is None:
+        return None
+    try:
+        return max(0., float(value))
+    except ValueError:
+        pass
+    # Header can also hold a date
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0., retry_at.timestamp() - time.time())
 
 
 def simple_async_retry(exceptions: Sequence, logger: logging.Logger,
-                       retries: int, delay: int):
+                       retries: int, delay: int,
+                       backoff: Optional[float] = None,
+                       max_delay: Optional[float] = None,
+                       jitter: Optional[bool] = None,
+                       max_elapsed: Optional[float] = None,
+                       budget: Optional[RetryBudget] = None):
     """
-    Retries retries number of times with delay on exceptions
+    ### Retries retries number of times with delay on exceptions
+    Retry-After of the failed response is honored over the delay.
+    :param delay: seconds before the first retry
+    :param backoff: delay multiplier applied after each retry, 1 by default
+    :param max_delay: upper bound of a delay, no bound by default
+    :param jitter: sleep a random time between 0 & the delay (full jitter)
+    :param max_elapsed: seconds after which no more retries are made
+    :param budget: retry budget shared with other callers
     """
+    backoff = backoff or 1
+
     def decorator(func: Callable):
         @functools.wraps(func)
         async def wrapper(*args, **kwargs):
+            start = time.monotonic()
+            if budget is not None:
+                budget.deposit()
             for attempt in range(retries+1):
                 try:
                     return await func(*args, **kwargs)
                 except exceptions as e:
                     logger.debug("Caught an exception: %s", e)
-                    if attempt < retries:
-                        logger.debug("Retrying in %s seconds...", delay)
-                        await asyncio.sleep(delay)
-                    else:
+                    if attempt >= retries:
                         logger.warning("Retries exhausted. Raising err")
                         raise e
+                    sleep_for = delay * backoff ** attempt
+                    if max_delay is not None:
+                        sleep_for = min(sleep_for, max_delay)
+                    if jitter:
+                        sleep_for = random.uniform(0, sleep_for)
+                    retry_after = _retry_after(e=e)
+                    if retry_after is not None:
+                        sleep_for = retry_after
+                    elapsed = time.monotonic() - start
+                    if (max_elapsed is not None
+                            and elapsed + sleep_for > max_elapsed):
+                        logger.warning("Retry time limit reached. Raising err")
+                        raise e
+                    if budget is not None and not budget.withdraw():
+                        logger.warning("Retry budget exhausted. Raising err")
+                        raise e
+                    logger.debug("Retrying in %s seconds...", sleep_for)
+                    await asyncio.sleep(sleep_for)
         return wrapper
     return decorator
-
-                        
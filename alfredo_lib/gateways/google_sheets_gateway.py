@@ -1,18 +1,32 @@
 """
 Module implements an async Gsheet Gateway
 """
+import asyncio
+import contextlib
+import datetime
 import json
 import logging
-from typing import Optional
+import os
+import re
+import time
+from typing import AsyncIterator, Optional
 
 import aiogoogle
+import aiohttp
+import cachetools
 import polars as pl
 from aiogoogle import models as aiogoogle_models
 from aiogoogle.auth import creds
+from aiogoogle.resource import GoogleAPI
+from aiogoogle.sessions.aiohttp_session import AiohttpSession
 
 from alfredo_lib import MAIN_CFG
-from alfredo_lib.gateways.base import async_rps_limiter
-from alfredo_lib.gateways.base.my_retry import simple_async_retry
+from alfredo_lib.gateways.base import hierarchical_limiter
+from alfredo_lib.gateways.base.hierarchical_limiter import (
+    BACKGROUND_PRIORITY,
+    RequestContext,
+)
+from alfredo_lib.gateways.base.my_retry import RetryBudget, simple_async_retry
 
 bot_logger = logging.getLogger(MAIN_CFG["main_logger_name"])
 backup_logger = logging.getLogger(MAIN_CFG["backup_logger_name"])
@@ -24,6 +38,28 @@ SHEET_SCOPES = [
 
 READ_REQUEST_TYPE = "r"
 WRITE_REQUEST_TYPE = "w"
+# Typed reads need raw numbers, not how they are displayed in the sheet
+FORMATTED_VALUE = "FORMATTED_VALUE"
+UNFORMATTED_VALUE = "UNFORMATTED_VALUE"
+# Day 0 of the date serial numbers returned with UNFORMATTED_VALUE
+SHEETS_EPOCH = datetime.datetime(1899, 12, 30)
+MS_PER_DAY = 86_400_000
+# Dates written to the sheet as text, tried in order
+TEXT_DATETIME_FORMATS = ("%Y-%m-%d %H:%M:%S%.f", "%Y-%m-%dT%H:%M:%S%.f",
+                         "%Y-%m-%d")
+# Cells quoted in the error of a typed read that doesn't match its schema
+MAX_REPORTED_CELLS = 5
+# Only tab properties are needed from spreadsheets.get
+SHEET_PROPERTIES_FIELDS = "sheets.properties"
+# Reads cover A:ZZ unless columns are specified
+DEFAULT_END_COL = 702
+# tab!A1:B2 or tab!A1, tab part may be quoted and contain anything
+A1_RANGE_PATTERN = re.compile(
+    r"^(?P<tab>.*)!(?P<start_col>[A-Z]+)(?P<start_row>\d+)"
+    r"(?::(?P<end_col>[A-Z]+)(?P<end_row>\d+))?$"
+)
+# Shared by all gateway requests so that an outage can't cause retry storms
+SHEETS_RETRY_BUDGET = RetryBudget(**MAIN_CFG["google_sheets"]["retry_budget"])
 
 class GoogleSheetRetriableError(Exception):
     """
@@ -34,6 +70,11 @@ class GoogleSheetRetriableError(Exception):
         super().__init__(msg)
         self.og_exception = og_exception
 
+class GoogleSheetRateLimitError(GoogleSheetRetriableError):
+    """
+    Custom exception class for requests throttled by Google (429)
+    """
+
 class GoogleSheetBadRequestError(Exception):
     """
     Custom exception class to differentiate 4XX cases
@@ -53,12 +94,41 @@ class GoogleSheetMapper:
         Mapper converting col number to a spreadsheet column
         """
         bot_logger.debug("Preparing sheet range from num %s", num)
-        rem, layers = num % 26, num // 26
-        bot_logger.debug("Rem: %s, layers: %s", rem, layers)
-        first = ""
-        if layers > 0:
-            first = chr(65+layers-1)
-        return f"{first}{chr(65+rem-1)}"
+        letters = ""
+        # Bijective base 26: 26 is Z, 27 is AA, 702 is ZZ
+        while num > 0:
+            num, rem = divmod(num - 1, 26)
+            letters = f"{chr(65+rem)}{letters}"
+        return letters
+
+    @staticmethod
+    def quote_tab_name(tab_name: str) -> str:
+        """
+        ### Mapper quoting a tab name for A1 notation
+        Quotes are needed for names with spaces or looking like a cell
+        (e.g. Q1), Sheets accepts them on any name. Single quotes inside
+        the name are doubled.
+        """
+        escaped = tab_name.replace("'", "''")
+        return f"'{escaped}'"
+
+    def params_to_a1_range(self, tab_name: str,
+                           start_row: Optional[int] = None,
+                           end_row: Optional[int] = None,
+                           start_col: Optional[int] = None,
+                           end_col: Optional[int] = None) -> str:
+        """
+        ### Mapper converting 1-based row & col bounds to an A1 range
+        Missing row bounds leave the range open (e.g. tab!A5:ZZ),
+        missing col bounds default to A:ZZ.
+        """
+        start_col = start_col or 1
+        end_col = end_col or DEFAULT_END_COL
+        if end_row is not None and start_row is None:
+            start_row = 1
+        start = f"{self.num_to_sheet_range(start_col)}{start_row or ''}"
+        end = f"{self.num_to_sheet_range(end_col)}{end_row or ''}"
+        return f"{self.quote_tab_name(tab_name)}!{start}:{end}"
     
     @staticmethod
     async def _tab_name_to_tab_id(sheet_id: str, tab_name: str,
@@ -84,39 +154,259 @@ class GoogleSheetMapper:
             for tab in sheet_properties["sheets"]
         }
 
+    @staticmethod
+    def _updated_range_to_last_row(updated_range: str) -> int:
+        """
+        Mapper converting A1 range from an update response
+        (e.g. 'tab'!A5:G7) to its last row number
+        """
+        cells = updated_range.rsplit("!", 1)[-1]
+        last_cell = cells.split(":")[-1]
+        return int("".join(char for char in last_cell if char.isdigit()))
+
+    @staticmethod
+    def _split_append_response(resp: dict, sizes: list) -> list:
+        """
+        ### Splits response of a coalesced append to per caller responses
+        Each part covers rows of one caller, sizes are in append order.
+        """
+        updates = resp["updates"]
+        match = A1_RANGE_PATTERN.match(updates["updatedRange"])
+        if match is None:
+            raise ValueError(f"Unexpected range {updates['updatedRange']}")
+        end_col = match.group("end_col") or match.group("start_col")
+        row = int(match.group("start_row"))
+        parts = []
+        for size in sizes:
+            part_range = (f"{match.group('tab')}!{match.group('start_col')}"
+                          f"{row}:{end_col}{row + size - 1}")
+            parts.append({
+                "spreadsheetId": resp.get("spreadsheetId"),
+                "tableRange": resp.get("tableRange"),
+                "updates": {**updates, "updatedRange": part_range,
+                            "updatedRows": size}
+            })
+            row += size
+        return parts
+
     @staticmethod
     def _process_sheet_response(sheet_data: list, header_rownum: int,
                                 header_offset: int) -> tuple:
         """
         Splits sheet_data into header and data
-        accounting for header_rownum and header_offset
+        accounting for header_rownum and header_offset.
+        Rows above the header are not data, like in the other read modes.
         """
         header_index = header_rownum-1
         header_row = sheet_data[header_index]
         bot_logger.debug("header row fetched: %s. Index used: %s",
                          header_row, header_index)
         # Drop rows we want to skip based on params
-        del sheet_data[header_index:header_index+1+header_offset]
-        return header_row, sheet_data
+        return header_row, sheet_data[header_index+1+header_offset:]
     
     @staticmethod
-    def _delete_rows_params_to_body(tab_id: str, start: int, end: int) -> dict:
+    def _cell_to_dtype_expr(col: str, dtype) -> pl.Expr:
+        """
+        ### Expression casting a Utf8 column of raw cells to dtype
+        Cells are read with UNFORMATTED_VALUE & stringified.
+        Numbers come back as JSON ints or floats, dates as serial numbers
+        (days since 1899-12-30, fraction is the time of day) unless they
+        were written as text. Cells that don't fit dtype become null.
+        """
+        cell = pl.col(col)
+        if dtype == pl.Utf8:
+            return cell
+        number = cell.cast(pl.Float64, strict=False)
+        if dtype == pl.Datetime:
+            # Rounded to milliseconds, the precision Sheets keeps
+            serial = pl.lit(SHEETS_EPOCH) + pl.duration(
+                milliseconds=(number * MS_PER_DAY).round(0).cast(pl.Int64)
+            )
+            # Parsing only cells that are not numbers
+            text_cell = pl.when(number.is_null()).then(cell)
+            text = [text_cell.str.strptime(pl.Datetime, fmt, strict=False)
+                    for fmt in TEXT_DATETIME_FORMATS]
+            return pl.coalesce(serial, *text).cast(dtype)
+        if dtype in pl.INTEGER_DTYPES:
+            # Going through floats only for values ints can't parse
+            # so that ints above 2**53 keep their precision
+            whole = pl.when(number == number.round(0)).then(number)
+            return pl.coalesce(cell.cast(dtype, strict=False),
+                               whole.cast(dtype, strict=False))
+        if dtype in pl.FLOAT_DTYPES:
+            return number.cast(dtype)
+        if dtype == pl.Boolean:
+            return (pl.when(cell == "true").then(True)
+                    .when(cell == "false").then(False))
+        return cell.cast(dtype, strict=False)
+
+    def _rows_to_df(self, header: list, rows: list,
+                    dtypes: Optional[dict] = None) -> pl.DataFrame:
+        """
+        ### Mapper converting sheet rows to a df with dtypes
+        Google drops trailing empty cells so rows are padded
+        (or cut) to the header length. Cells are read as Utf8 &
+        cast column-wise. Columns missing from dtypes are Utf8.
+        :param dtypes: {sheet_name: dtype}, see config_schema_to_dtypes
+        :raises ValueError: listing cells that don't fit their dtype
+        """
+        dtypes = dtypes or {}
+        width = len(header)
+        padded = [row if len(row) == width
+                  else (row + [None] * (width - len(row)))[:width]
+                  for row in rows]
+        raw = pl.DataFrame(padded, schema=[(col, pl.Utf8) for col in header],
+                           orient="row")
+        # Blank cells are nulls whatever the dtype
+        raw = raw.select(pl.when(pl.col(col) != "").then(pl.col(col))
+                         .alias(col) for col in header)
+        df = raw.select(
+            self._cell_to_dtype_expr(col=col, dtype=dtypes.get(col, pl.Utf8))
+            .alias(col)
+            for col in header
+        )
+        bad_cells, bad_count = [], 0
+        for col in header:
+            bad = raw[col].is_not_null() & df[col].is_null()
+            bad_count += bad.sum()
+            for row_index in bad.arg_true().head(MAX_REPORTED_CELLS):
+                bad_cells.append((row_index, col, raw[col][row_index]))
+        if bad_count:
+            raise ValueError(
+                f"{bad_count} cells don't match the schema, "
+                f"first (row index, column, value): "
+                f"{bad_cells[:MAX_REPORTED_CELLS]}"
+            )
+        return df
+
+    @staticmethod
+    def config_schema_to_dtypes(schema: dict) -> dict:
+        """
+        Mapper converting a tab schema from config to {sheet_name: dtype}
+        """
+        return {value["sheet_name"]: getattr(pl, value["type"])
+                for value in schema.values()}
+
+    @staticmethod
+    def _delete_rows_params_to_request(tab_id: str, start: int,
+                                       end: int) -> dict:
+        """
+        Mapper converting delete rows params to a deleteDimension request
+        """
+        return {
+            "deleteDimension": {
+                "range": {
+                    "sheetId": tab_id,
+                    "dimension": "ROWS",
+                    "startIndex": start,
+                    "endIndex": end
+                }
+            }
+        }
+
+    def _delete_rows_params_to_body(self, tab_id: str, start: int,
+                                    end: int) -> dict:
         """
         Mapper converting delete rows params to a request body that Google
         api understands.
         """
         return {
             "requests": [
-                {
-                    "deleteDimension": {
-                        "range": {
-                            "sheetId": tab_id,
-                            "dimension": "ROWS",
-                            "startIndex": start,
-                            "endIndex": end
-                        }    
-                    }
-                }
+                self._delete_rows_params_to_request(tab_id=tab_id,
+                                                    start=start, end=end)
+            ]
+        }
+
+    @staticmethod
+    def _value_to_cell_data(value) -> dict:
+        """
+        Mapper converting a python value to CellData, same as RAW input
+        """
+        if value is None:
+            return {}
+        # bool is a subclass of int so checking it first
+        if isinstance(value, bool):
+            return {"userEnteredValue": {"boolValue": value}}
+        if isinstance(value, (int, float)):
+            return {"userEnteredValue": {"numberValue": value}}
+        return {"userEnteredValue": {"stringValue": str(value)}}
+
+    def _rows_to_row_data(self, rows: list) -> list:
+        """
+        Mapper converting a 2d list to a list of RowData
+        """
+        return [{"values": [self._value_to_cell_data(value) for value in row]}
+                for row in rows]
+
+    def _rows_to_append_cells_request(self, tab_id: str, rows: list) -> dict:
+        """
+        Mapper converting a 2d list to an appendCells request
+        """
+        return {
+            "appendCells": {
+                "sheetId": tab_id,
+                "rows": self._rows_to_row_data(rows=rows),
+                "fields": "userEnteredValue"
+            }
+        }
+
+    @staticmethod
+    def _grid_expansion_requests(tab_properties: dict, rows: int,
+                                 columns: int) -> list:
+        """
+        ### Mapper creating appendDimension requests for a tab too small
+        to fit rows x columns. Unlike values.update, updateCells does not
+        grow the grid on its own.
+        """
+        grid = tab_properties.get("gridProperties", {})
+        requests = []
+        for dimension, needed, key in (("ROWS", rows, "rowCount"),
+                                       ("COLUMNS", columns, "columnCount")):
+            missing = needed - grid.get(key, needed)
+            if missing > 0:
+                requests.append({
+                    "appendDimension": {"sheetId": tab_properties["sheetId"],
+                                        "dimension": dimension,
+                                        "length": missing}
+                })
+        return requests
+
+    def _rows_to_update_cells_body(self, tab_id: str, rows: list,
+                                   start_row: int, width: int,
+                                   clear_below: bool) -> dict:
+        """
+        ### Mapper converting a 2d list to an updateCells batchUpdate body
+        :param start_row: 0-based index of the first row to write
+        :param width: number of columns covered by the paste
+        :param clear_below: when True the range has no end row so that
+            cells below the written rows get cleared by the same request
+        """
+        update_cells = {
+            "rows": self._rows_to_row_data(rows=rows),
+            "fields": "userEnteredValue"
+        }
+        if clear_below:
+            update_cells["range"] = {"sheetId": tab_id,
+                                     "startRowIndex": start_row,
+                                     "startColumnIndex": 0,
+                                     "endColumnIndex": width}
+        else:
+            update_cells["start"] = {"sheetId": tab_id,
+                                     "rowIndex": start_row,
+                                     "columnIndex": 0}
+        return {"requests": [{"updateCells": update_cells}]}
+
+    def _trim_and_append_params_to_body(self, tab_id: str, start: int,
+                                        end: int, rows: list) -> dict:
+        """
+        Mapper combining row deletion & append to one batchUpdate body.
+        Requests are applied in order so rows land after the trimmed data.
+        """
+        return {
+            "requests": [
+                self._delete_rows_params_to_request(tab_id=tab_id,
+                                                    start=start, end=end),
+                self._rows_to_append_cells_request(tab_id=tab_id, rows=rows)
             ]
         }
     
@@ -144,7 +434,8 @@ class GoogleSheetMapper:
         """
         Mapper converting df to a 2d list that Google understands
         """
-        data_update = data.to_numpy().tolist()
+        # rows() keeps python values of each column, no object upcasting
+        data_update = [list(row) for row in data.rows()]
         if include_header:
             data_update = [data.columns] + data_update
         return data_update
@@ -201,6 +492,28 @@ class GoogleSheetMapper:
         code = e.res.json["error"].get("code", None)
         if code is not None:
             return int(code)
+
+    @staticmethod
+    def _is_rate_limit_error(e: aiogoogle.excs.HTTPError) -> bool:
+        """
+        Checks if e tells that a quota of the Sheets API is exhausted
+        """
+        error = e.res.json["error"]
+        return (str(error.get("code", None)) == "429"
+                or error.get("status", None) == "RESOURCE_EXHAUSTED")
+
+    def _is_stale_tab_error(self, e: Exception) -> bool:
+        """
+        Checks if e is a 400 caused by a tab id that no longer exists
+        """
+        if getattr(e, "res", None) is None:
+            return False
+        try:
+            code = self._error_to_response_code(e=e)
+            msg = self._error_to_message(e=e) or ""
+        except Exception:
+            return False
+        return code == 400 and "grid" in msg.lower()
         
     @staticmethod
     def _error_to_message(e: aiogoogle.excs.HTTPError) -> str:
@@ -228,13 +541,74 @@ class GoogleSheetAsyncGateway(GoogleSheetMapper):
     """
     Implements an async class for interacting with Gsheet API.
     It relies on a service account for authentication.
+    Requests share a pooled HTTP session between open() and close(),
+    the gateway can also be used as an async context manager for that.
     """
     def __init__(self, service_acc_path: str,
-                 read_rps_limiter: async_rps_limiter.AsyncLimiter,
-                 write_rps_limter: async_rps_limiter.AsyncLimiter):
+                 read_rps_limiter: hierarchical_limiter.HierarchicalLimiter,
+                 write_rps_limter: hierarchical_limiter.HierarchicalLimiter,
+                 row_count_cache_size: Optional[int] = None,
+                 row_count_ttl: Optional[int] = None,
+                 metadata_cache_size: Optional[int] = None,
+                 metadata_ttl: Optional[int] = None,
+                 pool_size: Optional[int] = None,
+                 keepalive_timeout: Optional[float] = None,
+                 append_coalesce_window: Optional[float] = None,
+                 read_chunk_rows: Optional[int] = None,
+                 paste_chunk_rows: Optional[int] = None,
+                 paste_concurrency: Optional[int] = None,
+                 discovery_cache_dir: Optional[str] = None,
+                 discovery_ttl: Optional[int] = None,
+                 request_weights: Optional[dict] = None):
         """
         Instantiates the gateway
+        :param read_rps_limiter: limiter of read requests
+        :param write_rps_limter: limiter of write requests
+        :param row_count_cache_size: max number of tabs with cached row counts
+        :param row_count_ttl: seconds after which a cached row count is
+            reconciled with the sheet
+        :param metadata_cache_size: max number of spreadsheets with
+            cached tab properties
+        :param metadata_ttl: seconds for which tab properties are reused
+        :param pool_size: max number of open connections to Google
+        :param keepalive_timeout: seconds an idle connection is kept open
+        :param append_coalesce_window: seconds coalesced appends wait
+            for other rows going to the same tab
+        :param read_chunk_rows: rows fetched per request by chunked reads
+        :param paste_chunk_rows: rows sent per request by paste_data
+        :param paste_concurrency: max paste_data requests in flight
+        :param discovery_cache_dir: folder keeping discovery documents
+        :param discovery_ttl: seconds after which a cached discovery
+            document is refreshed in the background
+        :param request_weights: limiter tokens taken by batch_update
+            & batch_get requests, other requests take 1
         """
+        row_count_cache_size = row_count_cache_size or 1024
+        row_count_ttl = row_count_ttl or 3600
+        metadata_cache_size = metadata_cache_size or 1024
+        metadata_ttl = metadata_ttl or 600
+        self.pool_size = pool_size or 10
+        self.keepalive_timeout = keepalive_timeout or 60
+        # Set by open(), requests fall back to one-off sessions without it
+        self.session = None
+        self.append_coalesce_window = append_coalesce_window or 0.5
+        self.read_chunk_rows = read_chunk_rows or 5000
+        self.paste_chunk_rows = paste_chunk_rows or 5000
+        self.paste_concurrency = paste_concurrency or 2
+        self.discovery_cache_dir = discovery_cache_dir or "cache/discovery"
+        self.discovery_ttl = discovery_ttl or 86400
+        self.request_weights = {"batch_update": 1, "batch_get": 1,
+                                **(request_weights or {})}
+        # Set by discover_sheet_service
+        self.sheet_service = None
+        self._discovery_refresh = None
+        # {(sheet_id, tab_name):
+        #  {"row_limit", "low_watermark", "ctx", "items": [(df, future)],
+        #   "task"}}
+        self._pending_appends = {}
+        # {(sheet_id, tab_name): asyncio.Lock}, held while a batch is sent
+        # so that appends to a tab do not overlap
+        self._append_locks = {}
         self.raw_creds = self._new_creds(service_acc_path=service_acc_path)
         bot_logger.debug("Prepared raw Service Acc credentials")
         self.gsheet_client = aiogoogle.Aiogoogle(
@@ -242,6 +616,12 @@ class GoogleSheetAsyncGateway(GoogleSheetMapper):
         )
         self.read_limiter = read_rps_limiter
         self.write_limter = write_rps_limter
+        # {(sheet_id, tab_name): number of used rows, header included}
+        self._row_counts = cachetools.TTLCache(maxsize=row_count_cache_size,
+                                               ttl=row_count_ttl)
+        # {sheet_id: {tab_name: properties}}
+        self._tab_properties = cachetools.TTLCache(maxsize=metadata_cache_size,
+                                                   ttl=metadata_ttl)
         bot_logger.debug("Instantiated GSheet Async Gateway")
 
     @staticmethod
@@ -255,35 +635,175 @@ class GoogleSheetAsyncGateway(GoogleSheetMapper):
         return creds.ServiceAccountCreds(scopes=SHEET_SCOPES,
                                          **service_account_key)
     
-    async def discover_sheet_service(self, api_version: str):
+    async def open(self):
         """
-        ### Discovers sheets api service
-        Outside of __init__ bc it needs an await
+        Opens the pooled HTTP session, no-op if it is already open
+        """
+        if self.session is not None and not self.session.closed:
+            return
+        connector = aiohttp.TCPConnector(
+            limit=self.pool_size, keepalive_timeout=self.keepalive_timeout
+        )
+        self.session = AiohttpSession(connector=connector)
+        bot_logger.debug("Opened Gsheet HTTP session, pool size %s",
+                         self.pool_size)
+
+    async def close(self):
+        """
+        Closes the pooled HTTP session, stops discovery refresh if running
+        """
+        if self._discovery_refresh is not None:
+            self._discovery_refresh.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._discovery_refresh
+            self._discovery_refresh = None
+        if self.session is None:
+            return
+        await self.session.close()
+        self.session = None
+        self.gsheet_client.session_context.set(None)
+        bot_logger.debug("Closed Gsheet HTTP session")
+
+    async def __aenter__(self):
+        "Opens the pooled HTTP session"
+        await self.open()
+        return self
+
+    async def __aexit__(self, *args):
+        "Closes the pooled HTTP session"
+        await self.close()
+
+    @contextlib.asynccontextmanager
+    async def _client(self):
         """
-        async with self.gsheet_client as client:
-            self.sheet_service = await client.discover(
+        Yields aiogoogle client bound to the pooled session when it is open,
+        otherwise the client opens & closes a session of its own
+        """
+        if self.session is None or self.session.closed:
+            # A closed session may linger in this task's context
+            self.gsheet_client.session_context.set(None)
+            async with self.gsheet_client as client:
+                yield client
+            return
+        # aiogoogle looks up its session in a ContextVar
+        self.gsheet_client.session_context.set(self.session)
+        yield self.gsheet_client
+
+    def _discovery_doc_path(self, api_version: str) -> str:
+        """
+        Path of the cached discovery document of api_version
+        """
+        return os.path.join(self.discovery_cache_dir,
+                            f"sheets_{api_version}.json")
+
+    def _load_discovery_doc(self, api_version: str) -> tuple:
+        """
+        Reads cached discovery document from disk
+        :return: tuple(document or None, its age in seconds or None)
+        """
+        path = self._discovery_doc_path(api_version=api_version)
+        try:
+            with open(file=path, encoding="utf-8", mode="r") as doc_file:
+                doc = json.load(doc_file)
+            return doc, time.time() - os.path.getmtime(path)
+        except FileNotFoundError:
+            return None, None
+        except Exception as e:
+            bot_logger.warning("Ignoring unreadable discovery doc %s: %s",
+                               path, e)
+            return None, None
+
+    def _save_discovery_doc(self, api_version: str, doc: dict):
+        """
+        Writes discovery document to disk, replacing the old one atomically
+        """
+        path = self._discovery_doc_path(api_version=api_version)
+        os.makedirs(self.discovery_cache_dir, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(file=tmp_path, encoding="utf-8", mode="w") as doc_file:
+            json.dump(doc, doc_file)
+        os.replace(tmp_path, path)
+
+    async def _fetch_sheet_service(self, api_version: str) -> GoogleAPI:
+        """
+        Downloads discovery document of sheets api & caches it on disk
+        """
+        async with self._client() as client:
+            service = await client.discover(
                 api_name="sheets",
                 api_version=api_version
             )
+        try:
+            self._save_discovery_doc(api_version=api_version,
+                                     doc=service.discovery_document)
+        except Exception as e:
+            bot_logger.warning("Failed to cache discovery doc: %s", e)
         bot_logger.debug("Performed %s sheets service discovery", api_version)
+        return service
+
+    async def _refresh_sheet_service(self, api_version: str):
+        """
+        Replaces a stale sheet service, keeps the current one on failure
+        """
+        try:
+            self.sheet_service = await self._fetch_sheet_service(
+                api_version=api_version
+            )
+        except Exception as e:
+            bot_logger.warning("Discovery doc refresh failed: %s", e)
+
+    async def discover_sheet_service(self, api_version: str):
+        """
+        ### Discovers sheets api service
+        Outside of __init__ bc it needs an await.
+        Discovery document cached on disk is used when available,
+        a stale one gets refreshed in the background.
+        """
+        doc, age = self._load_discovery_doc(api_version=api_version)
+        if doc is None:
+            self.sheet_service = await self._fetch_sheet_service(
+                api_version=api_version
+            )
+            return
+        self.sheet_service = GoogleAPI(discovery_document=doc)
+        bot_logger.debug("Loaded %s sheets service from disk, age %ss",
+                         api_version, int(age))
+        if age > self.discovery_ttl:
+            # Keeping a reference so that the task is not garbage collected
+            self._discovery_refresh = asyncio.create_task(
+                self._refresh_sheet_service(api_version=api_version)
+            )
 
     
     @simple_async_retry(exceptions=(GoogleSheetRetriableError,
                                     aiogoogle.excs.AuthError),
-                        logger=bot_logger, retries=10, delay=1)
-    async def __make_request(self, req: aiogoogle.models.Request,
-                             timeout: int) -> aiogoogle.models.Response:
+                        logger=bot_logger, budget=SHEETS_RETRY_BUDGET,
+                        **MAIN_CFG["google_sheets"]["retries"])
+    async def __make_request(
+            self, req: aiogoogle.models.Request, timeout: int,
+            limiter: hierarchical_limiter.HierarchicalLimiter,
+            ctx: RequestContext
+        ) -> aiogoogle.models.Response:
         """
         Private method simplifying sending API requests to Google Backend.
-        Encorporates some basic retry logic.
+        Encorporates some basic retry logic. Every attempt goes through
+        limiter & tells it whether Google throttled the request.
         """
         try:
-            async with self.gsheet_client as client:
-                res = await client.as_service_account(
-                    req, timeout=timeout
-                )
+            async with limiter.limit(ctx):
+                async with self._client() as client:
+                    res = await client.as_service_account(
+                        req, timeout=timeout
+                    )
+            limiter.on_success()
             return res
         except aiogoogle.excs.HTTPError as e:
+            if self._is_rate_limit_error(e=e):
+                bot_logger.warning("Request throttled by Google: %s", ctx)
+                limiter.on_throttle()
+                raise GoogleSheetRateLimitError(
+                    msg="Rate limited", og_exception=e
+                )
             if 400 <= self._error_to_response_code(e=e) < 500:
                 raise GoogleSheetBadRequestError(
                     msg="Bad Request", og_exception=e
@@ -293,18 +813,35 @@ class GoogleSheetAsyncGateway(GoogleSheetMapper):
                     msg="Retriable error", og_exception=e
                 )
     
+    @staticmethod
+    def _request_ctx(ctx: Optional[RequestContext],
+                     sheet_id: str) -> RequestContext:
+        """
+        Fills spreadsheet of the request context, creating one if needed
+        """
+        ctx = ctx or RequestContext()
+        if ctx.sheet_id == sheet_id:
+            return ctx
+        return ctx.replace(sheet_id=sheet_id)
+
     async def _request_wrapper(
             self, req: aiogoogle.models.Request,
-            req_type: str, timeout: Optional[int] = None
+            req_type: str, timeout: Optional[int] = None,
+            weight: Optional[float] = None,
+            ctx: Optional[RequestContext] = None
             ) -> tuple:
         """
         Abstraction on top of __make_request that controls RPS limiting
         and handles exceptions.
+        :param weight: limiter tokens the request costs, 1 by default
+        :param ctx: spreadsheet, user & priority of the request,
+            used to pick rate limiting buckets & queueing lane
         """
         # TODO exceptions
-        # TODO ratelimitting!!!
         # TODO errors for API requests
         timeout = timeout or 10
+        ctx = ctx or RequestContext()
+        ctx = ctx.replace(weight=weight or ctx.weight or 1)
         
         # Not wrapping to a separate func bc mapper has no access to limiters
         if req_type == READ_REQUEST_TYPE:
@@ -317,38 +854,220 @@ class GoogleSheetAsyncGateway(GoogleSheetMapper):
             )
 
         try:
-            async with limiter:
-                resp = await self.__make_request(req=req, timeout=timeout)
-                return resp, None
+            resp = await self.__make_request(req=req, timeout=timeout,
+                                             limiter=limiter, ctx=ctx)
+            return resp, None
         except (GoogleSheetBadRequestError, GoogleSheetRetriableError) as e:
             bot_logger.debug("Request error. Request: %s. Response: %s",
                              e.og_exception.req.json, e.og_exception.res.json)
             user_msg = self.error_to_user_message(e=e.og_exception)
-            return None, aiogoogle.excs.HTTPError(user_msg)
+            # Keeping req & res so that callers can inspect the failure
+            return None, aiogoogle.excs.HTTPError(user_msg,
+                                                  req=e.og_exception.req,
+                                                  res=e.og_exception.res)
     
-    async def get_sheet_properties(self, sheet_id: str) -> tuple:
+    async def get_sheet_properties(
+            self, sheet_id: str, ctx: Optional[RequestContext] = None
+        ) -> tuple:
         """
-        Fetches sheet data via a get request
+        Fetches sheet data via a get request. Only tab properties are fetched.
         """
+        ctx = self._request_ctx(ctx=ctx, sheet_id=sheet_id)
         bot_logger.debug("Requesting sheet metadata")
-        req = self.sheet_service.spreadsheets.get(spreadsheetId=sheet_id,
-                                                  includeGridData=False)
+        req = self.sheet_service.spreadsheets.get(
+            spreadsheetId=sheet_id, includeGridData=False,
+            fields=SHEET_PROPERTIES_FIELDS
+        )
         bot_logger.debug("Prepared request")
         data, e = await self._request_wrapper(req=req,
-                                              req_type=READ_REQUEST_TYPE)
+                                              req_type=READ_REQUEST_TYPE,
+                                              ctx=ctx)
         if e is not None:
             bot_logger.error("Error fetching sheet properties: %s", e)
             return None, e
         return data, e
+
+    async def get_tab_properties(
+            self, sheet_id: str, ctx: Optional[RequestContext] = None
+        ) -> tuple:
+        """
+        ### Returns {tab_name: properties} of a spreadsheet
+        Served from the metadata cache when possible.
+        :return: tuple(tab properties, error if any)
+        """
+        ctx = self._request_ctx(ctx=ctx, sheet_id=sheet_id)
+        tabs = self._tab_properties.get(sheet_id, None)
+        if tabs is not None:
+            bot_logger.debug("Tab properties cache hit for %s", sheet_id)
+            return tabs, None
+        sheet_properties, e = await self.get_sheet_properties(
+            sheet_id=sheet_id,
+            ctx=ctx
+        )
+        if e is not None:
+            return None, e
+        tabs = self.parse_raw_properties(sheet_properties=sheet_properties)
+        self._tab_properties[sheet_id] = tabs
+        return tabs, None
+
+    def _invalidate_tab_properties(self, sheet_id: str):
+        """
+        Forgets cached tab properties of a spreadsheet
+        """
+        self._tab_properties.pop(sheet_id, None)
     
+    def _resize_cached_grid(self, sheet_id: str, tab_name: str,
+                            delta: int, min_rows: Optional[int] = None):
+        """
+        ### Shifts cached rowCount of a tab by delta rows
+        Keeps tab properties (ids included) cached after rows get deleted
+        or inserted. The grid is kept at least min_rows rows tall.
+        """
+        tabs = self._tab_properties.get(sheet_id, None) or {}
+        grid = tabs.get(tab_name, {}).get("gridProperties", {})
+        if "rowCount" not in grid:
+            return
+        grid["rowCount"] = max(grid["rowCount"] + delta, min_rows or 0)
+
+    def _set_row_count(self, sheet_id: str, tab_name: str, rows: int):
+        """
+        Records number of used rows of a tab
+        """
+        self._row_counts[(sheet_id, tab_name)] = max(rows, 0)
+
+    def _invalidate_row_count(self, sheet_id: str, tab_name: str):
+        """
+        Forgets row count of a tab so that it is read from the sheet next time
+        """
+        self._row_counts.pop((sheet_id, tab_name), None)
+
+    async def get_row_count(self, sheet_id: str, tab_name: str,
+                            ctx: Optional[RequestContext] = None) -> tuple:
+        """
+        ### Returns number of used rows of a tab, header included
+        Served from cache when possible, otherwise reconciled with the sheet
+        by reading only the first column.
+        :return: tuple(row count, error if any)
+        """
+        ctx = self._request_ctx(ctx=ctx, sheet_id=sheet_id)
+        rows = self._row_counts.get((sheet_id, tab_name), None)
+        if rows is not None:
+            bot_logger.debug("Row count cache hit for %s: %s", tab_name, rows)
+            return rows, None
+        req = self.sheet_service.spreadsheets.values.get(
+            spreadsheetId=sheet_id,
+            range=f"{self.quote_tab_name(tab_name)}!A:A",
+            majorDimension="ROWS"
+        )
+        resp, e = await self._request_wrapper(req=req,
+                                              req_type=READ_REQUEST_TYPE,
+                                              ctx=ctx)
+        if e is not None:
+            bot_logger.error("Err reading row count of %s: %s", tab_name, e)
+            return None, e
+        rows = len(resp.get("values", []))
+        self._set_row_count(sheet_id=sheet_id, tab_name=tab_name, rows=rows)
+        bot_logger.debug("Reconciled row count of %s: %s", tab_name, rows)
+        return rows, None
+
+    async def _read_range(self, sheet_id: str, sheet_range: str,
+                          value_render_option: Optional[str] = None,
+                          ctx: Optional[RequestContext] = None) -> tuple:
+        """
+        Reads values of an A1 range
+        :return: tuple(2d list of rows, error if any)
+        """
+        value_render_option = value_render_option or FORMATTED_VALUE
+        req = self.sheet_service.spreadsheets.values.get(
+            spreadsheetId=sheet_id,
+            range=sheet_range,
+            majorDimension='ROWS',
+            valueRenderOption=value_render_option,
+            dateTimeRenderOption="SERIAL_NUMBER"
+        )
+        bot_logger.debug("Prepared sheet reading request for %s", sheet_range)
+        sheet_data, e = await self._request_wrapper(
+            req=req, req_type=READ_REQUEST_TYPE,
+            ctx=ctx
+        )
+        if e is not None:
+            bot_logger.error("Err reading sheet: %s", e)
+            return None, e
+        # Google omits values for empty ranges
+        sheet_data = sheet_data.get("values", [])
+        bot_logger.info("Received data back, len %s", len(sheet_data))
+        return sheet_data, None
+
+    async def read_ranges(self, sheet_id: str, ranges: dict,
+                          value_render_option: Optional[str] = None,
+                          ctx: Optional[RequestContext] = None) -> tuple:
+        """
+        ### Reads several A1 ranges, possibly of different tabs, at once
+        Uses a single values.batchGet request.
+        :param ranges: {name: A1 range}
+        :return: tuple({name: 2d list of rows}, error if any)
+        """
+        ctx = self._request_ctx(ctx=ctx, sheet_id=sheet_id)
+        value_render_option = value_render_option or FORMATTED_VALUE
+        names = list(ranges.keys())
+        req = self.sheet_service.spreadsheets.values.batchGet(
+            spreadsheetId=sheet_id,
+            ranges=[ranges[name] for name in names],
+            majorDimension="ROWS",
+            valueRenderOption=value_render_option,
+            dateTimeRenderOption="SERIAL_NUMBER"
+        )
+        bot_logger.debug("Prepared batch reading request for %s", ranges)
+        resp, e = await self._request_wrapper(
+            req=req, req_type=READ_REQUEST_TYPE,
+            weight=self.request_weights["batch_get"],
+            ctx=ctx
+        )
+        if e is not None:
+            bot_logger.error("Err batch reading sheet: %s", e)
+            return None, e
+        # Value ranges come back in the order of the requested ones
+        value_ranges = resp.get("valueRanges", [])
+        if len(value_ranges) != len(names):
+            return None, ValueError(
+                f"Got {len(value_ranges)} ranges back, asked for {len(names)}"
+            )
+        return {
+            name: value_range.get("values", [])
+            for name, value_range in zip(names, value_ranges)
+        }, None
+
     async def read_sheet(self, sheet_id: str, tab_name: str,
                          header_rownum: Optional[int] = None,
                          header_offset: Optional[int] = None,
                          as_df: Optional[bool] = None,
-                         use_schema: Optional[bool] = None) -> tuple:
+                         use_schema: Optional[bool] = None,
+                         start_row: Optional[int] = None,
+                         end_row: Optional[int] = None,
+                         start_col: Optional[int] = None,
+                         end_col: Optional[int] = None,
+                         header_only: Optional[bool] = None,
+                         last_n_rows: Optional[int] = None,
+                         schema: Optional[dict] = None,
+                         ctx: Optional[RequestContext] = None) -> tuple:
         """
-        Fetches data from spreadsheet
+        ### Fetches data from spreadsheet
+        Whole A:ZZ range is read unless narrowed down by the params below.
+        Header row is always part of the result, it is read separately
+        when the requested rows do not include it.
+        :param start_row: first row to read, 1-based
+        :param end_row: last row to read, inclusive
+        :param start_col: first column to read, 1-based
+        :param end_col: last column to read, inclusive
+        :param header_only: reads header_rownum row only
+        :param last_n_rows: reads the last n data rows, ignores row bounds
+        :param use_schema: casts the df to schema, needs as_df
+        :param schema: tab schema in config format,
+            transaction tab schema by default
+        :param ctx: spreadsheet & user the read is made for,
+            passed on to the rate limiters
         """
+        ctx = self._request_ctx(ctx=ctx, sheet_id=sheet_id)
         # Default values
         if header_rownum is None:
             header_rownum = 1
@@ -358,22 +1077,65 @@ class GoogleSheetAsyncGateway(GoogleSheetMapper):
             as_df = False
         if use_schema is None:
             use_schema = False
+        if header_only is None:
+            header_only = False
+        if use_schema and schema is None:
+            schema = MAIN_CFG["google_sheets"]["transaction_tab"]["schema"]
+        value_render_option = FORMATTED_VALUE
+        if use_schema:
+            value_render_option = UNFORMATTED_VALUE
 
-        req = self.sheet_service.spreadsheets.values.get(
-            spreadsheetId=sheet_id,
-            range=f"{tab_name}!A:ZZ",
-            majorDimension='ROWS'
-        )
-        bot_logger.debug("Prepared sheet reading request")
-        sheet_data, e = await self._request_wrapper(
-            req=req, req_type=READ_REQUEST_TYPE
+        if header_only:
+            start_row, end_row = header_rownum, header_rownum
+        elif last_n_rows is not None:
+            rows, e = await self.get_row_count(sheet_id=sheet_id,
+                                               tab_name=tab_name, ctx=ctx)
+            if e is not None:
+                return None, e
+            start_row = max(rows - last_n_rows + 1,
+                            header_rownum + header_offset + 1)
+            end_row = max(rows, start_row)
+        first_row = start_row or 1
+        data_range = self.params_to_a1_range(
+            tab_name=tab_name, start_row=start_row, end_row=end_row,
+            start_col=start_col, end_col=end_col
         )
-        if e is not None:
-            bot_logger.error("Err reading sheet: %s", e)
-            return None, e
+        if last_n_rows is not None and last_n_rows <= 0:
+            # Nothing to read besides the header
+            first_row, data_range = header_rownum + 1, None
+        if first_row > header_rownum:
+            # Range misses the header, fetching both in one request
+            ranges = {"header": self.params_to_a1_range(
+                tab_name=tab_name, start_row=header_rownum,
+                end_row=header_rownum, start_col=start_col, end_col=end_col
+            )}
+            if data_range is not None:
+                ranges["data"] = data_range
+            values, e = await self.read_ranges(
+                sheet_id=sheet_id, ranges=ranges,
+                value_render_option=value_render_option,
+                ctx=ctx
+            )
+            if e is not None:
+                return None, e
+            header_data = values["header"]
+            sheet_data = values.get("data", [])
+            # Header is the first row now & data starts right after it
+            header_rownum, header_offset = 1, 0
+        else:
+            header_data = []
+            header_rownum = header_rownum - first_row + 1
+            sheet_data, e = await self._read_range(
+                sheet_id=sheet_id, sheet_range=data_range,
+                value_render_option=value_render_option,
+                ctx=ctx
+            )
+            if e is not None:
+                return None, e
         # 2D array with rows here
-        sheet_data = sheet_data["values"]
-        bot_logger.info("Received data back, len %s", len(sheet_data))
+        sheet_data = header_data + sheet_data
+        if len(sheet_data) < header_rownum:
+            return None, ValueError(f"No header row in {tab_name} tab")
 
         header, data = self._process_sheet_response(sheet_data=sheet_data,
                                                     header_rownum=header_rownum,
@@ -384,47 +1146,153 @@ class GoogleSheetAsyncGateway(GoogleSheetMapper):
             return [header] + data, None
         
         # Converting to polars
-        bot_logger.info("Converting to polars")
-        df = pl.DataFrame(data=data)
-        if len(df) > 0:
-            df = df.transpose()
-            df.columns = header
-        if not use_schema:
-            bot_logger.info("use_schema is False, returning untyped")
-            return df, None
-        # Typecasting TODO
-
-    async def clear_data(self, sheet_id: str, tab_name: str, cell_range: str):
+        bot_logger.info("Converting to polars, use_schema %s", use_schema)
+        dtypes = {}
+        if use_schema:
+            dtypes = self.config_schema_to_dtypes(schema=schema)
+        try:
+            df = self._rows_to_df(header=header, rows=data, dtypes=dtypes)
+        except ValueError as e:
+            bot_logger.error("Err converting %s tab to df: %s", tab_name, e)
+            return None, e
+        return df, None
+
+    async def iter_sheet_chunks(
+            self, sheet_id: str, tab_name: str,
+            header_rownum: Optional[int] = None,
+            header_offset: Optional[int] = None,
+            chunk_rows: Optional[int] = None,
+            use_schema: Optional[bool] = None,
+            schema: Optional[dict] = None,
+            ctx: Optional[RequestContext] = None
+        ) -> AsyncIterator[tuple]:
+        """
+        ### Streams tab data as dfs of at most chunk_rows rows
+        Only one chunk is held in memory at a time, at least one
+        (possibly empty) df is yielded.
+        Yields tuple(df, error if any), stops after an error.
+        :param use_schema: casts each chunk to schema, see read_sheet
+        """
+        ctx = self._request_ctx(ctx=ctx, sheet_id=sheet_id)
+        if header_rownum is None:
+            header_rownum = 1
+        if header_offset is None:
+            header_offset = 0
+        chunk_rows = chunk_rows or self.read_chunk_rows
+        if use_schema is None:
+            use_schema = False
+        if use_schema and schema is None:
+            schema = MAIN_CFG["google_sheets"]["transaction_tab"]["schema"]
+        value_render_option = FORMATTED_VALUE
+        dtypes = {}
+        if use_schema:
+            value_render_option = UNFORMATTED_VALUE
+            dtypes = self.config_schema_to_dtypes(schema=schema)
+        header_rows, e = await self.read_sheet(sheet_id=sheet_id,
+                                               tab_name=tab_name,
+                                               header_rownum=header_rownum,
+                                               header_only=True, ctx=ctx)
+        if e is not None:
+            yield None, e
+            return
+        header = header_rows[0]
+        rows, e = await self.get_row_count(sheet_id=sheet_id,
+                                           tab_name=tab_name, ctx=ctx)
+        if e is not None:
+            yield None, e
+            return
+        start_row = header_rownum + header_offset + 1
+        if start_row > rows:
+            yield self._rows_to_df(header=header, rows=[], dtypes=dtypes), None
+            return
+        while start_row <= rows:
+            end_row = min(start_row + chunk_rows - 1, rows)
+            data, e = await self._read_range(
+                sheet_id=sheet_id,
+                sheet_range=self.params_to_a1_range(
+                    tab_name=tab_name, start_row=start_row, end_row=end_row,
+                    end_col=len(header)
+                ),
+                value_render_option=value_render_option,
+                ctx=ctx
+            )
+            if e is not None:
+                yield None, e
+                return
+            bot_logger.debug("Read rows %s-%s of %s", start_row, end_row,
+                             tab_name)
+            try:
+                df = self._rows_to_df(header=header, rows=data, dtypes=dtypes)
+            except ValueError as e:
+                bot_logger.error("Err converting rows %s-%s of %s to df: %s",
+                                 start_row, end_row, tab_name, e)
+                yield None, e
+                return
+            yield df, None
+            start_row = end_row + 1
+
+    async def read_sheet_chunked(self, sheet_id: str, tab_name: str,
+                                 header_rownum: Optional[int] = None,
+                                 header_offset: Optional[int] = None,
+                                 chunk_rows: Optional[int] = None,
+                                 use_schema: Optional[bool] = None,
+                                 schema: Optional[dict] = None,
+                                 ctx: Optional[RequestContext] = None) -> tuple:
+        """
+        Reads a whole tab to a df chunk by chunk, see iter_sheet_chunks
+        :return: tuple(df, error if any)
+        """
+        ctx = self._request_ctx(ctx=ctx, sheet_id=sheet_id)
+        frames = []
+        async for df, e in self.iter_sheet_chunks(
+                sheet_id=sheet_id, tab_name=tab_name,
+                header_rownum=header_rownum, header_offset=header_offset,
+                chunk_rows=chunk_rows, use_schema=use_schema, schema=schema,
+                ctx=ctx):
+            if e is not None:
+                return None, e
+            frames.append(df)
+        # rechunk=False avoids another full copy of the data
+        return pl.concat(frames, how="vertical", rechunk=False), None
+
+    async def clear_data(self, sheet_id: str, tab_name: str, cell_range: str,
+                         ctx: Optional[RequestContext] = None):
         """
         TODO return type hint
         Method for deleting cell data. Does not delete rows.
         """
-        sheet_range = f"{tab_name}!{cell_range}"
+        ctx = self._request_ctx(ctx=ctx, sheet_id=sheet_id)
+        sheet_range = f"{self.quote_tab_name(tab_name)}!{cell_range}"
         req = self.sheet_service.spreadsheets.values.clear(
             spreadsheetId=sheet_id,
             range=sheet_range
         )
         resp, e = await self._request_wrapper(req=req,
-                                              req_type=WRITE_REQUEST_TYPE)
+                                              req_type=WRITE_REQUEST_TYPE,
+                                              ctx=ctx)
+        self._invalidate_row_count(sheet_id=sheet_id, tab_name=tab_name)
         if e is not None:
             bot_logger.error("Err cleaning data: %s", e)
             return None, e
         return resp, e
     
     async def delete_rows(self, sheet_id: str, tab_name: str, end: int,
-                          start: Optional[int] = None):
+                          start: Optional[int] = None,
+                          ctx: Optional[RequestContext] = None):
         """
         TODO return type hint
         Deletes rows from a tab
         """
+        ctx = self._request_ctx(ctx=ctx, sheet_id=sheet_id)
         # Defaulting to 1 because zero is usually a header row
         if start is None:
             start = 1
 
-        sheet_properties = await self.get_sheet_properties(sheet_id=sheet_id)
-        sheet_tabs_data = self.parse_raw_properties(
-            sheet_properties=sheet_properties
-        )
+        sheet_tabs_data, e = await self.get_tab_properties(sheet_id=sheet_id,
+                                                           ctx=ctx)
+        if e is not None:
+            bot_logger.error("Rows deletion failed. Details: %s", e)
+            return None, e
         tab_id, e = await self._tab_name_to_tab_id(
             sheet_id=sheet_id, tab_name=tab_name,
             sheet_tabs_data=sheet_tabs_data
@@ -440,98 +1308,224 @@ class GoogleSheetAsyncGateway(GoogleSheetMapper):
             spreadsheetId=sheet_id,
             json=req_body
         )
-        return await self._request_wrapper(req=req, req_type=WRITE_REQUEST_TYPE)
+        resp, e = await self._request_wrapper(
+            req=req, req_type=WRITE_REQUEST_TYPE,
+            weight=self.request_weights["batch_update"],
+            ctx=ctx
+        )
+        if e is not None and self._is_stale_tab_error(e=e):
+            bot_logger.warning("Tab id of %s is stale, dropping metadata",
+                               tab_name)
+            self._invalidate_tab_properties(sheet_id=sheet_id)
+        elif e is None:
+            self._resize_cached_grid(sheet_id=sheet_id, tab_name=tab_name,
+                                     delta=start - end)
+        rows = self._row_counts.get((sheet_id, tab_name), None)
+        if e is not None or rows is None:
+            self._invalidate_row_count(sheet_id=sheet_id, tab_name=tab_name)
+        else:
+            self._set_row_count(sheet_id=sheet_id, tab_name=tab_name,
+                                rows=rows - (end - start))
+        return resp, e
+
+    async def _paste_chunk(self, sheet_id: str, tab_id: str, rows: list,
+                           start_row: int, width: int, clear_below: bool,
+                           extra_requests: Optional[list] = None,
+                           ctx: Optional[RequestContext] = None) -> tuple:
+        """
+        Writes one chunk of a paste with an updateCells request
+        :param start_row: 0-based index of the first row of the chunk
+        :param extra_requests: requests to apply before the updateCells one
+        """
+        body = self._rows_to_update_cells_body(
+            tab_id=tab_id, rows=rows, start_row=start_row, width=width,
+            clear_below=clear_below
+        )
+        body["requests"] = (extra_requests or []) + body["requests"]
+        req = self.sheet_service.spreadsheets.batchUpdate(
+            spreadsheetId=sheet_id,
+            json=body
+        )
+        bot_logger.debug("Pasting %s rows from row index %s",
+                         len(rows), start_row)
+        return await self._request_wrapper(
+            req=req, req_type=WRITE_REQUEST_TYPE,
+            weight=self.request_weights["batch_update"],
+            ctx=ctx
+        )
 
     async def paste_data(self, sheet_id: str, tab_name: str,
                          start_row: int, data: pl.DataFrame,
-                         include_header: Optional[bool] = None):
+                         include_header: Optional[bool] = None,
+                         chunk_rows: Optional[int] = None,
+                         ctx: Optional[RequestContext] = None) -> tuple:
         """
-        Pastes data to the sheet. Overrides data already existing in the sheet.
+        ### Pastes data to the sheet. Overrides data already existing in the sheet.
+        Data is serialized & sent in chunks of chunk_rows rows. The first
+        chunk also clears the cells below it, the rest are uploaded
+        with up to paste_concurrency requests in flight.
         :param sheet_id: id of the spreadsheet
         :param tab_name: tab where to paste
         :param start_row: where where we paste the data
         :param data: data to paste to the sheet
+        :return: tuple(list of batchUpdate responses, error if any)
         """
+        ctx = self._request_ctx(ctx=ctx, sheet_id=sheet_id)
         if include_header is None:
             include_header = True
-        #TODO type hints 
-        # Delete already existing data before pasting
-        paste_range = self._df_to_update_range(data=data, start_row=start_row)
-        # naive assumption, no resp check
-        await self.clear_data(sheet_id=sheet_id, tab_name=tab_name,
-                              cell_range=paste_range)
-        
-        # Convert df to a list of lists bc google expects an array
-        data_update = self._df_to_sheet_update(
-            data=data, include_header=include_header
+        chunk_rows = chunk_rows or self.paste_chunk_rows
+        sheet_tabs_data, e = await self.get_tab_properties(sheet_id=sheet_id,
+                                                           ctx=ctx)
+        if e is not None:
+            return None, e
+        tab_id, e = await self._tab_name_to_tab_id(
+            sheet_id=sheet_id, tab_name=tab_name,
+            sheet_tabs_data=sheet_tabs_data
         )
-        # Convert data to value range
-        sheet_range = f"{tab_name}!{paste_range}"
-        value_range = self._sheet_update_and_range_to_value_range(
-            sheet_range=sheet_range, data_update=data_update
+        if e is not None:
+            return None, e
+        self._invalidate_row_count(sheet_id=sheet_id, tab_name=tab_name)
+        width = len(data.columns)
+        # Header takes a row of its own, data starts after it
+        data_row = start_row - 1 + int(include_header)
+        tab_properties = sheet_tabs_data[tab_name]
+        expansion = self._grid_expansion_requests(
+            tab_properties=tab_properties, rows=data_row + len(data),
+            columns=width
         )
-        # TODO refactor this a bit more!
-        bot_logger.info("Pasting data to %s using range %s",
-                         tab_name, paste_range)
-        req = self.sheet_service.spreadsheets.values.update(
-            spreadsheetId=sheet_id,
-            range=sheet_range,
-            json=value_range,
+        bot_logger.info("Pasting %s rows to %s from row %s",
+                        len(data), tab_name, start_row)
+        first_rows = self._df_to_sheet_update(
+            data=data.slice(0, chunk_rows), include_header=include_header
+        )
+        first_resp, e = await self._paste_chunk(
+            sheet_id=sheet_id, tab_id=tab_id, rows=first_rows,
+            start_row=start_row - 1, width=width, clear_below=True,
+            extra_requests=expansion,
+            ctx=ctx
+        )
+        if e is not None:
+            if self._is_stale_tab_error(e=e):
+                self._invalidate_tab_properties(sheet_id=sheet_id)
+            return None, e
+        if expansion:
+            # Cached grid size is outdated now
+            self._invalidate_tab_properties(sheet_id=sheet_id)
+        semaphore = asyncio.Semaphore(self.paste_concurrency)
 
-            valueInputOption="RAW",
-            includeValuesInResponse=False,
-            responseValueRenderOption="UNFORMATTED_VALUE",
-            responseDateTimeRenderOption="SERIAL_NUMBER"
+        async def paste_rest(offset: int) -> tuple:
+            async with semaphore:
+                # Serializing inside the semaphore bounds memory too
+                rows = self._df_to_sheet_update(
+                    data=data.slice(offset, chunk_rows), include_header=False
+                )
+                return await self._paste_chunk(
+                    sheet_id=sheet_id, tab_id=tab_id, rows=rows,
+                    start_row=data_row + offset, width=width,
+                    clear_below=False,
+                    ctx=ctx
+                )
+
+        results = await asyncio.gather(
+            *(paste_rest(offset)
+              for offset in range(chunk_rows, len(data), chunk_rows))
         )
-        return await self._request_wrapper(req=req, req_type=WRITE_REQUEST_TYPE)
+        for _, e in results:
+            if e is not None:
+                bot_logger.error("Pasting a chunk to %s failed: %s",
+                                 tab_name, e)
+                return None, e
+        return [first_resp] + [resp for resp, _ in results], None
     
     @staticmethod
     def _compute_number_of_rows_to_drop(current_len: int, new_len: int,
-                                        row_limit: int):
+                                        row_limit: int,
+                                        low_watermark: Optional[int] = None):
         """
-        Computes number of rows to delete to comply with row_limit
+        ### Computes number of rows to delete to comply with row_limit
+        Once row_limit (high watermark) is passed, enough rows are dropped
+        to get down to low_watermark so that the next appends do not need
+        a trim. Only existing rows can be dropped.
         """
-        bot_logger.debug("current: %s, new: %s, limit %s",
-                         current_len, new_len, row_limit)
+        if low_watermark is None or low_watermark > row_limit:
+            low_watermark = row_limit
+        bot_logger.debug("current: %s, new: %s, limit %s, low watermark %s",
+                         current_len, new_len, row_limit, low_watermark)
         to_delete = 0
         if (tot_len := (current_len + new_len)) > row_limit:
-            to_delete = tot_len - row_limit
+            to_delete = min(tot_len - low_watermark, current_len)
         return to_delete
+
+    async def trim_tab(self, sheet_id: str, tab_name: str, row_limit: int,
+                       low_watermark: Optional[int] = None,
+                       ctx: Optional[RequestContext] = None) -> tuple:
+        """
+        ### Trims a tab down to low_watermark data rows if it is over row_limit
+        Meant for background compaction, no-op for tabs within the limit.
+        Requests are sent with background priority unless ctx says otherwise.
+        :return: tuple(number of deleted rows, error if any)
+        """
+        ctx = self._request_ctx(ctx=ctx, sheet_id=sheet_id)
+        ctx = ctx.replace(priority=ctx.priority or BACKGROUND_PRIORITY)
+        rows, e = await self.get_row_count(sheet_id=sheet_id,
+                                           tab_name=tab_name, ctx=ctx)
+        if e is not None:
+            return None, e
+        to_delete = self._compute_number_of_rows_to_drop(
+            current_len=max(rows - 1, 0), new_len=0, row_limit=row_limit,
+            low_watermark=low_watermark
+        )
+        if to_delete == 0:
+            return 0, None
+        bot_logger.info("Trimming %s rows of %s", to_delete, tab_name)
+        # End of the range is exclusive so doing +1
+        _, e = await self.delete_rows(sheet_id=sheet_id, tab_name=tab_name,
+                                      end=to_delete+1, ctx=ctx)
+        if e is not None:
+            return None, e
+        return to_delete, None
     
     async def append_data_native(self, sheet_id: str, tab_name: str,
                                  data: pl.DataFrame, row_limit: int,
-                                 include_header: Optional[bool] = None):
+                                 include_header: Optional[bool] = None,
+                                 low_watermark: Optional[int] = None,
+                                 ctx: Optional[RequestContext] = None):
         """
         Uses native append Method of the Gsheet API to add new rows to
         the sheet.
+        :param row_limit: max number of data rows the tab can have
+        :param low_watermark: number of data rows the tab is trimmed to
+            once row_limit is passed, row_limit by default
         """
+        ctx = self._request_ctx(ctx=ctx, sheet_id=sheet_id)
         if include_header is None:
             include_header = False
-        # Get current data + check for errorrs
-        curr_data = await self.read_sheet(sheet_id=sheet_id,
-                                          tab_name=tab_name,
-                                          as_df=True)
-        # TODO error check (read_sheet needs to be updated)
-        current_len = len(curr_data)
+        # Only the row count is needed, not the data itself
+        rows, e = await self.get_row_count(sheet_id=sheet_id,
+                                           tab_name=tab_name, ctx=ctx)
+        if e is not None:
+            return None, e
+        # Header row is not data
+        current_len = max(rows - 1, 0)
         new_len = len(data)
         to_delete = self._compute_number_of_rows_to_drop(
             current_len=current_len, new_len=new_len,
-            row_limit=row_limit
+            row_limit=row_limit, low_watermark=low_watermark
         )
         bot_logger.debug("Have to delete %s rows", to_delete)
-
-        if to_delete > 0:
-            # End of the range is exclusive so doing +1
-            _, _ = await self.delete_rows(sheet_id=sheet_id,
-                                          tab_name=tab_name,
-                                          end=to_delete+1)
-        paste_pos = current_len - to_delete 
-        # Prepare append request
         data_update = self._df_to_sheet_update(
             data=data, include_header=include_header
         )
+        if to_delete > 0:
+            return await self._trim_and_append(
+                sheet_id=sheet_id, tab_name=tab_name, data=data,
+                data_update=data_update, rows=rows, to_delete=to_delete,
+                ctx=ctx
+            )
+        paste_pos = current_len - to_delete 
+        # Prepare append request
         paste_range = self._df_to_update_range(data=data, start_row=paste_pos)
-        sheet_range = f"{tab_name}!{paste_range}"
+        sheet_range = f"{self.quote_tab_name(tab_name)}!{paste_range}"
         value_range = self._sheet_update_and_range_to_value_range(
             sheet_range=sheet_range, data_update=data_update
         )
@@ -541,14 +1535,185 @@ class GoogleSheetAsyncGateway(GoogleSheetMapper):
         )
         # Execute append request
         bot_logger.debug("Appending Natively")
-        return await self._request_wrapper(req=req, req_type=WRITE_REQUEST_TYPE)
+        resp, e = await self._request_wrapper(req=req,
+                                              req_type=WRITE_REQUEST_TYPE,
+                                              ctx=ctx)
+        if e is None:
+            # INSERT_ROWS grows the grid by the appended rows
+            appended = resp.get("updates", {}).get("updatedRows",
+                                                   len(data_update))
+            self._resize_cached_grid(sheet_id=sheet_id, tab_name=tab_name,
+                                     delta=appended)
+        self._update_row_count_from_append(sheet_id=sheet_id,
+                                           tab_name=tab_name, resp=resp, e=e)
+        return resp, e
+
+    async def _trim_and_append(self, sheet_id: str, tab_name: str,
+                               data: pl.DataFrame, data_update: list,
+                               rows: int, to_delete: int,
+                               ctx: Optional[RequestContext] = None) -> tuple:
+        """
+        ### Deletes oldest rows & appends data_update in one batchUpdate
+        Response gets an append-like updates section computed from
+        the row count so that callers can treat it as a values.append one.
+        :param rows: used rows of the tab before the request, header included
+        """
+        sheet_tabs_data, e = await self.get_tab_properties(sheet_id=sheet_id,
+                                                           ctx=ctx)
+        if e is not None:
+            return None, e
+        tab_id, e = await self._tab_name_to_tab_id(
+            sheet_id=sheet_id, tab_name=tab_name,
+            sheet_tabs_data=sheet_tabs_data
+        )
+        if e is not None:
+            return None, e
+        # Zero is the header row, end of the range is exclusive
+        req_body = self._trim_and_append_params_to_body(
+            tab_id=tab_id, start=1, end=to_delete+1, rows=data_update
+        )
+        req = self.sheet_service.spreadsheets.batchUpdate(
+            spreadsheetId=sheet_id,
+            json=req_body
+        )
+        bot_logger.debug("Trimming %s rows & appending %s in one request",
+                         to_delete, len(data_update))
+        resp, e = await self._request_wrapper(
+            req=req, req_type=WRITE_REQUEST_TYPE,
+            weight=self.request_weights["batch_update"],
+            ctx=ctx
+        )
+        if e is not None:
+            if self._is_stale_tab_error(e=e):
+                self._invalidate_tab_properties(sheet_id=sheet_id)
+            self._invalidate_row_count(sheet_id=sheet_id, tab_name=tab_name)
+            return None, e
+        first_row = rows - to_delete + 1
+        last_row = first_row + len(data_update) - 1
+        # appendCells only adds the rows that do not fit the trimmed grid
+        self._resize_cached_grid(sheet_id=sheet_id, tab_name=tab_name,
+                                 delta=-to_delete, min_rows=last_row)
+        self._set_row_count(sheet_id=sheet_id, tab_name=tab_name,
+                            rows=last_row)
+        resp["updates"] = {
+            "spreadsheetId": sheet_id,
+            "updatedRange": (f"{self.quote_tab_name(tab_name)}!A{first_row}:"
+                             f"{self.num_to_sheet_range(len(data.columns))}"
+                             f"{last_row}"),
+            "updatedRows": len(data_update)
+        }
+        return resp, None
+
+    async def append_data_coalesced(
+            self, sheet_id: str, tab_name: str, data: pl.DataFrame,
+            row_limit: int, low_watermark: Optional[int] = None,
+            ctx: Optional[RequestContext] = None
+        ) -> tuple:
+        """
+        ### Appends data together with other rows sent to the same tab
+        Rows arriving within append_coalesce_window go as one
+        append_data_native call. Each caller gets a response covering
+        its own rows only.
+        :param ctx: user the rows are appended for, the coalesced request
+            is rate limited as the one of the caller opening the batch
+        :return: tuple(append response, error if any)
+        """
+        ctx = self._request_ctx(ctx=ctx, sheet_id=sheet_id)
+        key = (sheet_id, tab_name)
+        future = asyncio.get_running_loop().create_future()
+        batch = self._pending_appends.get(key, None)
+        if low_watermark is None:
+            low_watermark = row_limit
+        if batch is None:
+            # Coalesced request is charged to the caller opening the batch
+            batch = {"row_limit": row_limit, "low_watermark": low_watermark,
+                     "ctx": ctx, "items": []}
+            self._pending_appends[key] = batch
+            # Keeping a reference so that the task is not garbage collected
+            batch["task"] = asyncio.create_task(self._flush_appends(key=key))
+        batch["row_limit"] = min(batch["row_limit"], row_limit)
+        batch["low_watermark"] = min(batch["low_watermark"], low_watermark)
+        batch["items"].append((data, future))
+        # Shielded so that a cancelled caller does not fail others
+        return await asyncio.shield(future)
+
+    async def _flush_appends(self, key: tuple):
+        """
+        ### Sends rows gathered for key once the coalescing window is over
+        Batches of one tab are sent one at a time, otherwise trims could
+        run twice and an older response could lower the cached row count.
+        Rows arriving while a batch is in flight join the next batch.
+        """
+        await asyncio.sleep(self.append_coalesce_window)
+        lock = self._append_locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            # Batch stays open to new rows until the previous one is sent
+            batch = self._pending_appends.pop(key)
+            await self._send_append_batch(key=key, batch=batch)
+            if key not in self._pending_appends:
+                # No batch waiting for the lock
+                del self._append_locks[key]
+
+    async def _send_append_batch(self, key: tuple, batch: dict):
+        """
+        Appends rows of batch, resolves futures of its callers
+        """
+        sheet_id, tab_name = key
+        frames = [df for df, _ in batch["items"]]
+        futures = [future for _, future in batch["items"]]
+        bot_logger.debug("Appending %s coalesced batches to %s",
+                         len(frames), tab_name)
+        try:
+            resp, e = await self.append_data_native(
+                sheet_id=sheet_id, tab_name=tab_name,
+                data=pl.concat(frames, how="vertical"),
+                row_limit=batch["row_limit"],
+                low_watermark=batch["low_watermark"],
+                ctx=batch["ctx"]
+            )
+            if e is None:
+                results = [
+                    (part, None) for part in self._split_append_response(
+                        resp=resp, sizes=[len(df) for df in frames]
+                    )
+                ]
+            else:
+                results = [(None, e)] * len(futures)
+        except Exception as err:
+            bot_logger.error("Coalesced append to %s failed: %s",
+                             tab_name, err)
+            results = [(None, err)] * len(futures)
+        for future, result in zip(futures, results):
+            if not future.done():
+                future.set_result(result)
+
+    def _update_row_count_from_append(self, sheet_id: str, tab_name: str,
+                                      resp: Optional[dict],
+                                      e: Optional[Exception]):
+        """
+        Keeps row count cache in sync using updatedRange of append response
+        """
+        try:
+            if e is not None:
+                raise e
+            last_row = self._updated_range_to_last_row(
+                resp["updates"]["updatedRange"]
+            )
+        except Exception as err:
+            bot_logger.debug("Can't get row count from append: %s", err)
+            self._invalidate_row_count(sheet_id=sheet_id, tab_name=tab_name)
+            return
+        self._set_row_count(sheet_id=sheet_id, tab_name=tab_name,
+                            rows=last_row)
     
     async def add_sheet(self, sheet_id: str, title: str, 
                         rows: Optional[int] = None,
-                        columns: Optional[int] = None):
+                        columns: Optional[int] = None,
+                        ctx: Optional[RequestContext] = None):
         """
         Adds a new sheet to the spreadsheet
         """
+        ctx = self._request_ctx(ctx=ctx, sheet_id=sheet_id)
         rows = rows or 1000
         columns = columns or 1000
         json_body = self._add_sheet_params_to_add_sheet_body(
@@ -558,7 +1723,34 @@ class GoogleSheetAsyncGateway(GoogleSheetMapper):
             spreadsheetId=sheet_id,
             json=json_body
         )
-        return await self._request_wrapper(req=req, req_type=WRITE_REQUEST_TYPE)
+        self._invalidate_row_count(sheet_id=sheet_id, tab_name=title)
+        resp, e = await self._request_wrapper(
+            req=req, req_type=WRITE_REQUEST_TYPE,
+            weight=self.request_weights["batch_update"],
+            ctx=ctx
+        )
+        self._update_tab_properties_from_add_sheet(sheet_id=sheet_id,
+                                                   resp=resp, e=e)
+        return resp, e
+
+    def _update_tab_properties_from_add_sheet(self, sheet_id: str,
+                                              resp: Optional[dict],
+                                              e: Optional[Exception]):
+        """
+        Adds properties of a new tab to the metadata cache
+        using the addSheet reply, drops the cache entry if that fails
+        """
+        tabs = self._tab_properties.get(sheet_id, None)
+        try:
+            if e is not None:
+                raise e
+            props = resp["replies"][0]["addSheet"]["properties"]
+            if tabs is None:
+                return
+            tabs[props["title"]] = props
+        except Exception as err:
+            bot_logger.debug("Can't cache properties of a new tab: %s", err)
+            self._invalidate_tab_properties(sheet_id=sheet_id)
 
 
 #TODO Oct 3 2023:
@@ -0,0 +1,206 @@
+"""
+Module implements an async facade on top of the local cache
+"""
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Union
+
+from alfredo_lib import MAIN_CFG
+from alfredo_lib.local_persistence import cache, models
+
+bot_logger = logging.getLogger(MAIN_CFG["main_logger_name"])
+
+
+class AsyncCache:
+    """
+    ### Async counterpart of cache.Cache
+    Runs blocking sqlite calls on a dedicated executor so that
+    the event loop keeps serving other users while the db works.
+    Method names & return values mirror cache.Cache.
+    """
+    def __init__(self, local_cache: cache.Cache,
+                 workers: Optional[int] = None):
+        """
+        Instantiates the class
+        :param local_cache: sync cache instance doing the actual db work
+        :param workers: number of db threads, 1 keeps sqlite writes serial
+        """
+        workers = workers or 1
+        self.lc = local_cache
+        self.executor = ThreadPoolExecutor(max_workers=workers,
+                                           thread_name_prefix="alfredo_db")
+        bot_logger.debug("Instantiated AsyncCache with %s workers", workers)
+
+    async def _run(self, func: Callable, *args, **kwargs):
+        """
+        Runs func with args & kwargs on the db executor
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, functools.partial(func, *args, **kwargs)
+        )
+
+    def shutdown(self, wait: Optional[bool] = None):
+        """
+        Stops the db executor, waits for pending calls by default
+        """
+        if wait is None:
+            wait = True
+        self.executor.shutdown(wait=wait)
+
+    def parse_db_row(self, row, mode: Optional[str] = None):
+        """
+        Parses an ORM row according to mode. CPU only, hence not awaitable.
+        """
+        return self.lc.parse_db_row(row=row, mode=mode)
+
+    def user_cache_stats(self) -> dict:
+        """
+        Reports hit / miss counters of the user cache. In memory, not awaitable.
+        """
+        return self.lc.user_cache_stats()
+
+    async def create_user(self, reg_data: dict) -> tuple:
+        """
+        Awaitable cache.Cache.create_user
+        """
+        return await self._run(self.lc.create_user, reg_data)
+
+    async def get_user(self, discord_id: int,
+                       parse_mode: Optional[str] = None) -> tuple:
+        """
+        Awaitable cache.Cache.get_user
+        """
+        return await self._run(self.lc.get_user, discord_id=discord_id,
+                               parse_mode=parse_mode)
+
+    async def update_user_data(self, discord_id: int,
+                               user_update: dict) -> Union[Exception, None]:
+        """
+        Awaitable cache.Cache.update_user_data
+        """
+        return await self._run(self.lc.update_user_data,
+                               discord_id=discord_id, user_update=user_update)
+
+    async def create_transaction(self, tr_data: dict) -> tuple:
+        """
+        Awaitable cache.Cache.create_transaction
+        """
+        return await self._run(self.lc.create_transaction, tr_data)
+
+    async def update_transaction(
+            self, update: dict,
+            transaction: models.Transaction
+        ) -> Union[Exception, None]:
+        """
+        Awaitable cache.Cache.update_transaction
+        """
+        return await self._run(self.lc.update_transaction, update=update,
+                               transaction=transaction)
+
+    async def delete_transaction(
+            self, transaction_id: int
+        ) -> Union[Exception, None]:
+        """
+        Awaitable cache.Cache.delete_transaction
+        """
+        return await self._run(self.lc.delete_transaction,
+                               transaction_id=transaction_id)
+
+    async def get_user_transactions(self, user: models.User,
+                                    parse_mode: Optional[str] = None):
+        """
+        Awaitable cache.Cache.get_user_transactions
+        """
+        return await self._run(self.lc.get_user_transactions, user=user,
+                               parse_mode=parse_mode)
+
+    async def fetch_category(self, category_id: int) -> models.Category:
+        """
+        Awaitable cache.Cache._fetch_category
+        """
+        return await self._run(self.lc._fetch_category,
+                               category_id=category_id)
+
+    async def fetch_categories(self) -> List[models.Category]:
+        """
+        Awaitable cache.Cache._fetch_categories
+        """
+        return await self._run(self.lc._fetch_categories)
+
+    async def get_categories(self, parse_mode: Optional[str] = None) -> tuple:
+        """
+        Awaitable cache.Cache.get_categories.
+        Served from the in-memory registry, hence no executor roundtrip.
+        """
+        return self.lc.get_categories(parse_mode=parse_mode)
+
+    async def get_category_buttons(self) -> tuple:
+        """
+        Awaitable cache.Cache.get_category_buttons, in-memory too
+        """
+        return self.lc.get_category_buttons()
+
+    async def create_category(self, category_data: dict) -> tuple:
+        """
+        Awaitable cache.Cache.create_category
+        """
+        return await self._run(self.lc.create_category,
+                               category_data=category_data)
+
+    async def update_category(self, category_id: int, update: dict):
+        """
+        Awaitable cache.Cache.update_category
+        """
+        return await self._run(self.lc.update_category,
+                               category_id=category_id, update=update)
+
+    async def delete_category(
+            self, category: models.Category
+        ) -> Union[Exception, None]:
+        """
+        Awaitable cache.Cache.delete_category
+        """
+        return await self._run(self.lc.delete_category, category=category)
+
+    async def enqueue_transaction_to_sheet(self, transaction_id: int,
+                                           outbox_data: dict) -> tuple:
+        """
+        Awaitable cache.Cache.enqueue_transaction_to_sheet
+        """
+        return await self._run(self.lc.enqueue_transaction_to_sheet,
+                               transaction_id=transaction_id,
+                               outbox_data=outbox_data)
+
+    async def get_due_outbox_items(
+            self, limit: int
+        ) -> List[models.SheetOutboxItem]:
+        """
+        Awaitable cache.Cache.get_due_outbox_items
+        """
+        return await self._run(self.lc.get_due_outbox_items, limit=limit)
+
+    async def update_outbox_item(self, outbox_id: int,
+                                 update: dict) -> Union[Exception, None]:
+        """
+        Awaitable cache.Cache.update_outbox_item
+        """
+        return await self._run(self.lc.update_outbox_item,
+                               outbox_id=outbox_id, update=update)
+
+    async def delete_outbox_item(
+            self, outbox_id: int
+        ) -> Union[Exception, None]:
+        """
+        Awaitable cache.Cache.delete_outbox_item
+        """
+        return await self._run(self.lc.delete_outbox_item,
+                               outbox_id=outbox_id)
+
+    async def delete_row(self, row_struct) -> Union[Exception, None]:
+        """
+        Awaitable cache.Cache.delete_row
+        """
+        return await self._run(self.lc.delete_row, row_struct=row_struct)
@@ -1,18 +1,21 @@
 """
 Module implements classes for interacting with a local DB using ORM
 """
+import functools
 import json
 import logging
 import re
+import threading
 import time
 from pathlib import Path
 from typing import List, Optional, Union
 
+import cachetools
 import polars as pl
-from sqlalchemy import create_engine, engine, exc, orm
+from sqlalchemy import create_engine, engine, event, exc, insert, orm
 
 from alfredo_lib import MAIN_CFG
-from alfredo_lib.local_persistence import models
+from alfredo_lib.local_persistence import migrations, models
 
 # Get loggers
 bot_logger = logging.getLogger(MAIN_CFG["main_logger_name"])
@@ -35,6 +38,20 @@ OK_ROW_PARSE_MODES = {
     ROW_PARSE_MODE_DF
 }
 
+# Statuses of sheet outbox items
+OUTBOX_STATUS_PENDING = "pending"
+OUTBOX_STATUS_FAILED = "failed"
+
+# PRAGMAs a storage profile from main config is allowed to set
+STORAGE_PRAGMAS = {
+    "journal_mode",
+    "synchronous",
+    "mmap_size",
+    "cache_size",
+    "busy_timeout",
+    "temp_store"
+}
+
 class DbErrorHandler:
     """
     Class respponsible for parsing DB errors.
@@ -88,24 +105,55 @@ class BaseCache(DbErrorHandler):
     """
     Class responsible for all the db operations
     """
-    def __init__(self, db_path: str):
+    def __init__(self, db_path: str,
+                 storage_profile: Optional[dict] = None):
         """
         Instantiates the class, creates the db & tables if they do not exist
+        :param storage_profile: sqlite PRAGMAs to set on every connection,
+            profile named by sqlite_profile in main config by default
         """
+        if storage_profile is None:
+            storage_profile = (
+                MAIN_CFG["sqlite_profiles"][MAIN_CFG["sqlite_profile"]]
+            )
         self.db_path_raw = db_path
         self.logs_table = models.LogRecord
-        self.engine = self._create_engine(db_path)
-        # TODO Check if the below two lines can be merged?
-        Session = orm.sessionmaker(bind=self.engine)
-        self.sesh = Session()
+        self.storage_profile = storage_profile
+        self.engine = self._create_engine(db_path,
+                                          storage_profile=storage_profile)
+        # One short-lived session per unit of work instead of a shared one:
+        # callers (bot commands, logging thread) do not step on each other.
+        # Objects stay readable after commit to be usable outside a session.
+        self.session_factory = orm.sessionmaker(bind=self.engine,
+                                                expire_on_commit=False)
         self.base = models.Base
     # Create all the tables on init (along with session and )
     # Write user-related operations
     
     @staticmethod
-    def _create_engine(db_path: str) -> engine.Engine:
+    def _apply_storage_profile(dbapi_conn, connection_record,
+                               storage_profile: dict):
+        """
+        ### Engine connect listener setting storage_profile PRAGMAs
+        """
+        cursor = dbapi_conn.cursor()
+        try:
+            for pragma, value in storage_profile.items():
+                # PRAGMA does not support bound parameters, hence validation
+                if pragma not in STORAGE_PRAGMAS:
+                    raise ValueError(f"Unsupported sqlite pragma: {pragma}")
+                if not re.fullmatch(r"-?\w+", str(value)):
+                    raise ValueError(f"Bad value for {pragma}: {value}")
+                cursor.execute(f"PRAGMA {pragma} = {value}")
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def _create_engine(db_path: str,
+                       storage_profile: Optional[dict] = None) -> engine.Engine:
         """
         Creates engine object, creates folders in db_path if they don't exist
+        :param storage_profile: sqlite PRAGMAs applied on every new connection
         """
         path_obj = Path(db_path)
         parent_dir = path_obj.parent
@@ -117,7 +165,17 @@ class BaseCache(DbErrorHandler):
         parent_dir.mkdir(parents=True, exist_ok=True)
         bot_logger.debug("Created dirs for DB")
         
-        return create_engine(f"sqlite:///{path_obj.absolute()}", echo=False)
+        db_engine = create_engine(f"sqlite:///{path_obj.absolute()}",
+                                  echo=False)
+        if storage_profile:
+            event.listen(
+                db_engine, "connect",
+                functools.partial(BaseCache._apply_storage_profile,
+                                  storage_profile=storage_profile)
+            )
+            bot_logger.debug("Using sqlite storage profile: %s",
+                             storage_profile)
+        return db_engine
     
     def _drop_all_tables(self):
         """
@@ -135,6 +193,14 @@ class BaseCache(DbErrorHandler):
         bot_logger.debug("Creating db schema")
         self.base.metadata.create_all(self.engine)
 
+    def _migrate_db(self):
+        """
+        Brings schema of an existing db up to date, create_all can't do it
+        """
+        version, e = migrations.MigrationRunner(db_engine=self.engine).apply()
+        if e is not None:
+            bot_logger.error("DB stuck at schema version %s: %s", version, e)
+
     @staticmethod
     def _generate_ts() -> int:
         """
@@ -219,12 +285,13 @@ class BaseCache(DbErrorHandler):
         :return: error if any
         """
         # Add to db
-        try:
-            self.sesh.add(row_struct)
-            self.sesh.commit()
-        except Exception as e:
-            self.sesh.rollback()
-            return e
+        with self.session_factory() as sesh:
+            try:
+                sesh.add(row_struct)
+                sesh.commit()
+            except Exception as e:
+                sesh.rollback()
+                return e
         
     def delete_row(self, row_struct: engine.ResultProxy) -> Union[Exception, None]:
         """
@@ -232,12 +299,14 @@ class BaseCache(DbErrorHandler):
         :param row_struct: sqlalchemy row object
         :return: error if any
         """
-        try:
-            self.sesh.delete(row_struct)
-            self.sesh.commit()
-        except Exception as e:
-            self.sesh.rollback()
-            return e
+        with self.session_factory() as sesh:
+            try:
+                # Rows usually come from another (closed) session
+                sesh.delete(sesh.merge(row_struct))
+                sesh.commit()
+            except Exception as e:
+                sesh.rollback()
+                return e
         
     def add_log_row(self, record: logging.LogRecord):
         """
@@ -258,17 +327,94 @@ class BaseCache(DbErrorHandler):
         if res is not None:
             backup_logger.error(f"Adding new DB row failed: {e}")
 
+    def _log_record_to_row_data(self, record: logging.LogRecord) -> dict:
+        """
+        Mapper converting a LogRecord to logs table column values
+        """
+        return {
+            "created": int(record.created * 1000),
+            "user_id": getattr(record, "user_id", None),
+            "message": record.getMessage(),
+            "level": record.levelname,
+            "func_name": record.funcName
+        }
+
+    def add_log_rows(self, records: List[logging.LogRecord]) -> Union[Exception, None]:  # noqa: E501
+        """
+        ### Writes a batch of records to the logs table with one insert
+        :param records: LogRecords from logging calls
+        :return: error if any
+        """
+        if not records:
+            return None
+        rows = [self._log_record_to_row_data(record) for record in records]
+        with self.session_factory() as sesh:
+            try:
+                # List of dicts makes it a single executemany. Core insert
+                # as the ORM one splits batches whenever user_id is None
+                sesh.execute(insert(self.logs_table.__table__), rows)
+                sesh.commit()
+            except Exception as e:
+                sesh.rollback()
+                backup_logger.error("Adding %s log rows failed: %s",
+                                    len(rows), e)
+                return e
+
 
 class UserCache(BaseCache):
     """
     ### Class encapsulates all cache operations on user data
     """
-    def __init__(self, db_path: str):
+    def __init__(self, db_path: str,
+                 storage_profile: Optional[dict] = None):
         """
         Instantiates the class, creates the db & tables if they do not exist
         """
-        super().__init__(db_path)
+        super().__init__(db_path, storage_profile=storage_profile)
         self.users_table = models.User
+        # Read-through cache of User rows keyed by discord_id
+        self._user_cache = cachetools.TTLCache(
+            maxsize=MAIN_CFG["user_cache"]["maxsize"],
+            ttl=MAIN_CFG["user_cache"]["ttl"]
+        )
+        # Cache is touched from several threads (db executor, logging)
+        self._user_cache_lock = threading.Lock()
+        # Bumped on every invalidation to avoid caching reads racing writes
+        self._user_cache_version = 0
+        self.user_cache_hits = 0
+        self.user_cache_misses = 0
+
+    def _invalidate_user(self, discord_id: int):
+        """
+        Drops discord_id from the user cache, called on user writes
+        """
+        with self._user_cache_lock:
+            self._user_cache.pop(discord_id, None)
+            self._user_cache_version += 1
+        bot_logger.debug("Invalidated cached user %s", discord_id)
+
+    @staticmethod
+    def _copy_user(user: models.User) -> models.User:
+        """
+        ### Copies column values of user to a new detached User
+        Callers get their own copy, changing it does not change the cached
+        one or other callers' copies. Relationships are not copied.
+        """
+        return models.User(**{col.name: getattr(user, col.name)
+                              for col in models.User.__table__.columns})
+
+    def user_cache_stats(self) -> dict:
+        """
+        Reports hit / miss counters of the user cache
+        """
+        with self._user_cache_lock:
+            lookups = self.user_cache_hits + self.user_cache_misses
+            return {
+                "hits": self.user_cache_hits,
+                "misses": self.user_cache_misses,
+                "hit_ratio": self.user_cache_hits / lookups if lookups else 0.,
+                "size": len(self._user_cache)
+            }
 
     def create_user(self, reg_data: dict) -> tuple:
         """
@@ -291,6 +437,7 @@ class UserCache(BaseCache):
         bot_logger.debug(f"Prepared user data for {username} reg.")
         # Add to db (this also rollbacks in case of errors)
         res = self._add_new_row(user_row)
+        self._invalidate_user(discord_id=reg_data["discord_id"])
         # Save path w/o issues
         if res is None:
             user_msg = f"{username} registered"
@@ -308,14 +455,27 @@ class UserCache(BaseCache):
         """
         ### Fetches data on user with discord_id from the db
         :param discord_id: discord id of a user
-        :return: tuple(User, error if any)
-        """
-        user = (self.sesh.query(models.User)
-                .filter(models.User.discord_id==discord_id).first())
+        :return: tuple(copy of the User, error if any)
+        """
+        with self._user_cache_lock:
+            user = self._user_cache.get(discord_id, None)
+            if user is not None:
+                self.user_cache_hits += 1
+                bot_logger.debug("User cache hit for %s", discord_id)
+                return self._copy_user(user), None
+            self.user_cache_misses += 1
+            version = self._user_cache_version
+        with self.session_factory() as sesh:
+            user = (sesh.query(models.User)
+                    .filter(models.User.discord_id==discord_id).first())
         if user is None:
             bot_logger.debug(f"No results for {discord_id}")
             return None, ValueError("User not registered")
-        return user, None  
+        with self._user_cache_lock:
+            # Skipping the write if the user was invalidated while reading
+            if version == self._user_cache_version:
+                self._user_cache[discord_id] = user
+        return self._copy_user(user), None
     
     def get_user(self, discord_id: int,
                  parse_mode: Optional[str] = None) -> tuple:
@@ -351,27 +511,46 @@ class UserCache(BaseCache):
         ### Updates field with value in users table
         :return: error if any
         """
-        (self.sesh.query(models.User).filter(models.User.discord_id == discord_id)
-         .update(user_update))
-        try: 
-            self.sesh.commit()
-            bot_logger.debug("Update query succeeded for user %s", discord_id)
-            return None
-        except Exception as e:
-            bot_logger.error("Update query failed for user %s: %s", discord_id, e)
-            self.sesh.rollback()
-            return e
+        with self.session_factory() as sesh:
+            try:
+                (sesh.query(models.User)
+                 .filter(models.User.discord_id == discord_id)
+                 .update(user_update))
+                sesh.commit()
+                bot_logger.debug("Update query succeeded for user %s",
+                                 discord_id)
+                return None
+            except Exception as e:
+                bot_logger.error("Update query failed for user %s: %s",
+                                 discord_id, e)
+                sesh.rollback()
+                return e
+            finally:
+                self._invalidate_user(discord_id=discord_id)
+
+    def delete_row(
+            self, row_struct: engine.ResultProxy
+        ) -> Union[Exception, None]:
+        """
+        Removes row_struct from the db, uncaches it if it is a User
+        :return: error if any
+        """
+        e = super().delete_row(row_struct=row_struct)
+        if isinstance(row_struct, models.User):
+            self._invalidate_user(discord_id=row_struct.discord_id)
+        return e
 
 
 class TransactionCache(BaseCache):
     """
     Class encapsulates all cache operations on transaction data.
     """
-    def __init__(self, db_path: str):
+    def __init__(self, db_path: str,
+                 storage_profile: Optional[dict] = None):
         """
         Instantiates the class
         """
-        super().__init__(db_path=db_path)
+        super().__init__(db_path=db_path, storage_profile=storage_profile)
         self.transactions_table = models.Transaction
 
     def create_transaction(self, tr_data: dict) -> tuple:
@@ -410,75 +589,152 @@ class TransactionCache(BaseCache):
         """
         Updates transaction
         """
-        tr_to_update = self.sesh.query(models.Transaction).filter(
-            models.Transaction.transaction_id == transaction.transaction_id
-        )
-        tr_to_update.update(update)
-        try: 
-            self.sesh.commit()
-            bot_logger.debug("Update query succeeded for transaction %s",
-                             transaction.transaction_id)
-        except Exception as e:
-            bot_logger.error("Update query failed for transaction %s: %s",
-                             transaction.transaction_id, e)
-            self.sesh.rollback()
-            return e
+        with self.session_factory() as sesh:
+            try:
+                sesh.query(models.Transaction).filter(
+                    models.Transaction.transaction_id == transaction.transaction_id
+                ).update(update)
+                sesh.commit()
+                bot_logger.debug("Update query succeeded for transaction %s",
+                                 transaction.transaction_id)
+            except Exception as e:
+                bot_logger.error("Update query failed for transaction %s: %s",
+                                 transaction.transaction_id, e)
+                sesh.rollback()
+                return e
+
+    def delete_transaction(self, transaction_id: int) -> Union[Exception, None]:
+        """
+        Deletes transaction with transaction_id
+        :return: error if any
+        """
+        with self.session_factory() as sesh:
+            try:
+                sesh.query(models.Transaction).filter(
+                    models.Transaction.transaction_id == transaction_id
+                ).delete()
+                sesh.commit()
+                bot_logger.debug("Deleted transaction %s", transaction_id)
+            except Exception as e:
+                bot_logger.error("Deleting transaction %s failed: %s",
+                                 transaction_id, e)
+                sesh.rollback()
+                return e
         
 
+# Discord rejects button labels longer than this
+BUTTON_LABEL_MAX_LEN = 80
+
+
+class CategoryRegistry:
+    """
+    ### Immutable in-memory snapshot of the categories table
+    Precomputes everything category prompts need so that
+    they do not touch the db or serialize anything.
+    """
+    def __init__(self, version: int, category_rows: list):
+        """
+        Instantiates the snapshot
+        :param version: counter bumped on every refresh of the registry
+        :param category_rows: rows with category_id & category_name
+        """
+        self.version = version
+        self.rows = list(category_rows)
+        self.as_dict = {row.category_id: row.category_name
+                        for row in self.rows}
+        self.as_json = json.dumps(self.as_dict, indent=4)
+        # (label, category_id) pairs for TransactionButton
+        self.button_specs = [
+            (name[:BUTTON_LABEL_MAX_LEN], cat_id)
+            for cat_id, name in self.as_dict.items()
+        ]
+
+
 class CategoryCache(BaseCache):
     """
     Encompasses operations on category data
     """
-    def __init__(self, db_path: str):
+    def __init__(self, db_path: str,
+                 storage_profile: Optional[dict] = None):
         """
         Instantiates the class
         """
-        super().__init__(db_path=db_path)
+        super().__init__(db_path=db_path, storage_profile=storage_profile)
         self.categories_table = models.Category
+        # Populated by refresh_categories once tables exist
+        self.category_registry = CategoryRegistry(version=0, category_rows=[])
+        self._category_registry_lock = threading.Lock()
+
+    def refresh_categories(self) -> Union[Exception, None]:
+        """
+        Reloads the category registry from the db, called on mutations
+        :return: error if any
+        """
+        with self._category_registry_lock:
+            try:
+                category_rows = self._fetch_categories()
+            except Exception as e:
+                bot_logger.error("Failed to refresh categories: %s", e)
+                return e
+            # Swapping the whole object keeps readers consistent
+            self.category_registry = CategoryRegistry(
+                version=self.category_registry.version + 1,
+                category_rows=category_rows
+            )
+        bot_logger.debug("Category registry refreshed to version %s",
+                         self.category_registry.version)
 
     def _fetch_category(self, category_id: int) -> models.Category:
         """
         Fetches category row by category_id
         """
-        return self.sesh.query(
-            models.Category).filter(
-                models.Category.category_id==category_id
-            ).first()
+        with self.session_factory() as sesh:
+            return sesh.query(
+                models.Category).filter(
+                    models.Category.category_id==category_id
+                ).first()
     
     def _fetch_categories(self) -> List[models.Category]:
         """
         Fetches categories from the db
         """
-        return self.sesh.query(models.Category.category_id,
-                               models.Category.category_name).all()
+        with self.session_factory() as sesh:
+            return sesh.query(models.Category.category_id,
+                              models.Category.category_name).all()
     
     def get_categories(self, parse_mode: Optional[str] = None) -> tuple:
         """
-        Fetches categoriesfrom the db and parses to a python dict of
+        Reads categories from the in-memory registry and returns a python
+        dict of
                 {
                     category_id: category_name
                 }
-        form if parse_mode is provided
+        form (or its json string) if parse_mode is provided
         """    
-        category_rows = self._fetch_categories()
-        if len(category_rows) == 0:
+        registry = self.category_registry
+        if len(registry.rows) == 0:
             return None, ValueError("No categories in the db")
         if parse_mode is None:
             bot_logger.debug("parse_mode not provided, returing ORM object")
-            return category_rows, None
-        try:
-            res = {row.category_id: row.category_name for row in category_rows}
-            if parse_mode == ROW_PARSE_MODE_DICT:
-                return res, None
-            elif parse_mode == ROW_PARSE_MODE_STRING:
-                return json.dumps(res, indent=4), None
-            else:
-                raise Exception(
-                    f"Bad parse mode {parse_mode}. Expected: {ROW_PARSE_MODE_DICT} or {ROW_PARSE_MODE_STRING}"  # noqa: E501
-                )
-        except Exception as e:
-            bot_logger.warning("Error parsing catetory rows to dict")
-            return None, e
+            return registry.rows, None
+        if parse_mode == ROW_PARSE_MODE_DICT:
+            return registry.as_dict, None
+        elif parse_mode == ROW_PARSE_MODE_STRING:
+            return registry.as_json, None
+        bot_logger.warning("Bad parse mode for categories: %s", parse_mode)
+        return None, ValueError(
+            f"Bad parse mode {parse_mode}. Expected: {ROW_PARSE_MODE_DICT} or {ROW_PARSE_MODE_STRING}"  # noqa: E501
+        )
+
+    def get_category_buttons(self) -> tuple:
+        """
+        Returns precomputed (label, category_id) pairs for category buttons
+        :return: tuple(list of pairs, error if any)
+        """
+        registry = self.category_registry
+        if len(registry.button_specs) == 0:
+            return None, ValueError("No categories in the db")
+        return registry.button_specs, None
     
     def create_category(self, category_data: dict) -> tuple:
         """
@@ -499,6 +755,7 @@ class CategoryCache(BaseCache):
                          category_data)
         res = self._add_new_row(row_struct=category_row)
         if res is None:
+            self.refresh_categories()
             user_msg = f"{category_data['category_name']} added"
             bot_logger.debug(user_msg)
             return user_msg, None
@@ -508,33 +765,144 @@ class CategoryCache(BaseCache):
         """
         Updates category data
         """
-        category_to_update = self.sesh.query(
-            models.Category).filter(
-            models.Category.category_id==category_id
-        )
-        category_to_update.update(values=update)
-        try: 
-            self.sesh.commit()
-            bot_logger.debug("Update query succeeded for category %s",
-                             category_id)
-        except Exception as e:
-            bot_logger.error("Update query failed for category %s: %s",
-                             category_id)
-            self.sesh.rollback()
+        with self.session_factory() as sesh:
+            try:
+                sesh.query(models.Category).filter(
+                    models.Category.category_id==category_id
+                ).update(values=update)
+                sesh.commit()
+                bot_logger.debug("Update query succeeded for category %s",
+                                 category_id)
+            except Exception as e:
+                bot_logger.error("Update query failed for category %s: %s",
+                                 category_id, e)
+                sesh.rollback()
+                return e
+        self.refresh_categories()
+
+    def delete_category(self, category: models.Category) -> Union[Exception, None]:  # noqa: E501
+        """
+        Deletes category row and refreshes the category registry
+        :return: error if any
+        """
+        e = self.delete_row(row_struct=category)
+        if e is not None:
             return e
+        self.refresh_categories()
         
 
-class Cache(UserCache, TransactionCache, CategoryCache):
+class OutboxCache(BaseCache):
+    """
+    Encompasses operations on rows waiting to be sent to spreadsheets
+    """
+    def __init__(self, db_path: str,
+                 storage_profile: Optional[dict] = None):
+        """
+        Instantiates the class
+        """
+        super().__init__(db_path=db_path, storage_profile=storage_profile)
+        self.outbox_table = models.SheetOutboxItem
+
+    def enqueue_transaction_to_sheet(self, transaction_id: int,
+                                     outbox_data: dict) -> tuple:
+        """
+        ### Moves a transaction to the sheet outbox in one db transaction
+        Either both the outbox row is created and the transaction is deleted
+        or nothing changes, so transactions are never lost or sent twice.
+        :param transaction_id: id of the transaction being sent
+        :param outbox_data: column values for the outbox row
+        :return: tuple(user message, error if any)
+        """
+        outbox_data = {**outbox_data, "attempts": 0,
+                       "status": OUTBOX_STATUS_PENDING}
+        if "next_attempt_at" not in outbox_data:
+            outbox_data["next_attempt_at"] = self._generate_ts()
+        row, e = self._construct_table_row(dst_attr_name="outbox_table",
+                                           **outbox_data)
+        if e is not None:
+            return "Internal data error", e
+        with self.session_factory() as sesh:
+            try:
+                sesh.add(row)
+                sesh.query(models.Transaction).filter(
+                    models.Transaction.transaction_id == transaction_id
+                ).delete()
+                sesh.commit()
+            except Exception as e:
+                sesh.rollback()
+                bot_logger.error("Queueing transaction %s failed: %s",
+                                 transaction_id, e)
+                return "Error queueing transaction for the sheet", e
+        bot_logger.debug("Transaction %s queued as outbox item %s",
+                         transaction_id, row.outbox_id)
+        return "Transaction queued for the sheet", None
+
+    def get_due_outbox_items(self, limit: int) -> List[models.SheetOutboxItem]:
+        """
+        Fetches pending outbox items whose next attempt time has come
+        """
+        with self.session_factory() as sesh:
+            return (
+                sesh.query(models.SheetOutboxItem)
+                .filter(models.SheetOutboxItem.status == OUTBOX_STATUS_PENDING)
+                .filter(models.SheetOutboxItem.next_attempt_at
+                        <= self._generate_ts())
+                .order_by(models.SheetOutboxItem.outbox_id)
+                .limit(limit)
+                .all()
+            )
+
+    def update_outbox_item(self, outbox_id: int,
+                           update: dict) -> Union[Exception, None]:
+        """
+        Updates outbox item, used for scheduling retries
+        :return: error if any
+        """
+        with self.session_factory() as sesh:
+            try:
+                sesh.query(models.SheetOutboxItem).filter(
+                    models.SheetOutboxItem.outbox_id == outbox_id
+                ).update(update)
+                sesh.commit()
+            except Exception as e:
+                bot_logger.error("Update query failed for outbox item %s: %s",
+                                 outbox_id, e)
+                sesh.rollback()
+                return e
+
+    def delete_outbox_item(self, outbox_id: int) -> Union[Exception, None]:
+        """
+        Deletes outbox item once its data is in the sheet
+        :return: error if any
+        """
+        with self.session_factory() as sesh:
+            try:
+                sesh.query(models.SheetOutboxItem).filter(
+                    models.SheetOutboxItem.outbox_id == outbox_id
+                ).delete()
+                sesh.commit()
+            except Exception as e:
+                bot_logger.error("Deleting outbox item %s failed: %s",
+                                 outbox_id, e)
+                sesh.rollback()
+                return e
+
+
+class Cache(UserCache, TransactionCache, CategoryCache, OutboxCache):
     """
     Class unites all cache operations and is meant to be used in other modules
     """ 
-    def __init__(self, db_path: str):
+    def __init__(self, db_path: str,
+                 storage_profile: Optional[dict] = None):
         """
         Instantiates the class
         """
-        super().__init__(db_path)
+        super().__init__(db_path, storage_profile=storage_profile)
         # Actually create schema in the db, only calling in this class
         self._create_db_tables()
+        self._migrate_db()
+        # Categories are served from memory after this initial load
+        self.refresh_categories()
 
     def get_user_transactions(
             self, user: models.User,
@@ -544,26 +912,27 @@ class Cache(UserCache, TransactionCache, CategoryCache):
         Fetches transaction of the current user. 
         """
         bot_logger.debug("Reading transactions of %s", user.username)
-        # This needs to work!
-        if not user.transactions:
-            return None
-        # Then refactor this!
+        # Not touching user.transactions: user is detached from its session
         try:
-            res = (self.sesh.query(
-                models.Transaction.created,
-                models.Transaction.transaction_id,
-                models.User.username,
-                models.Transaction.amount,
-                models.Transaction.currency,
-                models.Category.category_name,
-                models.Transaction.comment,
-                models.Transaction.split_percent
-            ).join(models.User).join(models.Category)
-            .filter(models.Transaction.user_id==user.user_id)
-            .first())
+            with self.session_factory() as sesh:
+                res = (sesh.query(
+                    models.Transaction.created,
+                    models.Transaction.transaction_id,
+                    models.User.username,
+                    models.Transaction.amount,
+                    models.Transaction.currency,
+                    models.Category.category_name,
+                    models.Transaction.comment,
+                    models.Transaction.split_percent
+                ).join(models.User).join(models.Category)
+                .filter(models.Transaction.user_id==user.user_id)
+                .first())
         except Exception as e:
             bot_logger.error("Error reading transactions for %s: %s",
                              user.username, e)
+            return None
+        if res is None:
+            return None
         if parse_mode is None:
             bot_logger.debug(
                 "parse_mode not provided, returning ORM transaction object"
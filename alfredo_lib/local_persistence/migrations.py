@@ -0,0 +1,110 @@
+"""
+Module implements a lightweight versioned schema migration runner for the local db
+"""
+import logging
+from typing import List, Optional
+
+from sqlalchemy import engine
+
+from alfredo_lib import MAIN_CFG
+
+bot_logger = logging.getLogger(MAIN_CFG["main_logger_name"])
+
+
+class Migration:
+    """
+    ### Models a single schema change
+    """
+    def __init__(self, version: int, description: str, statements: List[str]):
+        """
+        Instantiates the migration
+        :param version: schema version the db has after applying statements
+        :param description: short human readable summary of the change
+        :param statements: SQL statements to run, need to be idempotent
+        """
+        self.version = version
+        self.description = description
+        self.statements = statements
+
+
+# Ordered by version. Append new migrations, never edit applied ones.
+# Index names follow sqlalchemy's ix_<table>_<column> so that create_all on
+# a fresh db and migrations on an old one end up with the same schema.
+MIGRATIONS = [
+    Migration(
+        version=1,
+        description="Index transaction foreign keys",
+        statements=[
+            "CREATE INDEX IF NOT EXISTS ix_transactions_user_id "
+            "ON transactions (user_id)",
+            "CREATE INDEX IF NOT EXISTS ix_transactions_category_id "
+            "ON transactions (category_id)"
+        ]
+    ),
+    Migration(
+        version=2,
+        description="Index logs columns used for filtering",
+        statements=[
+            "CREATE INDEX IF NOT EXISTS ix_logs_created ON logs (created)",
+            "CREATE INDEX IF NOT EXISTS ix_logs_level ON logs (level)",
+            "CREATE INDEX IF NOT EXISTS ix_logs_user_id ON logs (user_id)"
+        ]
+    )
+]
+
+
+class MigrationRunner:
+    """
+    ### Applies pending migrations in order on startup.
+    Schema version is kept in sqlite's PRAGMA user_version.
+    """
+    def __init__(self, db_engine: engine.Engine,
+                 migrations: Optional[List[Migration]] = None):
+        """
+        Instantiates the runner
+        :param db_engine: engine of the db to migrate
+        :param migrations: migrations to apply, MIGRATIONS by default
+        """
+        if migrations is None:
+            migrations = MIGRATIONS
+        self.engine = db_engine
+        self.migrations = sorted(migrations, key=lambda m: m.version)
+
+    def current_version(self) -> int:
+        """
+        Reads schema version recorded in the db
+        """
+        with self.engine.connect() as conn:
+            return conn.exec_driver_sql("PRAGMA user_version").scalar()
+
+    def pending(self) -> List[Migration]:
+        """
+        Lists migrations that are not applied yet
+        """
+        current = self.current_version()
+        return [m for m in self.migrations if m.version > current]
+
+    def apply(self) -> tuple:
+        """
+        ### Applies pending migrations, each one in its own transaction
+        :return: tuple(schema version, error if any)
+        """
+        current = self.current_version()
+        for migration in self.pending():
+            bot_logger.debug("Applying migration %s: %s",
+                             migration.version, migration.description)
+            try:
+                with self.engine.begin() as conn:
+                    for statement in migration.statements:
+                        conn.exec_driver_sql(statement)
+                    # PRAGMA does not support bound parameters
+                    conn.exec_driver_sql(
+                        f"PRAGMA user_version = {int(migration.version)}"
+                    )
+            except Exception as e:
+                bot_logger.error("Migration %s failed: %s",
+                                 migration.version, e)
+                return current, e
+            current = migration.version
+        bot_logger.debug("DB schema is at version %s", current)
+        return current, None
@@ -1,11 +1,13 @@
 """
 Module implements orm classes powering alfredo's db
 """
-from sqlalchemy import Column, Float, ForeignKey, Integer, String
+from sqlalchemy import Column, Float, ForeignKey, Integer, String, Text
 from sqlalchemy.orm import declarative_base, relationship
 
 from alfredo_lib import FLOAT_PRECISION
 
+# Indexes declared here need a matching migration in migrations.MIGRATIONS
+# for dbs created before the index was added
 Base = declarative_base()
 
 
@@ -36,7 +38,8 @@ class Transaction(Base):
     user_id = Column(
         Integer,
         ForeignKey("users.user_id", ondelete="CASCADE"),
-        nullable=False
+        nullable=False,
+        index=True
     )
     amount = Column(Float(precision=FLOAT_PRECISION), nullable=False)
     # Making it three here because of ISO 4217
@@ -45,7 +48,8 @@ class Transaction(Base):
     currency = Column(String(3), nullable=False)
     category_id = Column(Integer,
                          ForeignKey("categories.category_id"),
-                         nullable=False)
+                         nullable=False,
+                         index=True)
     comment = Column(String(100))
     split_percent = Column(Float(precision=FLOAT_PRECISION))
     # This field needs to update every time users update a transaction
@@ -73,8 +77,33 @@ class LogRecord(Base):
     __tablename__ = "logs"
     # Logging datapoints
     internal_id = Column(Integer, primary_key=True)
-    created = Column(Integer, nullable=False)
-    user_id = Column(Integer) # Can be null in some cases
+    created = Column(Integer, nullable=False, index=True)
+    user_id = Column(Integer, index=True) # Can be null in some cases
     message = Column(String(300), nullable=False)
-    level = Column(String(30), nullable=False)
-    func_name = Column(String(30), nullable=False)
\ No newline at end of file
+    level = Column(String(30), nullable=False, index=True)
+    func_name = Column(String(30), nullable=False)
+
+
+class SheetOutboxItem(Base):
+    """
+    ### Models rows waiting to be appended to a user's spreadsheet
+    """
+    __tablename__ = "sheet_outbox"
+    outbox_id = Column(Integer, primary_key=True)
+    created = Column(Integer, nullable=False)
+    user_id = Column(
+        Integer,
+        ForeignKey("users.user_id", ondelete="CASCADE"),
+        nullable=False
+    )
+    # Kept to message the user without reading users table
+    discord_id = Column(Integer, nullable=False)
+    spreadsheet = Column(String(50), nullable=False)
+    tab_name = Column(String(100), nullable=False)
+    # JSON of {"columns": [...], "rows": [[...], ...]}
+    payload = Column(Text, nullable=False)
+    attempts = Column(Integer, nullable=False, default=0)
+    # Unix ms, items are picked up by the worker once it is in the past
+    next_attempt_at = Column(Integer, nullable=False, index=True)
+    status = Column(String(10), nullable=False, default="pending")
+    last_error = Column(String(300))
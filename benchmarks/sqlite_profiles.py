@@ -0,0 +1,90 @@
+"""
+Module benchmarks local cache writes under each sqlite storage profile.
+Usage: python -m benchmarks.sqlite_profiles LOCAL [--rows N] [--profiles a b]
+ENV goes first because alfredo_lib reads it from sys.argv[1].
+"""
+import argparse
+import logging
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable
+
+from alfredo_lib import MAIN_CFG
+from alfredo_lib.local_persistence import cache
+
+
+def _time_ops(op: Callable, rows: int) -> float:
+    """
+    Runs op rows times, returns throughput in ops per second
+    """
+    start = time.perf_counter()
+    for _ in range(rows):
+        op()
+    return rows / (time.perf_counter() - start)
+
+
+def benchmark_profile(name: str, profile: dict, rows: int,
+                      folder: str) -> dict:
+    """
+    Measures create_transaction, add_log_row & add_log_rows throughput
+    on a fresh db using profile
+    """
+    lc = cache.Cache(str(Path(folder, f"{name}.sqlite")),
+                     storage_profile=profile)
+    lc.create_user({"username": "bench", "discord_id": 1,
+                    "currency": "EUR", "spreadsheet": "bench"})
+    lc.create_category({"category_name": "bench"})
+    user, _ = lc.get_user(discord_id=1)
+    record = logging.LogRecord(name="bench", level=logging.INFO,
+                               pathname=__file__, lineno=0,
+                               msg="benchmark message", args=None,
+                               exc_info=None, func="benchmark_profile")
+    res = {
+        "create_transaction": _time_ops(
+            lambda: lc.create_transaction({"user_id": user.user_id,
+                                           "amount": 1.,
+                                           "currency": "EUR",
+                                           "category_id": 1}),
+            rows=rows
+        ),
+        "add_log_row": _time_ops(lambda: lc.add_log_row(record), rows=rows)
+    }
+    # Batched path used by alfredo_logger.DbHandler, 100 records per insert
+    batches = max(rows // 100, 1)
+    res["add_log_rows (x100)"] = 100 * _time_ops(
+        lambda: lc.add_log_rows([record] * 100), rows=batches
+    )
+    lc.engine.dispose()
+    return res
+
+
+def main():
+    """
+    Benchmark entry point, prints ops/sec per operation & profile
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("env", help="alfredo env, e.g. LOCAL")
+    parser.add_argument("--rows", type=int, default=1000,
+                        help="writes per operation")
+    parser.add_argument("--profiles", nargs="*",
+                        default=list(MAIN_CFG["sqlite_profiles"].keys()),
+                        help="profiles from main config to compare")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        for name in args.profiles:
+            results[name] = benchmark_profile(
+                name=name, profile=MAIN_CFG["sqlite_profiles"][name],
+                rows=args.rows, folder=folder
+            )
+    ops = list(next(iter(results.values())).keys())
+    print(f"{'profile':<15}" + "".join(f"{op:>22}" for op in ops))
+    for name, res in results.items():
+        print(f"{name:<15}" + "".join(f"{res[op]:>22.1f}" for op in ops))
+    print(f"ops/sec, {args.rows} writes per operation")
+
+
+if __name__ == "__main__":
+    main()
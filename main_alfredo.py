@@ -10,8 +10,13 @@ import yaml
 from discord.ext import commands
 
 from alfredo_lib import COMMANDS_METADATA, ENV, ENV_VARS, LOG_LEVEL, MAIN_CFG
-from alfredo_lib.alfredo_deps import input_controller, local_cache, sheets
-from alfredo_lib.bot import buttons, ex
+from alfredo_lib.alfredo_deps import (
+    async_local_cache,
+    input_controller,
+    local_cache,
+    sheets,
+)
+from alfredo_lib.bot import buttons, ex, outbox
 from alfredo_lib.bot.cogs import account, category, transaction
 
 # Logging boilerplate
@@ -26,6 +31,35 @@ bot_logger.setLevel(LOG_LEVEL)
 backup_logger = logging.getLogger(MAIN_CFG["backup_logger_name"])
 
 
+class AlfredoBot(commands.Bot):
+    """
+    Bot owning lifecycle of alfredo's long-lived resources
+    """
+    def __init__(self, *args, **kwargs):
+        """
+        Instantiates the bot, args & kwargs go to commands.Bot
+        """
+        super().__init__(*args, **kwargs)
+        # Assigned once built bc the worker needs the bot itself
+        self.outbox_worker = None
+
+    async def setup_hook(self):
+        """
+        Runs once before connecting to discord
+        """
+        await sheets.open()
+
+    async def close(self):
+        """
+        Stops background work & releases resources on shutdown
+        """
+        if self.outbox_worker is not None:
+            await self.outbox_worker.stop()
+        await sheets.close()
+        await super().close()
+        async_local_cache.shutdown()
+
+
 def run_alfredo():
     """
     Entry point to running Alfredo bot
@@ -33,18 +67,26 @@ def run_alfredo():
     intents = discord.Intents.default()
     intents.message_content = True
 
-    bot = commands.Bot(command_prefix=MAIN_CFG["command_prefix"],
-                       intents=intents)
+    bot = AlfredoBot(command_prefix=MAIN_CFG["command_prefix"],
+                     intents=intents)
+    outbox_worker = outbox.SheetOutboxWorker(
+        bot=bot, async_local_cache=async_local_cache, sheets=sheets,
+        **MAIN_CFG["sheet_outbox"]
+    )
+    bot.outbox_worker = outbox_worker
 
     @bot.event
     async def on_ready():
         bot_logger.debug("User: %s (ID: %s)", bot.user, bot.user.id)
-        await sheets.discover_sheet_service(
-            api_version=MAIN_CFG["google_sheets"]["version"]
-        )
+        # on_ready fires on reconnects too, the service is kept from before
+        if sheets.sheet_service is None:
+            await sheets.discover_sheet_service(
+                api_version=MAIN_CFG["google_sheets"]["version"]
+            )
         try:
             await bot.add_cog(
                 account.AccountCog(bot=bot, local_cache=local_cache,
+                                   async_local_cache=async_local_cache,
                                    input_controller=input_controller,
                                    sheets=sheets))
         except Exception as e:
@@ -54,8 +96,10 @@ def run_alfredo():
         try:
             await bot.add_cog(
                 transaction.TransactionCog(bot=bot, local_cache=local_cache,
+                                           async_local_cache=async_local_cache,
                                            input_controller=input_controller,
-                                           sheets=sheets))
+                                           sheets=sheets,
+                                           outbox_worker=outbox_worker))
         except Exception as e:
             bot_logger.exception("Can't load TransactionCog: %s", e)
         bot_logger.debug("Loaded TransactionCog")
@@ -63,11 +107,14 @@ def run_alfredo():
         try:
             await bot.add_cog(
                 category.CategoryCog(bot=bot, local_cache=local_cache,
+                                     async_local_cache=async_local_cache,
                                      input_controller=input_controller,
                                      sheets=sheets))
         except Exception as e:
             bot_logger.exception("Can't load CategoryCog: %s", e)
         bot_logger.debug("Loaded CategoryCog")
+        # on_ready fires on reconnects too, start() is a no-op then
+        outbox_worker.start()
     
     @bot.event
     async def on_command_error(ctx: commands.Context, error: Exception):
@@ -181,8 +228,8 @@ def run_alfredo():
         
         try:
             # Check if user is registered
-            _, e = (bot.cogs[MAIN_CFG["cog_names"]["account"]]
-                    .lc.get_user(discord_id=ctx.author.id))
+            _, e = await (bot.cogs[MAIN_CFG["cog_names"]["account"]]
+                          .alc.get_user(discord_id=ctx.author.id))
             if e is not None:
                 bot_logger.debug("Unregistered user invoked start, showing account view only")
                 await ctx.message.author.send(view=start_menu)
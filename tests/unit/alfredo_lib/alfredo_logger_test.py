@@ -0,0 +1,134 @@
+"""
+Implements tests for alfredo_lib.alfredo_logger module
+"""
+import logging
+import types
+from unittest import mock
+
+import pytest
+
+from alfredo_lib import alfredo_logger
+from alfredo_lib.local_persistence import cache, models
+
+# Long enough for the background flusher never to fire during a test
+NO_INTERVAL = 3600
+
+
+class FakeMonotonic:
+    "time.monotonic replacement moved by tests"
+    def __init__(self):
+        "Starts the clock at 0"
+        self.now = 0.
+
+    def __call__(self) -> float:
+        "Returns current time"
+        return self.now
+
+
+@pytest.fixture
+def monotonic():
+    "Patches time of alfredo_logger with a FakeMonotonic"
+    fake_monotonic = FakeMonotonic()
+    with mock.patch.object(alfredo_logger, "time",
+                           types.SimpleNamespace(monotonic=fake_monotonic)):
+        yield fake_monotonic
+
+
+@pytest.fixture
+def local_cache(tmp_path):
+    "Cache over an empty sqlite db in tmp_path"
+    return cache.Cache(db_path=str(tmp_path / "test.sqlite"))
+
+
+@pytest.fixture
+def handler_factory(local_cache, monotonic):
+    "Creates DbHandlers writing to local_cache, closes them after the test"
+    handlers = []
+
+    def factory(**kwargs) -> alfredo_logger.DbHandler:
+        kwargs = {"flush_interval": NO_INTERVAL, **kwargs}
+        handler = alfredo_logger.DbHandler(cache_instance=local_cache,
+                                           **kwargs)
+        handlers.append(handler)
+        return handler
+    yield factory
+    for handler in handlers:
+        handler.close()
+
+
+def _log_record(msg: str) -> logging.LogRecord:
+    "INFO LogRecord of msg"
+    return logging.LogRecord(name="test", level=logging.INFO,
+                             pathname=__file__, lineno=1, msg=msg,
+                             args=None, exc_info=None, func="func")
+
+
+def _messages(local_cache: cache.Cache) -> list:
+    "Messages in the logs table"
+    with local_cache.session_factory() as sesh:
+        return [row.message for row in sesh.query(models.LogRecord)
+                .order_by(models.LogRecord.internal_id)]
+
+
+@pytest.mark.parametrize(
+    ("name", "handler_kwargs", "emits", "want_messages"),
+    (
+        # (message, seconds passed before emitting)
+        ("Buffered below capacity", {"capacity": 3},
+         [("a", 0), ("b", 0)], []),
+        ("Flushed at capacity", {"capacity": 3},
+         [("a", 0), ("b", 0), ("c", 0), ("d", 0)], ["a", "b", "c"]),
+        ("Flushed once the oldest record is flush_interval old",
+         {"capacity": 100, "flush_interval": 5},
+         [("a", 0), ("b", 4), ("c", 1)], ["a", "b", "c"]),
+        ("Interval restarts after a flush",
+         {"capacity": 100, "flush_interval": 5},
+         [("a", 5), ("b", 4), ("c", 0.5)], ["a"])
+    )
+)
+def test_db_handler_flush(local_cache, monotonic, handler_factory, name,
+                          handler_kwargs, emits, want_messages):
+    "Tests when buffered records get written to the db"
+    handler = handler_factory(**handler_kwargs)
+    for msg, seconds in emits:
+        monotonic.now += seconds
+        handler.handle(_log_record(msg))
+    assert _messages(local_cache) == want_messages
+
+
+def test_db_handler_flushes_quiet_periods(local_cache, handler_factory):
+    "Tests that the background flusher writes records nobody else flushes"
+    handler = handler_factory(capacity=100)
+    handler.handle(_log_record("a"))
+    stop_event = handler._stop_event
+    # One interval passes, then the handler is stopped
+    handler._stop_event = mock.Mock(wait=mock.Mock(side_effect=[False, True]))
+    handler._flush_periodically()
+    handler._stop_event = stop_event
+    assert _messages(local_cache) == ["a"]
+
+
+def test_db_handler_flushes_on_close(local_cache, handler_factory):
+    "Tests that close writes what is left & stops the background flusher"
+    handler = handler_factory(capacity=100)
+    for msg in ("a", "b"):
+        handler.handle(_log_record(msg))
+    handler.close()
+    handler._flusher.join(timeout=5)
+    assert not handler._flusher.is_alive()
+    assert _messages(local_cache) == ["a", "b"]
+
+
+def test_db_handler_single_insert_per_flush(monotonic):
+    "Tests that a flush writes the whole buffer with one add_log_rows call"
+    cache_instance = mock.Mock()
+    cache_instance.add_log_rows.return_value = None
+    handler = alfredo_logger.DbHandler(cache_instance=cache_instance,
+                                       capacity=3,
+                                       flush_interval=NO_INTERVAL)
+    for msg in ("a", "b", "c"):
+        handler.handle(_log_record(msg))
+    handler.close()
+    assert cache_instance.add_log_rows.call_count == 1
+    records = cache_instance.add_log_rows.call_args.args[0]
+    assert [record.getMessage() for record in records] == ["a", "b", "c"]
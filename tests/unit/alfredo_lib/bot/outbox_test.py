@@ -0,0 +1,161 @@
+"""
+Implements tests for alfredo_lib.bot.outbox module
+"""
+import asyncio
+import datetime
+import json
+from typing import Optional
+from unittest import mock
+
+import polars as pl
+import pytest
+
+from alfredo_lib.bot import outbox
+from alfredo_lib.local_persistence import cache, models
+
+NOW = 1000
+DB_ERROR = RuntimeError("db is locked")
+SHEET_ERROR = RuntimeError("sheet unavailable")
+
+
+@pytest.mark.parametrize(
+    ("name", "df"),
+    (
+        ("Transaction row", pl.DataFrame({
+            "Created Timestamp": ["2023-11-14 22:13:20.123"],
+            "User": ["bob"], "Amount": [12.5], "Split": [None],
+            "Count": [3], "Flag": [True]
+        })),
+        ("Several rows", pl.DataFrame({"a": ["x", "y", None],
+                                       "b": [1.5, None, -2.0]})),
+        ("Unicode", pl.DataFrame({"Comment": ["café ☕", ""]}))
+    )
+)
+def test_outbox_payload_round_trip(name, df):
+    "Tests that a df stored in the outbox comes back unchanged"
+    payload = outbox.df_to_outbox_payload(df=df)
+    assert isinstance(json.loads(payload), dict)
+    got = outbox.outbox_payload_to_df(payload=payload)
+    assert got.columns == df.columns
+    assert got.rows() == df.rows()
+
+
+def test_outbox_payload_with_date_fails():
+    "Tests that payloads need dates converted to strings first"
+    df = pl.DataFrame({"a": [datetime.datetime(2023, 1, 1)]})
+    with pytest.raises(TypeError):
+        outbox.df_to_outbox_payload(df=df)
+
+
+def _item(attempts: int = 0,
+          payload: Optional[str] = None) -> models.SheetOutboxItem:
+    "Outbox item of a single row"
+    payload = payload or outbox.df_to_outbox_payload(pl.DataFrame({"a": [1]}))
+    return models.SheetOutboxItem(
+        outbox_id=1, created=0, user_id=1, discord_id=42, spreadsheet="s",
+        tab_name="tab", payload=payload, attempts=attempts,
+        next_attempt_at=0, status=cache.OUTBOX_STATUS_PENDING
+    )
+
+
+def _worker(update_results: list, append_result: tuple,
+            delete_result=None) -> outbox.SheetOutboxWorker:
+    "Worker with mocked db, sheets & discord"
+    alc = mock.Mock()
+    # Errors are returned by the cache, not raised
+    alc.update_outbox_item = mock.AsyncMock(
+        side_effect=lambda **kwargs: update_results.pop(0)
+    )
+    alc.delete_outbox_item = mock.AsyncMock(return_value=delete_result)
+    sheets = mock.Mock()
+    sheets.append_data_coalesced = mock.AsyncMock(return_value=append_result)
+    bot = mock.Mock()
+    bot.get_user.return_value.send = mock.AsyncMock()
+    return outbox.SheetOutboxWorker(
+        bot=bot, async_local_cache=alc, sheets=sheets, max_attempts=3,
+        retry_delay=5, send_timeout=300
+    )
+
+
+HOLD = {"next_attempt_at": (NOW + 300) * 1000}
+
+
+@pytest.mark.parametrize(
+    ("name", "item_kwargs", "update_results", "append_result",
+     "delete_result", "want_updates", "want_append", "want_delete",
+     "want_e"),
+    (
+        ("Sent item is deleted", {}, [None], ({}, None), None,
+         [HOLD], True, True, None),
+        ("Item not held is not sent", {}, [DB_ERROR], ({}, None), None,
+         [HOLD], False, False, DB_ERROR),
+        ("Failed delete is reported", {}, [None], ({}, None), DB_ERROR,
+         [HOLD], True, True, DB_ERROR),
+        ("Failed append is retried later", {}, [None, None],
+         (None, SHEET_ERROR), None,
+         [HOLD, {"attempts": 1, "next_attempt_at": (NOW + 5) * 1000,
+                 "last_error": "sheet unavailable"}],
+         True, False, None),
+        ("Failed retry scheduling is reported", {"attempts": 1},
+         [None, DB_ERROR], (None, SHEET_ERROR), None,
+         [HOLD, {"attempts": 2, "next_attempt_at": (NOW + 10) * 1000,
+                 "last_error": "sheet unavailable"}],
+         True, False, DB_ERROR),
+        ("Last attempt fails the item", {"attempts": 2}, [None, None],
+         (None, SHEET_ERROR), None,
+         [HOLD, {"attempts": 3, "status": cache.OUTBOX_STATUS_FAILED,
+                 "last_error": "sheet unavailable"}],
+         True, False, None),
+        ("Failed marking of the last attempt is reported", {"attempts": 2},
+         [None, DB_ERROR], (None, SHEET_ERROR), None,
+         [HOLD, {"attempts": 3, "status": cache.OUTBOX_STATUS_FAILED}],
+         True, False, DB_ERROR),
+        ("Malformed payload fails the item", {"payload": "{"}, [DB_ERROR],
+         ({}, None), None,
+         [{"attempts": 1, "status": cache.OUTBOX_STATUS_FAILED}],
+         False, False, DB_ERROR)
+    )
+)
+def test_process_item(name, item_kwargs, update_results, append_result,
+                      delete_result, want_updates, want_append, want_delete,
+                      want_e):
+    "Tests db writes around the append of an outbox item"
+    worker = _worker(update_results=update_results,
+                     append_result=append_result, delete_result=delete_result)
+    with mock.patch.object(outbox.time, "time", return_value=NOW):
+        e = asyncio.run(worker._process_item(_item(**item_kwargs)))
+    assert e is want_e
+    updates = [call.kwargs["update"]
+               for call in worker.alc.update_outbox_item.await_args_list]
+    # Error messages depend on the exception, comparing given keys only
+    assert [{key: update[key] for key in want} for update, want in
+            zip(updates, want_updates)] == want_updates
+    assert len(updates) == len(want_updates)
+    assert worker.sheets.append_data_coalesced.await_count == want_append
+    assert worker.alc.delete_outbox_item.await_count == want_delete
+
+
+@pytest.mark.parametrize(
+    ("name", "process_results", "want_scans"),
+    (
+        ("Next due items are fetched right away", [None, None], 3),
+        ("Db error waits for the next poll", [DB_ERROR, DB_ERROR], 1)
+    )
+)
+def test_run_backs_off_on_db_errors(name, process_results, want_scans):
+    "Tests that the worker does not spin on items it can't update"
+    async def run():
+        worker = _worker(update_results=[], append_result=({}, None))
+        worker.poll_interval = 60
+        # Items stay due when their outcome is not saved
+        worker.alc.get_due_outbox_items = mock.AsyncMock(
+            side_effect=[[_item()], [_item()], []]
+        )
+        worker._process_item = mock.AsyncMock(side_effect=process_results)
+        worker.start()
+        for _ in range(20):
+            await asyncio.sleep(0)
+        await worker.stop()
+        return worker
+    worker = asyncio.run(run())
+    assert worker.alc.get_due_outbox_items.await_count == want_scans
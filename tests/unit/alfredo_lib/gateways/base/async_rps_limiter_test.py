@@ -0,0 +1,137 @@
+"""
+Implements tests for alfredo_lib.gateways.base.async_rps_limiter module
+"""
+import asyncio
+
+import pytest
+
+from alfredo_lib.gateways.base import async_rps_limiter
+
+
+@pytest.mark.parametrize(
+    ("name", "limiter_kwargs", "weights", "want"),
+    (
+        ("Burst goes through at once, next request waits for a token",
+         {"rps": 10, "burst": 3}, [1, 1, 1, 1], [0, 0, 0, 0.1]),
+        ("No burst by default, requests are spaced by 1 / rps",
+         {"rps": 20}, [1, 1, 1], [0, 0.05, 0.1]),
+        ("Weighted request waits for all its tokens",
+         {"rps": 10}, [3], [0.2]),
+        ("Request heavier than burst takes the bucket into debt",
+         {"rps": 10, "burst": 2}, [3, 1], [0.1, 0.2]),
+        ("Idle limiter refills up to burst only",
+         {"rps": 10, "burst": 2}, [2, 1], [0, 0.1])
+    )
+)
+def test_entry_times(clock, name, limiter_kwargs, weights, want):
+    "Tests when requests of weights in a row get through the limiter"
+    async def run():
+        limiter = async_rps_limiter.AsyncLimiter(**limiter_kwargs)
+        entries = []
+        for weight in weights:
+            async with limiter.weighted(weight):
+                entries.append(clock.now)
+        return entries
+    assert asyncio.run(clock.run(run())) == pytest.approx(want)
+
+
+def test_cancelled_waiter_refunds_tokens_and_slot(clock):
+    "Tests that cancelling a waiting caller does not leak tokens or slots"
+    async def run():
+        limiter = async_rps_limiter.AsyncLimiter(rps=1, burst=1,
+                                                 concurrent_requests=1)
+        async with limiter:
+            pass
+        waiter = asyncio.create_task(limiter.acquire(weight=5))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        return limiter
+    limiter = asyncio.run(clock.run(run()))
+    limiter._refill()
+    # Bucket is where the first request left it
+    assert limiter.tokens == 0
+    assert not limiter.sem.locked()
+
+
+@pytest.mark.parametrize(
+    ("name", "concurrent_requests", "want"),
+    (
+        ("Single request at once", 1, 1),
+        ("Two requests at once", 2, 2),
+        ("Limit above number of callers", 10, 6)
+    )
+)
+def test_concurrency_limit(clock, name, concurrent_requests, want):
+    "Tests that no more than concurrent_requests callers are inside"
+    async def run():
+        limiter = async_rps_limiter.AsyncLimiter(
+            rps=1000, burst=100, concurrent_requests=concurrent_requests
+        )
+        inside, peak = 0, 0
+
+        async def call():
+            nonlocal inside, peak
+            async with limiter:
+                inside += 1
+                peak = max(peak, inside)
+                await asyncio.sleep(0.01)
+                inside -= 1
+        await asyncio.gather(*(call() for _ in range(6)))
+        return peak
+    assert asyncio.run(clock.run(run())) == want
+
+
+@pytest.mark.parametrize(
+    ("name", "tokens", "weight", "want"),
+    (
+        ("Enough tokens", 2, 1, 0),
+        ("Missing tokens", 0, 2, 0.2),
+        ("Heavier than burst needs a full bucket only", 0, 5, 0.3)
+    )
+)
+def test_time_until(clock, name, tokens, weight, want):
+    "Tests seconds until a request can go without debt"
+    limiter = async_rps_limiter.AsyncLimiter(rps=10, burst=3)
+    limiter.tokens = tokens
+    assert limiter.time_until(weight=weight) == pytest.approx(want)
+    # Nothing is taken
+    assert limiter.tokens == tokens
+
+
+ADAPTIVE = {"rps": 4, "min_rps": 1, "max_rps": 6, "rps_step": 0.5,
+            "backoff_factor": 0.5, "throttle_cooldown": 1}
+
+
+@pytest.mark.parametrize(
+    ("name", "limiter_kwargs", "events", "want"),
+    (
+        ("Rate is static without bounds", {"rps": 2},
+         [("throttle", 0), ("success", 0)], 2),
+        ("Throttle decreases rate multiplicatively", ADAPTIVE,
+         [("throttle", 0)], 2),
+        ("Throttles within cooldown count once", ADAPTIVE,
+         [("throttle", 0), ("throttle", 0.5)], 2),
+        ("Throttles after cooldown count again", ADAPTIVE,
+         [("throttle", 0), ("throttle", 1)], 1),
+        ("Rate does not go below min_rps", ADAPTIVE,
+         [("throttle", 0), ("throttle", 1), ("throttle", 1)], 1),
+        ("Success increases rate additively", ADAPTIVE,
+         [("success", 0)], 4.5),
+        ("Rate does not go above max_rps", ADAPTIVE,
+         [("success", 0)] * 5, 6),
+        ("Rate recovers after throttling", ADAPTIVE,
+         [("throttle", 0), ("success", 0), ("success", 0)], 3)
+    )
+)
+def test_adaptive_rate(clock, name, limiter_kwargs, events, want):
+    "Tests AIMD rate changes on successes & throttling"
+    limiter = async_rps_limiter.AsyncLimiter(**limiter_kwargs)
+    for event, seconds_before in events:
+        clock.now += seconds_before
+        if event == "throttle":
+            limiter.on_throttle()
+        else:
+            limiter.on_success()
+    assert limiter.rps == pytest.approx(want)
@@ -0,0 +1,140 @@
+"""
+Implements tests for alfredo_lib.gateways.base.hierarchical_limiter module
+"""
+import asyncio
+
+import pytest
+
+from alfredo_lib.gateways.base import async_rps_limiter, hierarchical_limiter
+
+INTERACTIVE = hierarchical_limiter.INTERACTIVE_PRIORITY
+BACKGROUND = hierarchical_limiter.BACKGROUND_PRIORITY
+
+
+async def _serve(limiter: hierarchical_limiter.HierarchicalLimiter,
+                 clock, batches: list) -> list:
+    """
+    Sends batches of requests one after another without waiting for them
+    :param batches: lists of (label, RequestContext kwargs)
+    :return: (label, entry time) of every request in the order served
+    """
+    served = []
+
+    async def call(label: str, ctx_kwargs: dict):
+        ctx = hierarchical_limiter.RequestContext(**ctx_kwargs)
+        async with limiter.limit(ctx):
+            served.append((label, clock.now))
+    tasks = []
+    for batch in batches:
+        tasks.extend(asyncio.create_task(call(label, ctx_kwargs))
+                     for label, ctx_kwargs in batch)
+        # Lets the batch get queued before the next one arrives
+        await asyncio.sleep(0)
+    await asyncio.gather(*tasks)
+    return served
+
+
+@pytest.mark.parametrize(
+    ("name", "limiter_kwargs", "batches", "want"),
+    (
+        ("Light user is not starved by a heavy one",
+         {},
+         [[("heavy", {"user_id": 1})] * 6, [("light", {"user_id": 2})] * 2],
+         ["heavy", "heavy", "light", "heavy", "light",
+          "heavy", "heavy", "heavy"]),
+        ("Interactive requests are served before background ones",
+         {},
+         [[("bg", {"priority": BACKGROUND})] * 4,
+          [("ia", {"priority": INTERACTIVE})] * 2],
+         ["bg", "ia", "ia", "bg", "bg", "bg"]),
+        ("Long waiting background request jumps the line",
+         {"max_background_wait": 0.1},
+         [[("ia", {})] * 8, [("bg", {"priority": BACKGROUND})]],
+         # Waited 0.1s when the 3rd request at 20 rps goes
+         ["ia", "ia", "bg", "ia", "ia", "ia", "ia", "ia", "ia"])
+    )
+)
+def test_serve_order(clock, name, limiter_kwargs, batches, want):
+    "Tests order in which queued requests get the global quota"
+    limiter = hierarchical_limiter.HierarchicalLimiter(
+        global_limiter=async_rps_limiter.AsyncLimiter(rps=20),
+        **limiter_kwargs
+    )
+    served = asyncio.run(clock.run(_serve(limiter=limiter, clock=clock,
+                                          batches=batches)))
+    assert [label for label, _ in served] == want
+
+
+@pytest.mark.parametrize(
+    ("name", "global_kwargs", "limiter_kwargs", "batches", "want"),
+    (
+        ("Per-user bucket slows down its user only",
+         {"rps": 1000, "burst": 1000}, {"user_rps": 10, "user_burst": 1},
+         [[("a", {"user_id": 1})] * 3 + [("b", {"user_id": 2})]],
+         [("a", 0), ("b", 0), ("a", 0.1), ("a", 0.2)]),
+        ("Per-sheet bucket takes the request weight",
+         {"rps": 1000, "burst": 1000}, {"sheet_rps": 10, "sheet_burst": 1},
+         [[("s", {"sheet_id": "s", "weight": 3})]],
+         [("s", 0.2)]),
+        ("Request heavier than global burst is not stuck",
+         {"rps": 10, "burst": 1}, {},
+         [[("a", {"weight": 3})], [("b", {"weight": 3})]],
+         # b waits for a full bucket, then for its debt like a did
+         [("a", 0.2), ("b", 0.5)])
+    )
+)
+def test_entry_times(clock, name, global_kwargs, limiter_kwargs, batches,
+                     want):
+    "Tests when requests get through spreadsheet, user & global buckets"
+    limiter = hierarchical_limiter.HierarchicalLimiter(
+        global_limiter=async_rps_limiter.AsyncLimiter(**global_kwargs),
+        **limiter_kwargs
+    )
+    served = asyncio.run(clock.run(_serve(limiter=limiter, clock=clock,
+                                          batches=batches)))
+    assert [label for label, _ in served] == [label for label, _ in want]
+    assert [at for _, at in served] == pytest.approx(
+        [at for _, at in want], abs=1e-6
+    )
+
+
+def test_cancelled_waiter_gives_back_tokens(clock):
+    "Tests that cancelling a queued request does not leak any quota"
+    async def run():
+        limiter = hierarchical_limiter.HierarchicalLimiter(
+            global_limiter=async_rps_limiter.AsyncLimiter(
+                rps=1, concurrent_requests=1
+            ),
+            user_rps=1, user_burst=5
+        )
+        ctx = hierarchical_limiter.RequestContext(user_id=1)
+        async with limiter.limit(ctx):
+            pass
+        waiter = asyncio.create_task(limiter.acquire(ctx))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        return limiter
+    limiter = asyncio.run(clock.run(run()))
+    user_bucket = limiter._user_buckets[1]
+    user_bucket._refill()
+    assert user_bucket.tokens == 4
+    limiter.global_limiter._refill()
+    assert limiter.global_limiter.tokens == 0
+    assert not limiter.global_limiter.sem.locked()
+
+
+def test_bad_priority_is_rejected(clock):
+    "Tests that an unknown priority fails and gives back bucket tokens"
+    async def run():
+        limiter = hierarchical_limiter.HierarchicalLimiter(
+            global_limiter=async_rps_limiter.AsyncLimiter(rps=1),
+            user_rps=1, user_burst=2
+        )
+        ctx = hierarchical_limiter.RequestContext(user_id=1, priority="bad")
+        with pytest.raises(ValueError):
+            await limiter.acquire(ctx)
+        return limiter
+    limiter = asyncio.run(clock.run(run()))
+    assert limiter._user_buckets[1].tokens == 2
@@ -0,0 +1,115 @@
+"""
+Implements tests for alfredo_lib.gateways.base.my_retry module
+"""
+import asyncio
+import logging
+from typing import Callable, Optional
+from unittest import mock
+
+import pytest
+
+from alfredo_lib.gateways.base import my_retry
+
+test_logger = logging.getLogger("my_retry_test")
+
+
+class FlakyError(Exception):
+    "Exception raised by flaky test calls"
+    def __init__(self, headers: Optional[dict] = None):
+        "Wraps a response with headers like gateway errors do"
+        super().__init__("flaky")
+        self.og_exception = mock.Mock(res=mock.Mock(headers=headers or {}))
+
+
+def _flaky(fails: int, headers: Optional[dict] = None) -> mock.AsyncMock:
+    "Creates a coroutine function failing fails times before succeeding"
+    return mock.AsyncMock(
+        side_effect=[FlakyError(headers=headers)] * fails + ["ok"]
+    )
+
+
+def _run(clock, func: Callable, **retry_kwargs):
+    "Runs func wrapped by the decorator on the fake clock"
+    retry_kwargs = {"exceptions": (FlakyError,), "logger": test_logger,
+                    "retries": 5, "delay": 1, **retry_kwargs}
+    wrapped = my_retry.simple_async_retry(**retry_kwargs)(func)
+    return asyncio.run(clock.run(wrapped()))
+
+
+@pytest.mark.parametrize(
+    ("name", "retry_kwargs", "fails", "headers", "want_sleeps", "is_err"),
+    (
+        ("Fixed delay by default", {}, 3, None, [1, 1, 1], False),
+        ("Exponential backoff capped by max_delay",
+         {"backoff": 2, "max_delay": 5}, 4, None, [1, 2, 4, 5], False),
+        # random.uniform is patched to return the middle of the range
+        ("Full jitter", {"backoff": 2, "jitter": True}, 3, None,
+         [0.5, 1, 2], False),
+        ("Retry-After seconds replace the delay", {"backoff": 2}, 2,
+         {"Retry-After": "7"}, [7, 7], False),
+        ("Retry-After header name is case insensitive", {}, 1,
+         {"retry-after": "3"}, [3], False),
+        ("Retry-After date is converted to seconds", {}, 1,
+         {"Retry-After": "Tue, 14 Nov 2023 22:13:30 GMT"}, [10], False),
+        ("Unparsable Retry-After is ignored", {}, 1,
+         {"Retry-After": "soon"}, [1], False),
+        ("Retries exhausted", {"retries": 2}, 3, None, [1, 1], True),
+        ("No retry ending after max_elapsed",
+         {"backoff": 2, "max_elapsed": 3.5}, 4, None, [1, 2], True),
+        ("Retry-After beyond max_elapsed is not waited for",
+         {"max_elapsed": 5}, 1, {"Retry-After": "7"}, [], True)
+    )
+)
+def test_simple_async_retry(clock, name, retry_kwargs, fails, headers,
+                            want_sleeps, is_err):
+    "Tests delays between retries & when the decorator gives up"
+    func = _flaky(fails=fails, headers=headers)
+    with mock.patch.object(my_retry.random, "uniform",
+                           lambda low, high: (low + high) / 2):
+        if is_err:
+            with pytest.raises(FlakyError):
+                _run(clock=clock, func=func, **retry_kwargs)
+        else:
+            assert _run(clock=clock, func=func, **retry_kwargs) == "ok"
+    assert clock.sleeps == pytest.approx(want_sleeps)
+
+
+@pytest.mark.parametrize(
+    ("name", "ratio", "max_tokens", "fails", "want_sleeps", "is_err"),
+    (
+        ("Full budget covers retries", 0.5, 5, 3, 3, False),
+        ("Empty budget stops retries", 0.5, 2, 5, 2, True),
+        ("Budget below one token allows no retry", 0.5, 0.5, 1, 0, True)
+    )
+)
+def test_retry_budget_stops_storm(clock, name, ratio, max_tokens, fails,
+                                  want_sleeps, is_err):
+    "Tests that calls are not retried once the shared budget is empty"
+    budget = my_retry.RetryBudget(ratio=ratio, max_tokens=max_tokens)
+    func = _flaky(fails=fails)
+    if is_err:
+        with pytest.raises(FlakyError):
+            _run(clock=clock, func=func, budget=budget)
+    else:
+        _run(clock=clock, func=func, budget=budget)
+    assert len(clock.sleeps) == want_sleeps
+
+
+@pytest.mark.parametrize(
+    ("name", "ops", "want"),
+    (
+        ("Budget starts full", ["withdraw", "withdraw", "withdraw"],
+         [True, True, False]),
+        ("Calls refill the budget",
+         ["withdraw", "withdraw", "deposit", "withdraw", "deposit",
+          "withdraw"],
+         [True, True, None, False, None, True]),
+        ("Budget does not grow over max_tokens",
+         ["deposit", "deposit", "withdraw", "withdraw", "withdraw"],
+         [None, None, True, True, False])
+    )
+)
+def test_retry_budget(name, ops, want):
+    "Tests RetryBudget deposits & withdrawals"
+    budget = my_retry.RetryBudget(ratio=0.5, max_tokens=2)
+    assert [getattr(budget, op)() for op in ops] == want
@@ -0,0 +1,96 @@
+"""
+Implements fixtures shared by gateway tests
+"""
+import asyncio
+import heapq
+import itertools
+import types
+from unittest import mock
+
+import pytest
+
+from alfredo_lib.gateways.base import (
+    async_rps_limiter,
+    hierarchical_limiter,
+    my_retry,
+)
+
+# Wall clock reading at virtual time 0, Tue, 14 Nov 2023 22:13:20 GMT
+EPOCH = 1_700_000_000
+# Event loop passes letting ready tasks run before the clock moves
+SETTLE_PASSES = 50
+# Smallest move of the clock when a task wakes up
+MIN_STEP = 1e-9
+
+
+class FakeClock:
+    """
+    ### Virtual clock for time dependent code
+    Time only moves when every task is waiting on a sleep, then it jumps
+    to the earliest wake up. Results don't depend on the machine speed.
+    """
+    def __init__(self):
+        """
+        Instantiates the clock
+        """
+        self.now = 0.
+        # Seconds passed to every sleep call, in call order
+        self.sleeps = []
+        self._sleepers = []
+        self._order = itertools.count()
+        self._real_sleep = asyncio.sleep
+
+    def monotonic(self) -> float:
+        "Replaces time.monotonic"
+        return self.now
+
+    def time(self) -> float:
+        "Replaces time.time"
+        return EPOCH + self.now
+
+    async def sleep(self, delay: float, result=None):
+        "Replaces asyncio.sleep, wakes up once the clock gets to now + delay"
+        self.sleeps.append(delay)
+        if delay <= 0:
+            await self._real_sleep(0)
+            return result
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._sleepers,
+                       (self.now + delay, next(self._order), future))
+        await future
+        return result
+
+    async def run(self, coro):
+        """
+        Runs coro to completion moving the clock whenever nothing can run
+        """
+        task = asyncio.ensure_future(coro)
+        while True:
+            for _ in range(SETTLE_PASSES):
+                await self._real_sleep(0)
+            if task.done():
+                return task.result()
+            while self._sleepers and self._sleepers[0][2].done():
+                # Sleeper got cancelled
+                heapq.heappop(self._sleepers)
+            if not self._sleepers:
+                task.cancel()
+                raise RuntimeError("Tasks wait for something else than time")
+            wake_at, _, future = heapq.heappop(self._sleepers)
+            # Delays too small to move a float clock still have to move it,
+            # code polling until a deadline would spin forever otherwise
+            self.now = max(self.now + MIN_STEP, wake_at)
+            future.set_result(None)
+
+
+@pytest.fixture
+def clock():
+    "Patches time of the limiter & retry modules with a FakeClock"
+    fake_clock = FakeClock()
+    fake_time = types.SimpleNamespace(monotonic=fake_clock.monotonic,
+                                      time=fake_clock.time)
+    with mock.patch.object(async_rps_limiter, "time", fake_time), \
+            mock.patch.object(hierarchical_limiter, "time", fake_time), \
+            mock.patch.object(my_retry, "time", fake_time), \
+            mock.patch.object(asyncio, "sleep", fake_clock.sleep):
+        yield fake_clock
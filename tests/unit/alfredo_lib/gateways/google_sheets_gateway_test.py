@@ -0,0 +1,1055 @@
+"""
+Implements tests for alfredo_lib.gateways.google_sheets_gateway module
+"""
+import asyncio
+import contextlib
+import datetime
+import functools
+import json
+import os
+import re
+import time
+import types
+from unittest import mock
+
+import aiogoogle
+import aiohttp
+import cachetools
+import polars as pl
+import pytest
+from aiogoogle.resource import GoogleAPI
+
+from alfredo_lib.gateways import google_sheets_gateway
+from alfredo_lib.gateways.base import async_rps_limiter, hierarchical_limiter
+
+
+@pytest.fixture
+def gateway(tmp_path):
+    "Gateway with dummy credentials & limiters that do not wait"
+    service_acc_path = tmp_path / "service_account.json"
+    service_acc_path.write_text(json.dumps({
+        "type": "service_account", "client_email": "test@test.test",
+        "private_key": "key"
+    }))
+    limiter = hierarchical_limiter.HierarchicalLimiter(
+        global_limiter=async_rps_limiter.AsyncLimiter(rps=1000, burst=1000)
+    )
+    return google_sheets_gateway.GoogleSheetAsyncGateway(
+        service_acc_path=str(service_acc_path), read_rps_limiter=limiter,
+        write_rps_limter=limiter
+    )
+
+
+def test_close_cancels_discovery_refresh(gateway):
+    "Tests that close stops a running discovery document refresh"
+    async def run():
+        refresh = asyncio.create_task(asyncio.sleep(60))
+        gateway._discovery_refresh = refresh
+        async with gateway:
+            pass
+        return refresh
+    refresh = asyncio.run(run())
+    assert refresh.cancelled()
+    assert gateway._discovery_refresh is None
+    assert gateway.session is None
+
+
+def _discovery_doc(revision: str) -> dict:
+    "Minimal sheets discovery document"
+    return {"name": "sheets", "version": "v4", "revision": revision}
+
+
+@pytest.fixture
+def discovery(gateway, tmp_path):
+    """
+    Points the discovery cache of gateway to tmp_path & replaces
+    the client, its discover mock serves a fresh document
+    """
+    gateway.discovery_cache_dir = str(tmp_path / "discovery")
+    client = mock.Mock()
+    client.discover = mock.AsyncMock(
+        return_value=GoogleAPI(discovery_document=_discovery_doc("fresh"))
+    )
+
+    @contextlib.asynccontextmanager
+    async def fake_client():
+        yield client
+    gateway._client = fake_client
+    return client
+
+
+def _write_discovery_doc(gateway, revision: str, age: float):
+    "Caches a discovery document of revision on disk, age seconds old"
+    gateway._save_discovery_doc(api_version="v4",
+                                doc=_discovery_doc(revision))
+    path = gateway._discovery_doc_path(api_version="v4")
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+
+
+def _revision(service: GoogleAPI) -> str:
+    "Revision of the discovery document behind service"
+    return service.discovery_document["revision"]
+
+
+def test_discovery_doc_from_disk(gateway, discovery):
+    "Tests that a fresh document on disk is used without a fetch"
+    _write_discovery_doc(gateway, revision="disk", age=60)
+    asyncio.run(gateway.discover_sheet_service(api_version="v4"))
+    assert _revision(gateway.sheet_service) == "disk"
+    assert discovery.discover.await_count == 0
+    assert gateway._discovery_refresh is None
+
+
+def test_discovery_doc_fetched_and_saved(gateway, discovery):
+    "Tests that a missing document is fetched & saved by a rename"
+    with mock.patch.object(google_sheets_gateway.os, "replace",
+                           wraps=os.replace) as replace:
+        asyncio.run(gateway.discover_sheet_service(api_version="v4"))
+    path = gateway._discovery_doc_path(api_version="v4")
+    assert _revision(gateway.sheet_service) == "fresh"
+    assert discovery.discover.await_count == 1
+    replace.assert_called_once_with(f"{path}.tmp", path)
+    assert os.listdir(gateway.discovery_cache_dir) == ["sheets_v4.json"]
+    doc, _ = gateway._load_discovery_doc(api_version="v4")
+    assert doc["revision"] == "fresh"
+
+
+def test_unreadable_discovery_doc_is_fetched(gateway, discovery):
+    "Tests that a corrupt document on disk is replaced by a fetched one"
+    os.makedirs(gateway.discovery_cache_dir)
+    with open(gateway._discovery_doc_path(api_version="v4"), "w") as f:
+        f.write("{not json")
+    asyncio.run(gateway.discover_sheet_service(api_version="v4"))
+    assert _revision(gateway.sheet_service) == "fresh"
+    assert discovery.discover.await_count == 1
+
+
+@pytest.mark.parametrize(
+    ("name", "fetch_error", "want_revision"),
+    (
+        ("Refresh replaces the service", None, "fresh"),
+        ("Failed refresh keeps the old service",
+         aiohttp.ClientError("offline"), "stale")
+    )
+)
+def test_stale_discovery_doc_refreshed(gateway, discovery, name, fetch_error,
+                                       want_revision):
+    "Tests that a stale document is used while it is refreshed"
+    _write_discovery_doc(gateway, revision="stale",
+                         age=gateway.discovery_ttl + 60)
+    if fetch_error is not None:
+        discovery.discover.side_effect = fetch_error
+
+    async def run():
+        await gateway.discover_sheet_service(api_version="v4")
+        # Stale service is served until the refresh is done
+        assert _revision(gateway.sheet_service) == "stale"
+        await gateway._discovery_refresh
+    asyncio.run(run())
+    assert discovery.discover.await_count == 1
+    assert _revision(gateway.sheet_service) == want_revision
+    doc, _ = gateway._load_discovery_doc(api_version="v4")
+    assert doc["revision"] == want_revision
+
+
+def _http_error(code: int, status: str = "") -> aiogoogle.excs.HTTPError:
+    "Error aiogoogle raises for a response with code & status"
+    res = types.SimpleNamespace(
+        json={"error": {"code": code, "status": status, "message": "err"}},
+        headers={}
+    )
+    return aiogoogle.excs.HTTPError("err", req=types.SimpleNamespace(json={}),
+                                    res=res)
+
+
+RATE_LIMITED = _http_error(code=429, status="RESOURCE_EXHAUSTED")
+QUOTA_EXHAUSTED = _http_error(code=403, status="RESOURCE_EXHAUSTED")
+BAD_REQUEST = _http_error(code=400, status="INVALID_ARGUMENT")
+NOT_FOUND = _http_error(code=404, status="NOT_FOUND")
+SERVER_ERROR = _http_error(code=503, status="UNAVAILABLE")
+RESPONSE = {"values": [["a"]]}
+
+
+@pytest.mark.parametrize(
+    ("name", "error", "want"),
+    (
+        ("429", RATE_LIMITED, True),
+        ("RESOURCE_EXHAUSTED status", QUOTA_EXHAUSTED, True),
+        ("Bad request", BAD_REQUEST, False),
+        ("Server error", SERVER_ERROR, False)
+    )
+)
+def test_is_rate_limit_error(name, error, want):
+    "Tests which errors tell that a Sheets quota is exhausted"
+    mapper = google_sheets_gateway.GoogleSheetMapper
+    assert mapper._is_rate_limit_error(e=error) is want
+
+
+@pytest.mark.parametrize(
+    ("name", "responses", "want_resp", "want_code", "want_calls",
+     "want_throttles", "want_successes"),
+    (
+        ("Success", [RESPONSE], RESPONSE, None, 1, 0, 1),
+        ("429 is retried", [RATE_LIMITED, RATE_LIMITED, RESPONSE], RESPONSE,
+         None, 3, 2, 1),
+        ("RESOURCE_EXHAUSTED is retried", [QUOTA_EXHAUSTED, RESPONSE],
+         RESPONSE, None, 2, 1, 1),
+        ("Server error is retried without throttling",
+         [SERVER_ERROR, RESPONSE], RESPONSE, None, 2, 0, 1),
+        ("Bad request is not retried", [BAD_REQUEST, RESPONSE], None, 400,
+         1, 0, 0),
+        ("Not found is not retried", [NOT_FOUND, RESPONSE], None, 404,
+         1, 0, 0)
+    )
+)
+def test_make_request_retries(clock, gateway, name, responses, want_resp,
+                              want_code, want_calls, want_throttles,
+                              want_successes):
+    "Tests which errors get retried & what the limiter is told"
+    client = mock.Mock()
+    client.as_service_account = mock.AsyncMock(side_effect=responses)
+
+    @contextlib.asynccontextmanager
+    async def fake_client():
+        yield client
+    gateway._client = fake_client
+    limiter = gateway.read_limiter
+    budget = google_sheets_gateway.SHEETS_RETRY_BUDGET
+    with mock.patch.object(limiter, "on_throttle",
+                           wraps=limiter.on_throttle) as on_throttle, \
+            mock.patch.object(limiter, "on_success",
+                              wraps=limiter.on_success) as on_success, \
+            mock.patch.object(budget, "tokens", budget.max_tokens):
+        resp, e = asyncio.run(clock.run(gateway._request_wrapper(
+            req="req", req_type=google_sheets_gateway.READ_REQUEST_TYPE
+        )))
+    assert resp == want_resp
+    if want_code is None:
+        assert e is None
+    else:
+        assert isinstance(e, aiogoogle.excs.HTTPError)
+        assert e.res.json["error"]["code"] == want_code
+    assert client.as_service_account.await_count == want_calls
+    assert on_throttle.call_count == want_throttles
+    assert on_success.call_count == want_successes
+
+
+@pytest.mark.parametrize(
+    ("name", "num", "want"),
+    (
+        ("First column", 1, "A"),
+        ("Last single letter column", 26, "Z"),
+        ("First double letter column", 27, "AA"),
+        ("Multiple of 26", 52, "AZ"),
+        ("Last double letter column", 702, "ZZ"),
+        ("First triple letter column", 703, "AAA")
+    )
+)
+def test_num_to_sheet_range(name, num, want):
+    "Tests num_to_sheet_range of GoogleSheetMapper"
+    assert google_sheets_gateway.GoogleSheetMapper.num_to_sheet_range(
+        num=num
+    ) == want
+
+
+@pytest.mark.parametrize(
+    ("name", "tab_name", "bounds", "want"),
+    (
+        ("Whole tab", "tab", {}, "'tab'!A:ZZ"),
+        ("Open ended rows", "tab", {"start_row": 5}, "'tab'!A5:ZZ"),
+        ("End row only starts at the first row", "tab", {"end_row": 3},
+         "'tab'!A1:ZZ3"),
+        ("Rows & columns", "tab",
+         {"start_row": 2, "end_row": 9, "start_col": 2, "end_col": 27},
+         "'tab'!B2:AA9"),
+        ("Tab name with a space", "my tab", {"end_row": 1},
+         "'my tab'!A1:ZZ1"),
+        ("Tab name looking like a cell", "Q1", {}, "'Q1'!A:ZZ"),
+        ("Tab name with a quote", "bob's", {}, "'bob''s'!A:ZZ")
+    )
+)
+def test_params_to_a1_range(name, tab_name, bounds, want):
+    "Tests params_to_a1_range of GoogleSheetMapper"
+    mapper = google_sheets_gateway.GoogleSheetMapper()
+    assert mapper.params_to_a1_range(tab_name=tab_name, **bounds) == want
+
+
+@pytest.mark.parametrize(
+    ("name", "updated_range", "want"),
+    (
+        ("Plain range", "tab!A5:G7", 7),
+        ("Quoted tab with a quote & exclamation", "'bob''s!'!A5:G17", 17),
+        ("Single cell", "'tab'!B3", 3)
+    )
+)
+def test_updated_range_to_last_row(name, updated_range, want):
+    "Tests _updated_range_to_last_row of GoogleSheetMapper"
+    assert google_sheets_gateway.GoogleSheetMapper._updated_range_to_last_row(
+        updated_range=updated_range
+    ) == want
+
+
+@pytest.mark.parametrize(
+    ("name", "value", "want"),
+    (
+        ("String", "abc", {"userEnteredValue": {"stringValue": "abc"}}),
+        ("Int", 3, {"userEnteredValue": {"numberValue": 3}}),
+        ("Float", 1.5, {"userEnteredValue": {"numberValue": 1.5}}),
+        ("Bool is not a number", True,
+         {"userEnteredValue": {"boolValue": True}}),
+        ("None leaves the cell empty", None, {}),
+        ("Other types are written as strings", b"x",
+         {"userEnteredValue": {"stringValue": "b'x'"}})
+    )
+)
+def test_value_to_cell_data(name, value, want):
+    "Tests _value_to_cell_data of GoogleSheetMapper"
+    assert google_sheets_gateway.GoogleSheetMapper._value_to_cell_data(
+        value=value
+    ) == want
+
+
+@pytest.mark.parametrize(
+    ("name", "rows", "want_rows"),
+    (
+        ("No rows", [], []),
+        ("Mixed types & empty cell", [["a", 1, None], [False, 2.5, "b"]],
+         [{"values": [{"userEnteredValue": {"stringValue": "a"}},
+                      {"userEnteredValue": {"numberValue": 1}},
+                      {}]},
+          {"values": [{"userEnteredValue": {"boolValue": False}},
+                      {"userEnteredValue": {"numberValue": 2.5}},
+                      {"userEnteredValue": {"stringValue": "b"}}]}])
+    )
+)
+def test_rows_to_append_cells_request(name, rows, want_rows):
+    "Tests _rows_to_append_cells_request of GoogleSheetMapper"
+    mapper = google_sheets_gateway.GoogleSheetMapper()
+    assert mapper._rows_to_append_cells_request(tab_id=7, rows=rows) == {
+        "appendCells": {"sheetId": 7, "rows": want_rows,
+                        "fields": "userEnteredValue"}
+    }
+
+
+@pytest.mark.parametrize(
+    ("name", "start", "end", "rows"),
+    (
+        ("Trim below header & append", 1, 4, [["a", 1]]),
+        ("Nothing to trim", 1, 1, [["a", 1], ["b", None]])
+    )
+)
+def test_trim_and_append_params_to_body(name, start, end, rows):
+    "Tests that rows get deleted before the append in one batchUpdate body"
+    mapper = google_sheets_gateway.GoogleSheetMapper()
+    body = mapper._trim_and_append_params_to_body(tab_id=7, start=start,
+                                                  end=end, rows=rows)
+    assert body == {
+        "requests": [
+            {"deleteDimension": {"range": {"sheetId": 7, "dimension": "ROWS",
+                                           "startIndex": start,
+                                           "endIndex": end}}},
+            mapper._rows_to_append_cells_request(tab_id=7, rows=rows)
+        ]
+    }
+
+
+@pytest.mark.parametrize(
+    ("name", "current_len", "new_len", "row_limit", "low_watermark", "want"),
+    (
+        ("Below the limit", 5, 3, 10, None, 0),
+        ("Exactly at the limit", 7, 3, 10, None, 0),
+        ("Above the limit trims down to it", 8, 3, 10, None, 1),
+        ("Above the limit trims down to the watermark", 8, 3, 10, 6, 5),
+        ("Watermark not passed does not trim", 5, 3, 10, 2, 0),
+        ("Watermark equal to the limit", 8, 3, 10, 10, 1),
+        ("Watermark above the limit is capped to it", 8, 3, 10, 15, 1),
+        ("Only existing rows are dropped", 2, 20, 10, None, 2),
+        ("Empty tab", 0, 20, 10, 5, 0)
+    )
+)
+def test_compute_number_of_rows_to_drop(name, current_len, new_len,
+                                        row_limit, low_watermark, want):
+    "Tests rows trimmed before an append to respect row_limit"
+    gateway_cls = google_sheets_gateway.GoogleSheetAsyncGateway
+    assert gateway_cls._compute_number_of_rows_to_drop(
+        current_len=current_len, new_len=new_len, row_limit=row_limit,
+        low_watermark=low_watermark
+    ) == want
+
+
+@pytest.mark.parametrize(
+    ("name", "dtype", "cells", "want"),
+    (
+        ("Ints keep their precision", pl.Int64,
+         [2**53 + 1, 3.0, "7", "", None], [2**53 + 1, 3, 7, None, None]),
+        ("Floats", pl.Float64, [1.5, 2, "0.25", ""], [1.5, 2.0, 0.25, None]),
+        ("Serial dates from the 1899-12-30 epoch", pl.Datetime,
+         [0, 45000, 45000.75, 1.5, ""],
+         [datetime.datetime(1899, 12, 30), datetime.datetime(2023, 3, 15),
+          datetime.datetime(2023, 3, 15, 18),
+          datetime.datetime(1899, 12, 31, 12),
+          None]),
+        ("Dates written as text", pl.Datetime,
+         ["2023-11-14 22:13:20.123", "2023-11-14"],
+         [datetime.datetime(2023, 11, 14, 22, 13, 20, 123000),
+          datetime.datetime(2023, 11, 14)]),
+        ("Strings & blank cells", pl.Utf8, ["a", 5, "", None],
+         ["a", "5", None, None]),
+        ("Bools", pl.Boolean, [True, False, ""], [True, False, None])
+    )
+)
+def test_rows_to_df_typed(name, dtype, cells, want):
+    "Tests that typed reads build columns of the schema dtype"
+    mapper = google_sheets_gateway.GoogleSheetMapper()
+    df = mapper._rows_to_df(header=["col"], rows=[[cell] for cell in cells],
+                            dtypes={"col": dtype})
+    assert df.schema == {"col": dtype}
+    assert df["col"].to_list() == want
+
+
+@pytest.mark.parametrize(
+    ("name", "dtype", "cells"),
+    (
+        ("Fraction in an int column", pl.Int64, [1, 2.5]),
+        ("Text in a float column", pl.Float64, ["n/a"]),
+        ("Text that is not a date", pl.Datetime, ["yesterday"]),
+        ("Bool is not a number", pl.Float64, [True]),
+        ("Int too large for the dtype", pl.Int64, [1e20])
+    )
+)
+def test_rows_to_df_bad_cells(name, dtype, cells):
+    "Tests that cells not fitting the schema fail instead of becoming nulls"
+    mapper = google_sheets_gateway.GoogleSheetMapper()
+    with pytest.raises(ValueError, match=r"^1 cells .*\(\d, 'col', "):
+        mapper._rows_to_df(header=["col"], rows=[[cell] for cell in cells],
+                           dtypes={"col": dtype})
+
+
+def test_rows_to_df_pads_rows():
+    "Tests that short rows are padded & long rows cut to the header"
+    mapper = google_sheets_gateway.GoogleSheetMapper()
+    df = mapper._rows_to_df(header=["a", "b"], rows=[["x"], ["y", 1, "z"]],
+                            dtypes={"b": pl.Int64})
+    assert df.schema == {"a": pl.Utf8, "b": pl.Int64}
+    assert df.rows() == [("x", None), ("y", 1)]
+
+
+@pytest.mark.parametrize(
+    ("name", "updated_range", "sizes", "want_ranges"),
+    (
+        ("One caller", "'tab'!A5:G6", [2], ["'tab'!A5:G6"]),
+        ("Callers get consecutive rows", "'tab'!A5:G10", [2, 1, 3],
+         ["'tab'!A5:G6", "'tab'!A7:G7", "'tab'!A8:G10"]),
+        ("Single column range", "tab!B3", [1, 2], ["tab!B3:B3", "tab!B4:B5"])
+    )
+)
+def test_split_append_response(name, updated_range, sizes, want_ranges):
+    "Tests that each caller of a coalesced append gets its own rows"
+    resp = {"spreadsheetId": "s", "tableRange": "'tab'!A1:G4",
+            "updates": {"updatedRange": updated_range,
+                        "updatedRows": sum(sizes), "updatedColumns": 7}}
+    parts = google_sheets_gateway.GoogleSheetMapper._split_append_response(
+        resp=resp, sizes=sizes
+    )
+    assert [part["updates"]["updatedRange"] for part in parts] == want_ranges
+    assert [part["updates"]["updatedRows"] for part in parts] == sizes
+    for part in parts:
+        assert part["spreadsheetId"] == "s"
+        assert part["tableRange"] == "'tab'!A1:G4"
+        assert part["updates"]["updatedColumns"] == 7
+
+
+def test_split_append_response_bad_range():
+    "Tests that an updatedRange that can't be split is an error"
+    with pytest.raises(ValueError):
+        google_sheets_gateway.GoogleSheetMapper._split_append_response(
+            resp={"updates": {"updatedRange": "tab"}}, sizes=[1]
+        )
+
+
+APPEND_ERROR = RuntimeError("append failed")
+
+
+@pytest.mark.parametrize(
+    ("name", "native_result", "want"),
+    (
+        ("Response is split between callers",
+         ({"updates": {"updatedRange": "'tab'!A2:B4"}}, None),
+         [("'tab'!A2:B3", None), ("'tab'!A4:B4", None)]),
+        ("Returned error goes to every caller", (None, APPEND_ERROR),
+         [(None, APPEND_ERROR), (None, APPEND_ERROR)]),
+        ("Raised error goes to every caller", APPEND_ERROR,
+         [(None, APPEND_ERROR), (None, APPEND_ERROR)])
+    )
+)
+def test_append_data_coalesced_fan_out(clock, gateway, name, native_result,
+                                       want):
+    "Tests results every caller of a coalesced append gets back"
+    gateway.append_data_native = mock.AsyncMock(side_effect=[native_result])
+
+    async def run():
+        return await asyncio.gather(*(
+            gateway.append_data_coalesced(
+                sheet_id="s", tab_name="tab", data=pl.DataFrame({"a": rows}),
+                row_limit=10
+            ) for rows in ([1, 2], [3])
+        ))
+    results = asyncio.run(clock.run(run()))
+    assert gateway.append_data_native.await_count == 1
+    sent = gateway.append_data_native.await_args.kwargs["data"]
+    assert sent["a"].to_list() == [1, 2, 3]
+    assert [
+        (resp and resp["updates"]["updatedRange"], e) for resp, e in results
+    ] == want
+
+
+def test_coalesced_flushes_do_not_overlap(clock, gateway):
+    "Tests that a tab gets one batch at a time & late rows join the next one"
+    in_flight, peak, sent = 0, 0, []
+
+    async def append_data_native(data, **kwargs):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        sent.append((clock.now, data["a"].to_list()))
+        await asyncio.sleep(1)
+        in_flight -= 1
+        return None, APPEND_ERROR
+    gateway.append_data_native = append_data_native
+
+    async def append(delay: float, rows: list):
+        await asyncio.sleep(delay)
+        return await gateway.append_data_coalesced(
+            sheet_id="s", tab_name="tab", data=pl.DataFrame({"a": rows}),
+            row_limit=10
+        )
+
+    async def run():
+        # 2nd batch opens at 0.6 while the 1st one is sent from 0.5 to 1.5
+        await asyncio.gather(append(0, [1]), append(0.6, [2]),
+                             append(1.2, [3]))
+    asyncio.run(clock.run(run()))
+    assert peak == 1
+    assert sent == [(0.5, [1]), (1.5, [2, 3])]
+    assert gateway._append_locks == {}
+    assert gateway._pending_appends == {}
+
+
+def _tab_properties(rows: int) -> dict:
+    "Properties of tab with a grid of rows x 2"
+    return {"sheetId": 7, "title": "tab", "index": 0,
+            "gridProperties": {"rowCount": rows, "columnCount": 2}}
+
+
+@pytest.mark.parametrize(
+    ("name", "operation", "want_grid", "want_expansion"),
+    (
+        ("Deleted rows shrink the grid",
+         ("delete_rows", {"end": 6}), 5, 7),
+        ("Appended rows grow the grid",
+         ("append_data_native", {"data": pl.DataFrame({"a": [1, 2, 3]}),
+                                 "row_limit": 100}), 13, 0),
+        ("Trim & append grows the trimmed grid to fit appended rows",
+         ("append_data_native", {"data": pl.DataFrame({"a": [1, 2, 3]}),
+                                 "row_limit": 5}), 6, 6)
+    )
+)
+def test_paste_sizes_grid_after_row_changes(gateway, name, operation,
+                                            want_grid, want_expansion):
+    "Tests that row changes resize the cached grid instead of dropping it"
+    bodies, gets = [], []
+    gateway.sheet_service = mock.Mock()
+    gateway.sheet_service.spreadsheets.get.return_value = "get"
+    gateway.sheet_service.spreadsheets.batchUpdate.side_effect = \
+        lambda **kwargs: kwargs["json"]
+    gateway.sheet_service.spreadsheets.values.append.return_value = "append"
+
+    async def request_wrapper(req, **kwargs):
+        if req == "get":
+            gets.append(req)
+            return {"sheets": [{"properties": _tab_properties(10)}]}, None
+        if req == "append":
+            return {"updates": {"updatedRange": "'tab'!A11:A13",
+                                "updatedRows": 3}}, None
+        bodies.append(req)
+        return {"replies": []}, None
+    gateway._request_wrapper = request_wrapper
+
+    async def run():
+        await gateway.get_tab_properties(sheet_id="s")
+        gateway._set_row_count(sheet_id="s", tab_name="tab", rows=10)
+        method, kwargs = operation
+        _, e = await getattr(gateway, method)(sheet_id="s", tab_name="tab",
+                                              **kwargs)
+        assert e is None
+        tabs, _ = await gateway.get_tab_properties(sheet_id="s")
+        assert tabs["tab"]["gridProperties"]["rowCount"] == want_grid
+        bodies.clear()
+        # Header & 11 rows need a grid of 12 rows
+        _, e = await gateway.paste_data(
+            sheet_id="s", tab_name="tab", start_row=1,
+            data=pl.DataFrame({"a": range(11), "b": range(11)})
+        )
+        assert e is None
+    asyncio.run(run())
+    assert len(gets) == 1
+    requests = bodies[0]["requests"]
+    expansion = [req["appendDimension"]["length"] for req in requests
+                 if "appendDimension" in req]
+    assert expansion == ([want_expansion] if want_expansion else [])
+
+
+STALE_TAB_ERROR = aiogoogle.excs.HTTPError(
+    "stale", res=mock.Mock(json={"error": {
+        "code": 400, "message": "No grid with id: 7"
+    }})
+)
+
+
+@pytest.mark.parametrize(
+    ("name", "operation"),
+    (
+        ("Deleting rows of a stale tab",
+         ("delete_rows", {"end": 6})),
+        ("Trim & append to a stale tab",
+         ("append_data_native", {"data": pl.DataFrame({"a": [1, 2, 3]}),
+                                 "row_limit": 5}))
+    )
+)
+def test_stale_tab_error_drops_tab_properties(gateway, name, operation):
+    "Tests that a 400 on a stale tab id drops cached tab properties"
+    gateway.sheet_service = mock.Mock()
+    gateway.sheet_service.spreadsheets.get.return_value = "get"
+
+    async def request_wrapper(req, **kwargs):
+        if req == "get":
+            return {"sheets": [{"properties": _tab_properties(10)}]}, None
+        return None, STALE_TAB_ERROR
+    gateway._request_wrapper = request_wrapper
+
+    async def run():
+        await gateway.get_tab_properties(sheet_id="s")
+        gateway._set_row_count(sheet_id="s", tab_name="tab", rows=10)
+        method, kwargs = operation
+        return await getattr(gateway, method)(sheet_id="s", tab_name="tab",
+                                              **kwargs)
+    _, e = asyncio.run(run())
+    assert e is STALE_TAB_ERROR
+    assert "s" not in gateway._tab_properties
+
+
+# 'tab'!A5:B or 'tab'!A:ZZ, row numbers are optional
+SHEET_RANGE_PATTERN = re.compile(
+    r"^'(?P<tab>(?:[^']|'')*)'!(?P<start_col>[A-Z]+)(?P<start_row>\d*)"
+    r"(?::(?P<end_col>[A-Z]+)(?P<end_row>\d*))?$"
+)
+
+
+def _col_to_num(col: str) -> int:
+    "Converts column letters to a 1-based column number"
+    num = 0
+    for char in col:
+        num = num * 26 + ord(char) - ord("A") + 1
+    return num
+
+
+class FakeSheet:
+    """
+    ### In-memory spreadsheet answering requests sent by the gateway
+    Stands in for __make_request so that everything above it runs.
+    """
+    def __init__(self, tabs: dict):
+        """
+        Instantiates the sheet
+        :param tabs: {tab_name: 2d list of rows}
+        """
+        self.tabs = tabs
+        # (method, request kwargs) of every request, in order
+        self.requests = []
+
+    def service(self) -> mock.Mock:
+        "Sheets service building (method, kwargs) requests"
+        service = mock.Mock()
+        spreadsheets = service.spreadsheets
+        values = spreadsheets.values
+        for method, func in (("get", spreadsheets.get),
+                             ("batchUpdate", spreadsheets.batchUpdate),
+                             ("values.get", values.get),
+                             ("values.batchGet", values.batchGet),
+                             ("values.append", values.append)):
+            func.side_effect = functools.partial(lambda method, **kwargs:
+                                                 (method, kwargs), method)
+        return service
+
+    def _values(self, sheet_range: str) -> dict:
+        "ValueRange of sheet_range, values are left out when empty"
+        match = SHEET_RANGE_PATTERN.match(sheet_range)
+        rows = self.tabs[match.group("tab").replace("''", "'")]
+        start_row = int(match.group("start_row") or 1)
+        end_row = match.group("end_row")
+        if match.group("end_col") is None:
+            # Single cell
+            end_row = match.group("start_row")
+        end_row = int(end_row or len(rows))
+        start_col = _col_to_num(match.group("start_col"))
+        end_col = _col_to_num(match.group("end_col")
+                              or match.group("start_col"))
+        values = [row[start_col - 1:end_col]
+                  for row in rows[start_row - 1:end_row]]
+        value_range = {"range": sheet_range}
+        if values:
+            value_range["values"] = values
+        return value_range
+
+    async def make_request(self, req: tuple, **kwargs) -> dict:
+        "Replaces __make_request"
+        self.requests.append(req)
+        method, req_kwargs = req
+        if method == "get":
+            return {"sheets": [
+                {"properties": {"sheetId": index, "title": title,
+                                "index": index,
+                                "gridProperties": {"rowCount": 10,
+                                                   "columnCount": 2}}}
+                for index, title in enumerate(self.tabs)
+            ]}
+        if method == "values.get":
+            return self._values(sheet_range=req_kwargs["range"])
+        if method == "values.batchGet":
+            return {"valueRanges": [self._values(sheet_range=sheet_range)
+                                    for sheet_range in req_kwargs["ranges"]]}
+        if method == "values.append":
+            return self._append(sheet_range=req_kwargs["range"],
+                                rows=req_kwargs["json"]["values"])
+        return {"replies": []}
+
+    def _append(self, sheet_range: str, rows: list) -> dict:
+        "Adds rows to the end of a tab, responds like values.append"
+        tab = SHEET_RANGE_PATTERN.match(sheet_range).group("tab")
+        tab_rows = self.tabs[tab.replace("''", "'")]
+        tab_rows.extend(rows)
+        return {"updates": {
+            "updatedRange": (f"'{tab}'!A{len(tab_rows) - len(rows) + 1}:"
+                             f"B{len(tab_rows)}"),
+            "updatedRows": len(rows)
+        }}
+
+    def ranges(self) -> list:
+        "Ranges read by values requests, in order"
+        ranges = []
+        for method, req_kwargs in self.requests:
+            if method == "values.get":
+                ranges.append(req_kwargs["range"])
+            elif method == "values.batchGet":
+                ranges.append(req_kwargs["ranges"])
+        return ranges
+
+
+HEADER = ["h1", "h2"]
+DATA_ROWS = [[f"a{num}", f"b{num}"] for num in range(1, 6)]
+
+
+@pytest.fixture
+def sheet(gateway):
+    "FakeSheet behind the gateway with a tab of a header & 5 rows"
+    fake_sheet = FakeSheet(tabs={"tab": [HEADER] + DATA_ROWS,
+                                 "empty": [],
+                                 "titled": [["Title"], HEADER] + DATA_ROWS})
+    gateway.sheet_service = fake_sheet.service()
+    with mock.patch.object(gateway, "_GoogleSheetAsyncGateway__make_request",
+                           fake_sheet.make_request):
+        yield fake_sheet
+
+
+@pytest.mark.parametrize(
+    ("name", "tab_name", "read_kwargs", "want_rows", "want_ranges"),
+    (
+        ("Whole tab", "tab", {}, DATA_ROWS, ["'tab'!A:ZZ"]),
+        ("Header only", "tab", {"header_only": True}, [],
+         ["'tab'!A1:ZZ1"]),
+        ("Rows below the header get the header in the same request", "tab",
+         {"start_row": 3, "end_row": 4}, DATA_ROWS[1:3],
+         [["'tab'!A1:ZZ1", "'tab'!A3:ZZ4"]]),
+        ("Rows from the header", "tab", {"start_row": 1, "end_row": 2},
+         DATA_ROWS[:1], ["'tab'!A1:ZZ2"]),
+        ("Columns", "tab", {"start_col": 2, "end_col": 2},
+         [row[1:] for row in DATA_ROWS], ["'tab'!B:B"]),
+        ("Last rows", "tab", {"last_n_rows": 2}, DATA_ROWS[-2:],
+         ["'tab'!A:A", ["'tab'!A1:ZZ1", "'tab'!A5:ZZ6"]]),
+        ("Last rows more than the tab has", "tab", {"last_n_rows": 10},
+         DATA_ROWS, ["'tab'!A:A", ["'tab'!A1:ZZ1", "'tab'!A2:ZZ6"]]),
+        ("No last rows", "tab", {"last_n_rows": 0}, [],
+         ["'tab'!A:A", ["'tab'!A1:ZZ1"]]),
+        ("Header in the 2nd row", "titled", {"header_rownum": 2},
+         DATA_ROWS, ["'titled'!A:ZZ"]),
+        ("Header in the 2nd row with row bounds", "titled",
+         {"header_rownum": 2, "start_row": 2, "end_row": 4},
+         DATA_ROWS[:2], ["'titled'!A2:ZZ4"]),
+        ("Last rows under a header in the 2nd row", "titled",
+         {"header_rownum": 2, "last_n_rows": 10}, DATA_ROWS,
+         ["'titled'!A:A", ["'titled'!A2:ZZ2", "'titled'!A3:ZZ7"]]),
+        ("Header offset skips rows after the header", "tab",
+         {"header_offset": 2}, DATA_ROWS[2:], ["'tab'!A:ZZ"])
+    )
+)
+def test_read_sheet(gateway, sheet, name, tab_name, read_kwargs, want_rows,
+                    want_ranges):
+    "Tests rows read_sheet returns & ranges it reads"
+    rows, e = asyncio.run(gateway.read_sheet(sheet_id="s", tab_name=tab_name,
+                                             **read_kwargs))
+    assert e is None
+    want_header = HEADER
+    if "start_col" in read_kwargs:
+        want_header = HEADER[1:]
+    assert rows == [want_header] + want_rows
+    assert sheet.ranges() == want_ranges
+
+
+def test_read_sheet_empty_tab(gateway, sheet):
+    "Tests that a tab without a header row is an error"
+    rows, e = asyncio.run(gateway.read_sheet(sheet_id="s", tab_name="empty"))
+    assert rows is None
+    assert isinstance(e, ValueError)
+
+
+def test_read_sheet_as_df(gateway, sheet):
+    "Tests that untyped dfs have the header as columns"
+    df, e = asyncio.run(gateway.read_sheet(sheet_id="s", tab_name="tab",
+                                           as_df=True, last_n_rows=1))
+    assert e is None
+    assert df.columns == HEADER
+    assert df.rows() == [tuple(DATA_ROWS[-1])]
+
+
+@pytest.mark.parametrize(
+    ("name", "ranges", "want"),
+    (
+        ("Ranges of different tabs",
+         {"first": "'tab'!A2:B2", "title": "'titled'!A1"},
+         {"first": [DATA_ROWS[0]], "title": [["Title"]]}),
+        ("Empty range", {"nothing": "'empty'!A1:B2"}, {"nothing": []})
+    )
+)
+def test_read_ranges(gateway, sheet, name, ranges, want):
+    "Tests that read_ranges reads all ranges in one request"
+    values, e = asyncio.run(gateway.read_ranges(sheet_id="s", ranges=ranges))
+    assert e is None
+    assert values == want
+    assert sheet.ranges() == [list(ranges.values())]
+
+
+def test_read_ranges_missing_range(gateway, sheet):
+    "Tests that a response with fewer ranges than asked for is an error"
+    async def make_request(req, **kwargs):
+        return {"valueRanges": []}
+    with mock.patch.object(gateway, "_GoogleSheetAsyncGateway__make_request",
+                           make_request):
+        values, e = asyncio.run(gateway.read_ranges(
+            sheet_id="s", ranges={"first": "'tab'!A1"}
+        ))
+    assert values is None
+    assert isinstance(e, ValueError)
+
+
+@pytest.mark.parametrize(
+    ("name", "tab_name", "chunk_kwargs", "want_sizes", "want_ranges"),
+    (
+        ("Last chunk is not full", "tab", {"chunk_rows": 2}, [2, 2, 1],
+         ["'tab'!A2:B3", "'tab'!A4:B5", "'tab'!A6:B6"]),
+        ("Single chunk", "tab", {"chunk_rows": 10}, [5], ["'tab'!A2:B6"]),
+        ("Chunks of full size only", "tab",
+         {"chunk_rows": 2, "header_offset": 1}, [2, 2],
+         ["'tab'!A3:B4", "'tab'!A5:B6"]),
+        ("Header in the 2nd row", "titled",
+         {"chunk_rows": 3, "header_rownum": 2}, [3, 2],
+         ["'titled'!A3:B5", "'titled'!A6:B7"])
+    )
+)
+def test_iter_sheet_chunks(gateway, sheet, name, tab_name, chunk_kwargs,
+                           want_sizes, want_ranges):
+    "Tests chunks iter_sheet_chunks yields & ranges it reads"
+    async def run():
+        return [chunk async for chunk in gateway.iter_sheet_chunks(
+            sheet_id="s", tab_name=tab_name, **chunk_kwargs
+        )]
+    chunks = asyncio.run(run())
+    assert [e for _, e in chunks] == [None] * len(want_sizes)
+    assert [len(df) for df, _ in chunks] == want_sizes
+    for df, _ in chunks:
+        assert df.columns == HEADER
+    # Header & row count are read first
+    assert sheet.ranges()[2:] == want_ranges
+
+
+def test_read_sheet_chunked(gateway, sheet):
+    "Tests that chunks add up to the whole tab"
+    df, e = asyncio.run(gateway.read_sheet_chunked(sheet_id="s",
+                                                   tab_name="tab",
+                                                   chunk_rows=2))
+    assert e is None
+    assert df.columns == HEADER
+    assert [list(row) for row in df.rows()] == DATA_ROWS
+
+
+def test_read_sheet_chunked_header_only_tab(gateway, sheet):
+    "Tests that a tab with a header only gives an empty df"
+    sheet.tabs["tab"] = [HEADER]
+    df, e = asyncio.run(gateway.read_sheet_chunked(sheet_id="s",
+                                                   tab_name="tab",
+                                                   chunk_rows=2))
+    assert e is None
+    assert df.columns == HEADER
+    assert df.is_empty()
+
+
+@pytest.mark.parametrize(
+    ("name", "paste_kwargs", "want_chunks"),
+    (
+        # (first row index, number of rows, clears below)
+        ("First chunk has the header", {"chunk_rows": 2},
+         [(0, 3, True), (3, 2, False), (5, 1, False)]),
+        ("No header", {"chunk_rows": 2, "include_header": False},
+         [(0, 2, True), (2, 2, False), (4, 1, False)]),
+        ("Pasting below the first row", {"chunk_rows": 4, "start_row": 3},
+         [(2, 5, True), (7, 1, False)]),
+        ("Single chunk", {"chunk_rows": 10}, [(0, 6, True)])
+    )
+)
+def test_paste_data_chunks(gateway, sheet, name, paste_kwargs, want_chunks):
+    "Tests updateCells requests paste_data splits data to"
+    paste_kwargs = {"start_row": 1, **paste_kwargs}
+    data = pl.DataFrame({"h1": [row[0] for row in DATA_ROWS],
+                         "h2": [row[1] for row in DATA_ROWS]})
+    resps, e = asyncio.run(gateway.paste_data(sheet_id="s", tab_name="tab",
+                                              data=data, **paste_kwargs))
+    assert e is None
+    assert len(resps) == len(want_chunks)
+    chunks, pasted = [], []
+    for method, req_kwargs in sheet.requests:
+        if method != "batchUpdate":
+            continue
+        update_cells = req_kwargs["json"]["requests"][-1]["updateCells"]
+        if "range" in update_cells:
+            chunk = (update_cells["range"]["startRowIndex"], True)
+        else:
+            chunk = (update_cells["start"]["rowIndex"], False)
+        chunks.append((chunk[0], len(update_cells["rows"]), chunk[1]))
+        pasted.extend(
+            [cell["userEnteredValue"]["stringValue"]
+             for cell in row["values"]] for row in update_cells["rows"]
+        )
+    assert sorted(chunks) == want_chunks
+    want_pasted = DATA_ROWS
+    if paste_kwargs.get("include_header", True):
+        want_pasted = [HEADER] + DATA_ROWS
+    assert sorted(pasted) == sorted(want_pasted)
+
+
+def test_trim_and_append_after_append_is_one_request(gateway, sheet):
+    "Tests that an append keeps the tab id cached for the next rotation"
+    async def run():
+        await gateway.get_tab_properties(sheet_id="s")
+        _, e = await gateway.append_data_native(
+            sheet_id="s", tab_name="tab", data=pl.DataFrame({"a": [1, 2]}),
+            row_limit=100
+        )
+        assert e is None
+        sheet.requests.clear()
+        # 7 data rows & 3 new ones are over the limit of 7
+        return await gateway.append_data_native(
+            sheet_id="s", tab_name="tab",
+            data=pl.DataFrame({"a": [3, 4, 5]}), row_limit=7
+        )
+    resp, e = asyncio.run(run())
+    assert e is None
+    assert [method for method, _ in sheet.requests] == ["batchUpdate"]
+    requests = sheet.requests[0][1]["json"]["requests"]
+    assert [list(req) for req in requests] == [["deleteDimension"],
+                                               ["appendCells"]]
+    assert resp["updates"]["updatedRange"] == "'tab'!A6:A8"
+
+
+class FakeTimer:
+    "Timer of the row count cache moved by tests"
+    def __init__(self):
+        "Starts the timer at 0"
+        self.now = 0.
+
+    def __call__(self) -> float:
+        "Returns current time"
+        return self.now
+
+
+ROW_COUNT_TTL = 60
+
+
+@pytest.fixture
+def timer(gateway):
+    "Replaces the row count cache of gateway with one using a FakeTimer"
+    fake_timer = FakeTimer()
+    gateway._row_counts = cachetools.TTLCache(maxsize=10, ttl=ROW_COUNT_TTL,
+                                              timer=fake_timer)
+    return fake_timer
+
+
+@pytest.mark.parametrize(
+    ("name", "cached", "seconds", "want_rows", "want_ranges"),
+    (
+        ("Cache hit sends no request", 3, 0, 3, []),
+        ("Cache miss reads the first column", None, 0, 6, ["'tab'!A:A"]),
+        ("Expired count is reconciled with the sheet", 3, ROW_COUNT_TTL + 1,
+         6, ["'tab'!A:A"])
+    )
+)
+def test_get_row_count(gateway, sheet, timer, name, cached, seconds,
+                       want_rows, want_ranges):
+    "Tests when get_row_count reads the sheet"
+    if cached is not None:
+        gateway._set_row_count(sheet_id="s", tab_name="tab", rows=cached)
+    timer.now += seconds
+    rows, e = asyncio.run(gateway.get_row_count(sheet_id="s",
+                                                tab_name="tab"))
+    assert e is None
+    assert rows == want_rows
+    assert sheet.ranges() == want_ranges
+
+
+def test_get_row_count_cached_after_read(gateway, sheet, timer):
+    "Tests that a reconciled row count serves the next calls"
+    async def run():
+        return [await gateway.get_row_count(sheet_id="s", tab_name="tab")
+                for _ in range(2)]
+    assert asyncio.run(run()) == [(6, None), (6, None)]
+    assert sheet.ranges() == ["'tab'!A:A"]
+
+
+@pytest.mark.parametrize(
+    ("name", "resp", "e", "want_rows"),
+    (
+        ("Last row of updatedRange",
+         {"updates": {"updatedRange": "'tab'!A7:B9"}}, None, 9),
+        ("Failed append drops the count", None, APPEND_ERROR, None),
+        ("Response without updates drops the count", {}, None, None)
+    )
+)
+def test_update_row_count_from_append(gateway, name, resp, e, want_rows):
+    "Tests row count kept after an append"
+    gateway._set_row_count(sheet_id="s", tab_name="tab", rows=6)
+    gateway._update_row_count_from_append(sheet_id="s", tab_name="tab",
+                                          resp=resp, e=e)
+    assert gateway._row_counts.get(("s", "tab"), None) == want_rows
+
+
+def test_append_updates_row_count(gateway, sheet, timer):
+    "Tests that the row count after an append is known without a read"
+    async def run():
+        _, e = await gateway.append_data_native(
+            sheet_id="s", tab_name="tab", data=pl.DataFrame({"a": [1, 2]}),
+            row_limit=100
+        )
+        assert e is None
+        sheet.requests.clear()
+        return await gateway.get_row_count(sheet_id="s", tab_name="tab")
+    assert asyncio.run(run()) == (8, None)
+    assert sheet.requests == []
@@ -0,0 +1,111 @@
+"""
+Implements tests for alfredo_lib.local_persistence.async_cache module
+"""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from alfredo_lib.local_persistence import async_cache, cache
+
+REG_DATA = {"username": "user1", "discord_id": 1, "currency": "EUR"}
+
+
+@pytest.fixture
+def caches(tmp_path):
+    "Sync & async caches over two sqlite dbs, each with user 1 registered"
+    sync_cache = cache.Cache(db_path=str(tmp_path / "sync.sqlite"))
+    async_lc = async_cache.AsyncCache(
+        local_cache=cache.Cache(db_path=str(tmp_path / "async.sqlite"))
+    )
+    for local_cache in (sync_cache, async_lc.lc):
+        _, e = local_cache.create_user(reg_data=REG_DATA)
+        assert e is None
+    yield sync_cache, async_lc
+    async_lc.shutdown()
+
+
+def _comparable(result):
+    "Swaps errors for their types & drops timestamps, both differ per cache"
+    if isinstance(result, tuple):
+        return tuple(_comparable(value) for value in result)
+    if isinstance(result, Exception):
+        return type(result)
+    if isinstance(result, dict):
+        return {key: value for key, value in result.items()
+                if key != "created"}
+    return result
+
+
+@pytest.mark.parametrize(
+    ("name", "method", "kwargs"),
+    (
+        ("Registering", "create_user",
+         {"reg_data": {**REG_DATA, "username": "user2", "discord_id": 2}}),
+        ("Registering twice", "create_user", {"reg_data": REG_DATA}),
+        ("Parsed user", "get_user",
+         {"discord_id": 1, "parse_mode": cache.ROW_PARSE_MODE_DICT}),
+        ("Unknown user", "get_user", {"discord_id": 2}),
+        ("Updating a user", "update_user_data",
+         {"discord_id": 1, "user_update": {"currency": "USD"}}),
+        ("Creating a category", "create_category",
+         {"category_data": {"category_name": "food"}}),
+        ("Categories from the registry", "get_categories",
+         {"parse_mode": cache.ROW_PARSE_MODE_STRING}),
+        ("No due outbox items", "get_due_outbox_items", {"limit": 5})
+    )
+)
+def test_async_cache_mirrors_cache(caches, name, method, kwargs):
+    "Tests that AsyncCache returns what the same Cache call returns"
+    sync_cache, async_lc = caches
+    want = getattr(sync_cache, method)(**kwargs)
+    got = asyncio.run(getattr(async_lc, method)(**kwargs))
+    assert _comparable(got) == _comparable(want)
+
+
+def test_async_cache_runs_on_executor(caches):
+    "Tests that db calls leave the event loop thread"
+    _, async_lc = caches
+    threads = []
+    get_user = async_lc.lc.get_user
+
+    def recording_get_user(**kwargs):
+        threads.append(threading.current_thread())
+        return get_user(**kwargs)
+    async_lc.lc.get_user = recording_get_user
+
+    async def run():
+        loop_thread = threading.current_thread()
+        user, e = await async_lc.get_user(discord_id=1)
+        return loop_thread, user, e
+    loop_thread, user, e = asyncio.run(run())
+    assert e is None
+    assert user.discord_id == 1
+    assert len(threads) == 1
+    assert threads[0] is not loop_thread
+    assert threads[0].name.startswith("alfredo_db")
+
+
+def test_async_cache_shutdown_waits(caches):
+    "Tests that shutdown returns only once pending db calls are done"
+    _, async_lc = caches
+    started, finished = threading.Event(), []
+
+    def slow_update(**kwargs):
+        started.set()
+        time.sleep(0.1)
+        finished.append(kwargs["discord_id"])
+
+    async_lc.lc.update_user_data = slow_update
+
+    async def run():
+        task = asyncio.create_task(async_lc.update_user_data(
+            discord_id=1, user_update={"currency": "USD"}
+        ))
+        # Waiting for the call to reach the executor
+        await asyncio.get_running_loop().run_in_executor(None, started.wait)
+        async_lc.shutdown()
+        assert finished == [1]
+        await task
+    asyncio.run(run())
@@ -0,0 +1,377 @@
+"""
+Implements tests for alfredo_lib.local_persistence.cache module
+"""
+import logging
+from typing import Optional
+
+import cachetools
+import pytest
+from sqlalchemy import event
+
+from alfredo_lib.local_persistence import cache, models
+
+TTL = 300
+
+
+class FakeTimer:
+    "Timer of the user cache moved by tests"
+    def __init__(self):
+        "Starts the timer at 0"
+        self.now = 0.
+
+    def __call__(self) -> float:
+        "Returns current time"
+        return self.now
+
+
+@pytest.fixture
+def local_cache(tmp_path):
+    "Cache over an empty sqlite db in tmp_path"
+    return cache.Cache(db_path=str(tmp_path / "test.sqlite"))
+
+
+@pytest.fixture
+def timer(local_cache):
+    "Replaces the user cache of local_cache with one using a FakeTimer"
+    fake_timer = FakeTimer()
+    local_cache._user_cache = cachetools.TTLCache(maxsize=10, ttl=TTL,
+                                                  timer=fake_timer)
+    return fake_timer
+
+
+def _register(local_cache: cache.Cache, discord_id: int = 1,
+              currency: str = "EUR"):
+    "Creates a user with discord_id"
+    _, e = local_cache.create_user(reg_data={
+        "username": f"user{discord_id}", "discord_id": discord_id,
+        "currency": currency
+    })
+    assert e is None
+
+
+def _update_behind_cache(local_cache: cache.Cache, currency: str):
+    "Changes currency of user 1 without going through the cache"
+    with local_cache.session_factory() as sesh:
+        sesh.query(models.User).filter(models.User.discord_id == 1).update(
+            {"currency": currency}
+        )
+        sesh.commit()
+
+
+def test_get_user_returns_copies(local_cache, timer):
+    "Tests that changing a returned user changes neither cache nor others"
+    _register(local_cache)
+    first, _ = local_cache.get_user(discord_id=1)
+    first.currency = "USD"
+    second, _ = local_cache.get_user(discord_id=1)
+    third, _ = local_cache.get_user(discord_id=1)
+    assert second.currency == "EUR"
+    assert second is not third
+    assert local_cache.user_cache_stats()["hits"] == 2
+
+
+@pytest.mark.parametrize(
+    ("name", "seconds", "want_currency"),
+    (
+        ("Cached user is served within ttl", TTL - 1, "EUR"),
+        ("Expired user is read again", TTL + 1, "USD")
+    )
+)
+def test_user_cache_ttl(local_cache, timer, name, seconds, want_currency):
+    "Tests that cached users expire after ttl"
+    _register(local_cache)
+    local_cache.get_user(discord_id=1)
+    _update_behind_cache(local_cache, currency="USD")
+    timer.now += seconds
+    user, _ = local_cache.get_user(discord_id=1)
+    assert user.currency == want_currency
+
+
+def _update(local_cache: cache.Cache, user: models.User):
+    "Updates currency through the cache"
+    e = local_cache.update_user_data(discord_id=1,
+                                     user_update={"currency": "USD"})
+    assert e is None
+
+
+def _delete(local_cache: cache.Cache, user: models.User):
+    "Deletes the user through the cache"
+    assert local_cache.delete_row(row_struct=user) is None
+
+
+def _re_register(local_cache: cache.Cache, user: models.User):
+    "Deletes the user behind the cache & registers it again"
+    with local_cache.session_factory() as sesh:
+        sesh.query(models.User).filter(models.User.discord_id == 1).delete()
+        sesh.commit()
+    _register(local_cache, currency="USD")
+
+
+@pytest.mark.parametrize(
+    ("name", "write", "want_currency"),
+    (
+        ("Update", _update, "USD"),
+        ("Delete", _delete, None),
+        ("Create", _re_register, "USD")
+    )
+)
+def test_user_cache_invalidation(local_cache, timer, name, write,
+                                 want_currency):
+    "Tests that user writes are seen by the next read"
+    _register(local_cache)
+    user, _ = local_cache.get_user(discord_id=1)
+    write(local_cache, user)
+    user, e = local_cache.get_user(discord_id=1)
+    if want_currency is None:
+        assert user is None
+        assert e is not None
+    else:
+        assert user.currency == want_currency
+    assert local_cache.user_cache_stats()["hits"] == 0
+
+
+@pytest.mark.parametrize(
+    ("name", "lookups", "want"),
+    (
+        ("No lookups", [], {"hits": 0, "misses": 0, "hit_ratio": 0.,
+                            "size": 0}),
+        ("Unknown user is not cached", [2, 2],
+         {"hits": 0, "misses": 2, "hit_ratio": 0., "size": 0}),
+        ("Repeated lookups hit", [1, 1, 1, 2],
+         {"hits": 2, "misses": 2, "hit_ratio": 0.5, "size": 1})
+    )
+)
+def test_user_cache_stats(local_cache, timer, name, lookups, want):
+    "Tests hit & miss counters of the user cache"
+    _register(local_cache)
+    for discord_id in lookups:
+        local_cache.get_user(discord_id=discord_id)
+    assert local_cache.user_cache_stats() == want
+
+
+@pytest.mark.parametrize(
+    ("name", "table_attr", "row_kwargs", "want_attrs"),
+    (
+        ("User", "users_table",
+         {"username": "bob", "discord_id": 7, "currency": "EUR"},
+         {"username": "bob", "discord_id": 7, "currency": "EUR"}),
+        ("Category", "categories_table", {"category_name": "food"},
+         {"category_name": "food"})
+    )
+)
+def test_rows_usable_after_commit(local_cache, name, table_attr, row_kwargs,
+                                  want_attrs):
+    "Tests that rows can be read once the session that saved them is closed"
+    row, e = local_cache._construct_table_row(dst_attr_name=table_attr,
+                                              **row_kwargs)
+    assert e is None
+    assert local_cache._add_new_row(row_struct=row) is None
+    # Primary key is set by the commit & not expired by it
+    primary_key = getattr(row, row.__table__.primary_key.columns[0].name)
+    assert primary_key is not None
+    assert {attr: getattr(row, attr) for attr in want_attrs} == want_attrs
+
+
+def test_fetched_rows_usable_outside_session(local_cache):
+    "Tests that rows fetched in a unit of work are readable after it"
+    local_cache.create_category(category_data={"category_name": "food"})
+    category_id = local_cache.category_registry.rows[0].category_id
+    category = local_cache._fetch_category(category_id=category_id)
+    assert category.category_name == "food"
+    # Deleting goes through a new session
+    assert local_cache.delete_row(row_struct=category) is None
+    assert local_cache._fetch_category(category_id=category_id) is None
+
+
+def test_sessions_do_not_share_state(local_cache):
+    "Tests that a failed unit of work does not break the next one"
+    _register(local_cache)
+    _, e = local_cache.create_user(reg_data={"username": "user1",
+                                             "discord_id": 2})
+    assert e is not None
+    _register(local_cache, discord_id=3)
+    user, e = local_cache.get_user(discord_id=3)
+    assert e is None
+    assert user.username == "user3"
+
+
+def _category_id(local_cache: cache.Cache, category_name: str) -> int:
+    "Looks up id of category_name in the registry"
+    as_dict, _ = local_cache.get_categories(
+        parse_mode=cache.ROW_PARSE_MODE_DICT
+    )
+    return {name: cat_id for cat_id, name in as_dict.items()}[category_name]
+
+
+def _create(local_cache: cache.Cache):
+    "Adds a category"
+    _, e = local_cache.create_category(category_data={"category_name": "fun"})
+    assert e is None
+
+
+def _rename(local_cache: cache.Cache):
+    "Renames a category"
+    e = local_cache.update_category(
+        category_id=_category_id(local_cache, "food"),
+        update={"category_name": "groceries"}
+    )
+    assert e is None
+
+
+def _delete_category(local_cache: cache.Cache):
+    "Deletes a category"
+    category = local_cache._fetch_category(
+        category_id=_category_id(local_cache, "food")
+    )
+    assert local_cache.delete_category(category=category) is None
+
+
+@pytest.mark.parametrize(
+    ("name", "mutation", "want_names"),
+    (
+        ("Create", _create, ["food", "fun", "rent"]),
+        ("Update", _rename, ["groceries", "rent"]),
+        ("Delete", _delete_category, ["rent"])
+    )
+)
+def test_category_registry_refresh(local_cache, name, mutation, want_names):
+    "Tests that category mutations publish a new registry"
+    for category_name in ("food", "rent"):
+        local_cache.create_category(
+            category_data={"category_name": category_name}
+        )
+    registry = local_cache.category_registry
+    mutation(local_cache)
+    new_registry = local_cache.category_registry
+    assert new_registry is not registry
+    assert new_registry.version == registry.version + 1
+    assert sorted(new_registry.as_dict.values()) == want_names
+    assert sorted(label for label, _ in new_registry.button_specs) == \
+        want_names
+    # Old snapshot stays as it was for readers still holding it
+    assert sorted(registry.as_dict.values()) == ["food", "rent"]
+
+
+def test_category_registry_empty(local_cache):
+    "Tests that an empty registry is reported as an error"
+    assert local_cache.category_registry.rows == []
+    _, e = local_cache.get_categories()
+    assert isinstance(e, ValueError)
+    _, e = local_cache.get_category_buttons()
+    assert isinstance(e, ValueError)
+
+
+def test_category_registry_not_refreshed_on_failed_delete(local_cache):
+    "Tests that a failed delete keeps the registry"
+    _create(local_cache)
+    registry = local_cache.category_registry
+    e = local_cache.delete_category(category=object())
+    assert e is not None
+    assert local_cache.category_registry is registry
+
+
+def _log_record(msg: str, user_id: Optional[int] = None) -> logging.LogRecord:
+    "INFO LogRecord of msg"
+    record = logging.LogRecord(name="test", level=logging.INFO,
+                               pathname=__file__, lineno=1, msg=msg,
+                               args=None, exc_info=None, func="func")
+    if user_id is not None:
+        record.user_id = user_id
+    return record
+
+
+def _log_rows(local_cache: cache.Cache) -> list:
+    "(message, user_id, level, func_name) of logs table rows"
+    with local_cache.session_factory() as sesh:
+        return [
+            (row.message, row.user_id, row.level, row.func_name)
+            for row in sesh.query(models.LogRecord)
+            .order_by(models.LogRecord.internal_id)
+        ]
+
+
+@pytest.mark.parametrize(
+    ("name", "records", "want_rows", "want_statements"),
+    (
+        ("No records, no insert", [], [], []),
+        ("Single record", [_log_record("a", user_id=1)],
+         [("a", 1, "INFO", "func")], [False]),
+        ("Batch goes as one executemany",
+         [_log_record("a"), _log_record("b", user_id=2), _log_record("c")],
+         [("a", None, "INFO", "func"), ("b", 2, "INFO", "func"),
+          ("c", None, "INFO", "func")], [True])
+    )
+)
+def test_add_log_rows(local_cache, name, records, want_rows,
+                      want_statements):
+    "Tests that log records are written with a single insert statement"
+    statements = []
+
+    def record_insert(conn, cursor, statement, parameters, context,
+                      executemany):
+        "Records INSERT statements sent to the db"
+        if statement.startswith("INSERT"):
+            statements.append(executemany)
+    event.listen(local_cache.engine, "before_cursor_execute", record_insert)
+    assert local_cache.add_log_rows(records=records) is None
+    assert statements == want_statements
+    assert _log_rows(local_cache) == want_rows
+
+
+def test_add_log_rows_error(local_cache):
+    "Tests that a failed batch is rolled back & returned"
+    records = [_log_record("a"), _log_record(None)]
+    records[1].funcName = None
+    e = local_cache.add_log_rows(records=records)
+    assert e is not None
+    assert _log_rows(local_cache) == []
+
+
+def _pragmas(db_engine, names: list) -> dict:
+    "Reads PRAGMA values on a new connection of db_engine"
+    with db_engine.connect() as conn:
+        return {name: conn.exec_driver_sql(f"PRAGMA {name}").scalar()
+                for name in names}
+
+
+@pytest.mark.parametrize(
+    ("name", "storage_profile", "want"),
+    (
+        ("sqlite defaults", {},
+         {"journal_mode": "delete", "synchronous": 2}),
+        ("WAL with full sync",
+         {"journal_mode": "WAL", "synchronous": "FULL", "busy_timeout": 5000},
+         {"journal_mode": "wal", "synchronous": 2, "busy_timeout": 5000}),
+        ("WAL with normal sync & bigger caches",
+         {"journal_mode": "WAL", "synchronous": "NORMAL",
+          "mmap_size": 268435456, "cache_size": -16000,
+          "temp_store": "MEMORY"},
+         {"journal_mode": "wal", "synchronous": 1, "mmap_size": 268435456,
+          "cache_size": -16000, "temp_store": 2})
+    )
+)
+def test_storage_profile_applied_on_connect(tmp_path, name, storage_profile,
+                                            want):
+    "Tests that PRAGMAs of the storage profile are set on every connection"
+    local_cache = cache.Cache(db_path=str(tmp_path / "test.sqlite"),
+                              storage_profile=storage_profile)
+    assert _pragmas(local_cache.engine, list(want)) == want
+    # Connections opened after the pool is emptied get them as well
+    local_cache.engine.dispose()
+    assert _pragmas(local_cache.engine, list(want)) == want
+
+
+@pytest.mark.parametrize(
+    ("name", "storage_profile"),
+    (
+        ("Pragma not allowed", {"foreign_keys": "ON"}),
+        ("Value that could inject sql", {"synchronous": "OFF; DROP TABLE x"})
+    )
+)
+def test_bad_storage_profile(tmp_path, name, storage_profile):
+    "Tests that unsupported PRAGMAs & values fail on connect"
+    db_engine = cache.BaseCache._create_engine(
+        db_path=str(tmp_path / "test.sqlite"), storage_profile=storage_profile
+    )
+    with pytest.raises(ValueError):
+        db_engine.connect()
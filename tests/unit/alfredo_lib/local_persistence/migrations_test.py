@@ -0,0 +1,75 @@
+"""
+Implements tests for alfredo_lib.local_persistence.migrations module
+"""
+import pytest
+from sqlalchemy import create_engine
+
+from alfredo_lib.local_persistence import migrations
+
+
+@pytest.fixture
+def db_engine(tmp_path):
+    "Engine of an empty sqlite db with a single table"
+    eng = create_engine(f"sqlite:///{tmp_path / 'test.sqlite'}")
+    with eng.begin() as conn:
+        conn.exec_driver_sql("CREATE TABLE t (a INTEGER, b INTEGER)")
+    return eng
+
+
+def _index_names(eng) -> set:
+    with eng.connect() as conn:
+        rows = conn.exec_driver_sql(
+            "SELECT name FROM sqlite_master WHERE type = 'index'"
+        ).all()
+    return {row[0] for row in rows}
+
+
+MIGRATIONS = [
+    migrations.Migration(
+        version=2, description="second",
+        statements=["CREATE INDEX IF NOT EXISTS ix_t_b ON t (b)"]
+    ),
+    migrations.Migration(
+        version=1, description="first",
+        statements=["CREATE INDEX IF NOT EXISTS ix_t_a ON t (a)"]
+    )
+]
+
+
+def test_apply_runs_pending_in_order(db_engine):
+    "Tests that all migrations are applied and version is recorded"
+    runner = migrations.MigrationRunner(db_engine=db_engine,
+                                        migrations=MIGRATIONS)
+    assert [m.version for m in runner.pending()] == [1, 2]
+    version, e = runner.apply()
+    assert e is None
+    assert version == 2
+    assert runner.current_version() == 2
+    assert {"ix_t_a", "ix_t_b"} <= _index_names(db_engine)
+    assert runner.pending() == []
+
+
+def test_apply_is_noop_when_up_to_date(db_engine):
+    "Tests that a second run does not apply anything"
+    runner = migrations.MigrationRunner(db_engine=db_engine,
+                                        migrations=MIGRATIONS[1:])
+    runner.apply()
+    runner = migrations.MigrationRunner(db_engine=db_engine,
+                                        migrations=MIGRATIONS)
+    assert [m.version for m in runner.pending()] == [2]
+    version, e = runner.apply()
+    assert (version, e) == (2, None)
+
+
+def test_apply_stops_on_error(db_engine):
+    "Tests that a failing migration keeps the previous version"
+    broken = MIGRATIONS + [
+        migrations.Migration(version=3, description="broken",
+                             statements=["CREATE INDEX ix_x ON missing (a)"])
+    ]
+    runner = migrations.MigrationRunner(db_engine=db_engine,
+                                        migrations=broken)
+    version, e = runner.apply()
+    assert e is not None
+    assert version == 2
+    assert runner.current_version() == 2